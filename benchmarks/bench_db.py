@@ -0,0 +1,291 @@
+﻿"""Benchmark of job ad database queries and connection profiles.
+
+For each table size, a database of synthetic job ads spread over two years
+is created, and the queries of the view (:meth:`JobAdDB.get_ads`), train
+(:meth:`JobAdDB.get_classified_ads`) and recomm (:meth:`JobAdDB.get_ads` by
+language) commands are timed both with and without secondary indexes. The
+first and last pages of :meth:`JobAdDB.get_ads_page` are timed against the
+same pages read with OFFSET. Database size and read time of job ads with
+long descriptions are compared with and without compressed descriptions.
+
+For each connection profile of :class:`JobAdDB`, insert and query
+throughput are measured, as well as how long a write waits while another
+connection is reading. Each case is run in a separate process. Run from the
+repository root::
+
+    python -m benchmarks.bench_db -sizes 10000 100000 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import threading
+import time
+
+from jobadcollector.db_controls import JobAdDB
+from jobadcollector.job_ad import JobAd
+
+from .common import peak_rss, run_isolated, write_results
+
+
+# vocabulary of long synthetic descriptions
+WORDS = ("we are looking for an experienced developer to join our team in helsinki "
+         "you will work with python sql and cloud services responsibilities include "
+         "designing building and maintaining data pipelines requirements degree in "
+         "computer science or equivalent experience fluent english finnish is a plus "
+         "we offer competitive salary flexible hours and a great working environment "
+         "apply by sending your cv and cover letter before the deadline").split()
+
+
+def _long_description(rng, i):
+    """Returns a description of about a hundred words, like a full job ad.
+    """
+    sentences = []
+    for k in range(rng.randrange(8, 20)):
+        start = rng.randrange(len(WORDS) - 12)
+        sentences.append(" ".join(WORDS[start:start + rng.randrange(6, 12)]).capitalize())
+    return "Company %d Oy. %s." % (i, ". ".join(sentences))
+
+
+def synthetic_ads(count, days=730, seed=0, long_descriptions=False):
+    """Yields synthetic job ads with dates spread over days before today.
+
+    About half of job ads are in English and one in twenty is classified.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    for i in range(count):
+        relevant = rng.choice([0, 1]) if rng.random() < 0.05 else None
+        description = _long_description(rng, i) if long_descriptions \
+            else "Description of job ad %d" % i
+        yield JobAd.create({"site": rng.choice(["indeed", "monster", "duunitori", "oikotie"]),
+                            "searchterm": "term%d" % rng.randrange(20),
+                            "id": "id%d" % i, "title": "Job title %d" % i,
+                            "url": "http://www.example.fi/%d" % i,
+                            "description": description,
+                            "date": today - datetime.timedelta(rng.randrange(days)),
+                            "language": rng.choice(["English", "Finnish"]),
+                            "relevant": relevant})
+
+
+def _best_time(function, repeat):
+    """Returns best time in seconds of repeat calls and the last result.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def _time_queries(db, repeat):
+    """Returns times in seconds and numbers of results of each query.
+
+    Both the database methods and their SQL queries alone are timed, as
+    creating :class:`JobAd` instances takes a large share of method time.
+    """
+    today = datetime.date.today()
+    week_ago = today - datetime.timedelta(7)
+    year_ago = today - datetime.timedelta(365)
+    queries = {"view_week": (lambda: db.get_ads(week_ago, today),
+                             """SELECT * FROM JobEntries WHERE date >= ? AND date <= ?""",
+                             (week_ago, today)),
+               "recomm_week": (lambda: db.get_ads(week_ago, today, "English"),
+                               """SELECT * FROM JobEntries
+                                  WHERE language = ? AND date >= ? AND date <= ?""",
+                               ("English", week_ago, today)),
+               "train_year": (lambda: db.get_classified_ads(year_ago, today, "English", 1),
+                              """SELECT * FROM JobEntries WHERE relevant IN (0, 1) 
+                                 AND language == ? AND date >= ? AND date <= ?""",
+                              ("English", year_ago, today))}
+    timings = {}
+    for name, (method, sql, parameters) in queries.items():
+        seconds, rows = _best_time(method, repeat)
+        sql_seconds = _best_time(lambda: db._conn.execute(sql, parameters).fetchall(),
+                                 repeat)[0]
+        timings[name] = {"seconds": round(seconds, 6), 
+                         "sql_seconds": round(sql_seconds, 6), "rows": len(rows)}
+
+    return timings
+
+
+def _time_pages(db, repeat, page_size=500):
+    """Returns times in seconds of reading the first and last page of job ads.
+
+    Pages are read with the cursor of :meth:`JobAdDB.get_ads_page` and, for
+    comparison, with OFFSET.
+    """
+    count = db._conn.execute("SELECT COUNT(*) FROM JobEntries").fetchone()[0]
+    last = max(count - page_size, 0)
+    # cursor of last page, i.e. position of the job ad before it
+    position = db._conn.execute("""SELECT date, site, id FROM JobEntries 
+                                   ORDER BY date, site, id LIMIT 1 OFFSET ?""",
+                                (max(last - 1, 0),)).fetchone()
+    cursor = db._encode_cursor(*position)
+    offset_sql = "SELECT * FROM JobEntries ORDER BY date, site, id LIMIT ? OFFSET ?"
+    timings = {}
+    for name, cursor, offset in [("first", None, 0), ("last", cursor, last)]:
+        seconds = _best_time(lambda: db.get_ads_page(None, None, page_size=page_size,
+                                                     cursor=cursor), repeat)[0]
+        offset_seconds = _best_time(lambda: db._conn.execute(
+            offset_sql, (page_size, offset)).fetchall(), repeat)[0]
+        timings[name] = {"seconds": round(seconds, 6),
+                         "offset_sql_seconds": round(offset_seconds, 6)}
+
+    return timings
+
+
+def bench_size(size, repeat):
+    """Times queries on a database of size job ads with and without indexes.
+    """
+    directory = tempfile.mkdtemp()
+    db_name = os.path.join(directory, "bench.db")
+    db = JobAdDB(db_name)
+    start = time.perf_counter()
+    db.store_ads(synthetic_ads(size))
+    store_seconds = time.perf_counter() - start
+    db._conn.execute("ANALYZE;")
+    indexed = _time_queries(db, repeat)
+    pages = _time_pages(db, repeat)
+    for name in db._db_indexes:
+        db._conn.execute("DROP INDEX %s;" % name)
+    unindexed = _time_queries(db, repeat)
+    db._conn.close()
+    os.remove(db_name)
+    os.rmdir(directory)
+
+    return {"name": "size/%d" % size, "rows": size,
+            "store_seconds": round(store_seconds, 4),
+            "indexed": indexed, "unindexed": unindexed, "pages": pages,
+            "peak_rss_kb": peak_rss()}
+
+
+def bench_compression(size, repeat):
+    """Compares database size and read time with and without compression.
+    """
+    directory = tempfile.mkdtemp()
+    db_name = os.path.join(directory, "bench.db")
+    db = JobAdDB(db_name)
+    db.store_ads(synthetic_ads(size, long_descriptions=True))
+    db._conn.execute("VACUUM;")
+    def read():
+        return sum([len(ad["description"]) for ad in db.iter_ads(None, None)])
+    results = {}
+    for codec in [None, "zlib"]:
+        if codec is not None:
+            start = time.perf_counter()
+            db.compress_descriptions(codec)
+            results["compress_seconds"] = round(time.perf_counter() - start, 4)
+        page_count = db._conn.execute("PRAGMA page_count;").fetchone()[0]
+        description_bytes = db._conn.execute("""SELECT SUM(LENGTH(CAST(description
+                                                AS BLOB))) FROM JobEntries""").fetchone()[0]
+        results[codec or "plain"] = {"file_bytes": os.path.getsize(db_name),
+                                     "pages": page_count,
+                                     "description_bytes": description_bytes,
+                                     "read_seconds": round(_best_time(read, repeat)[0], 6)}
+    db.disconnect_db()
+    os.remove(db_name)
+    os.rmdir(directory)
+    results.update({"name": "compression/%d" % size, "rows": size,
+                    "peak_rss_kb": peak_rss()})
+
+    return results
+
+
+def bench_profile(profile, size, repeat, insert_batch=200, read_seconds=0.5):
+    """Measures insert and query throughput and write latency during reads.
+    """
+    directory = tempfile.mkdtemp()
+    db_name = os.path.join(directory, "bench.db")
+    db = JobAdDB(db_name, profile)
+    ads = list(synthetic_ads(size + insert_batch))
+    # a search run stores job ads in many small transactions
+    start = time.perf_counter()
+    for i in range(0, size, insert_batch):
+        db.store_ads(ads[i:i + insert_batch])
+    insert_seconds = time.perf_counter() - start
+    queries = _time_queries(db, repeat)
+    rows = sum([query["rows"] for query in queries.values()])
+    query_seconds = sum([query["seconds"] for query in queries.values()])
+
+    # write while another connection, e.g. an export, is reading
+    reading = threading.Event()
+    def read():
+        reader = JobAdDB(db_name, profile)
+        for i, ad in enumerate(reader.iter_ads(None, None, batch_size=100)):
+            if i == 0:
+                reading.set()
+                time.sleep(read_seconds)
+        reader.disconnect_db()
+    reader = threading.Thread(target=read)
+    reader.start()
+    reading.wait()
+    start = time.perf_counter()
+    db.store_ads(ads[size:])
+    write_wait_seconds = time.perf_counter() - start
+    reader.join()
+    db.disconnect_db()
+    for filename in os.listdir(directory):
+        os.remove(os.path.join(directory, filename))
+    os.rmdir(directory)
+
+    return {"name": "profile/%s" % profile, "rows": size,
+            "inserts_per_sec": round(size / insert_seconds, 2),
+            "query_rows_per_sec": round(rows / query_seconds, 2),
+            "queries": queries,
+            "write_during_read_seconds": round(write_wait_seconds, 4),
+            "peak_rss_kb": peak_rss()}
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=
+        "Benchmarks job ad database queries with and without indexes.")
+    argparser.add_argument("-output", default="bench_db.json",
+        help="""Name of JSON file to write results to, - for standard output.
+                If not provided, bench_db.json is used.""")
+    argparser.add_argument("-sizes", type=int, nargs="+", default=[10000, 100000],
+        help="Numbers of job ads in database.")
+    argparser.add_argument("-repeat", type=int, default=5,
+        help="Number of times each query is run, the best time is reported.")
+    argparser.add_argument("-profiles", nargs="+", default=["default", "performance"],
+        help="Connection profiles of database to compare.")
+    argparser.add_argument("-profile_size", type=int, default=100000,
+        help="Number of job ads inserted when comparing profiles.")
+    args = argparser.parse_args()
+
+    results = [run_isolated(bench_size, size, args.repeat) for size in args.sizes]
+    profile_results = [run_isolated(bench_profile, profile, args.profile_size, args.repeat)
+                       for profile in args.profiles]
+    compression_result = run_isolated(bench_compression, args.profile_size, args.repeat)
+    for result in results:
+        for query in sorted(result["indexed"]):
+            indexed = result["indexed"][query]
+            unindexed = result["unindexed"][query]
+            print("%-14s %-12s %8d rows  indexed %9.2f ms (SQL %8.2f ms)  "
+                  "unindexed %9.2f ms (SQL %8.2f ms)" %
+                  (result["name"], query, indexed["rows"], indexed["seconds"] * 1000,
+                   indexed["sql_seconds"] * 1000, unindexed["seconds"] * 1000,
+                   unindexed["sql_seconds"] * 1000))
+        for page in ["first", "last"]:
+            timing = result["pages"][page]
+            print("%-14s %-12s cursor %9.2f ms  OFFSET (SQL) %9.2f ms" %
+                  (result["name"], "page_" + page, timing["seconds"] * 1000,
+                   timing["offset_sql_seconds"] * 1000))
+    for result in profile_results:
+        print("%-20s %10.0f inserts/s %10.0f query rows/s  write during read %7.3f s" %
+              (result["name"], result["inserts_per_sec"], result["query_rows_per_sec"],
+               result["write_during_read_seconds"]))
+    for codec in ["plain", "zlib"]:
+        result = compression_result[codec]
+        print("%-20s %-5s %10d file bytes %10d description bytes  read %7.3f s" %
+              (compression_result["name"], codec, result["file_bytes"],
+               result["description_bytes"], result["read_seconds"]))
+    write_results("db", results + profile_results + [compression_result], args.output)
+
+
+if __name__ == "__main__":
+    main()
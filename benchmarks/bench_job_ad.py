@@ -0,0 +1,123 @@
+﻿"""Benchmark of memory use and construction time of job ads.
+
+:class:`JobAd` is compared with a plain dictionary and with a dictionary
+subclass checking its keys, like :class:`JobAd` used to be. For each kind,
+job ads are created from database rows, as in :meth:`JobAdDB.get_ads`, and
+from parsed values, as in :meth:`JobAdParser._save_job_ad`. Memory per job
+ad is measured with tracemalloc, excluding the values themselves, which are
+shared by all kinds. Each case is run in a separate process. Run from the
+repository root::
+
+    python -m benchmarks.bench_job_ad -count 100000
+"""
+import argparse
+import datetime
+import time
+import tracemalloc
+
+from jobadcollector.job_ad import JobAd
+
+from .common import peak_rss, run_isolated, write_results
+
+
+class DictJobAd(dict):
+    """Dictionary subclass job ad, for comparison.
+    """
+    _cols = JobAd._cols
+
+    def __init__(self):
+        super().__init__()
+        for key in self._cols:
+            self[key] = None
+        self["date"] = datetime.date.today()
+
+    def __setitem__(self, key, val):
+        if key not in self._cols:
+            raise KeyError("Key not column in JobAd.")
+        return super().__setitem__(key, val)
+
+    @classmethod
+    def create(cls, dictionary):
+        job_ad = cls()
+        for key in dictionary:
+            if key in cls._cols:
+                job_ad[key] = dictionary[key]
+        return job_ad
+
+
+def _rows(count):
+    """Returns database rows of count synthetic job ads.
+    """
+    today = datetime.date.today()
+    return [("site%d" % (i % 4), "term", "id%d" % i, "Job title %d" % i,
+             "http://www.example.fi/%d" % i, "Description of job ad %d" % i,
+             today, "English", None, None, None) for i in range(count)]
+
+
+# functions creating a job ad of a database row, kinds as keys
+FROM_ROW = {"JobAd": JobAd.from_values,
+            "DictJobAd": lambda row: DictJobAd.create(dict(zip(JobAd._cols, row))),
+            "dict": lambda row: dict(zip(JobAd._cols, row))}
+
+# functions creating a job ad of parsed values without a date, kinds as keys
+FROM_PARSED = {"JobAd": JobAd.create, "DictJobAd": DictJobAd.create,
+               "dict": lambda values: dict(dict.fromkeys(JobAd._cols), **values,
+                                           date=datetime.date.today())}
+
+
+def bench_kind(kind, count, repeat):
+    """Measures memory per job ad and construction time of a kind of job ad.
+    """
+    rows = _rows(count)
+    parsed = [dict(zip(["site", "searchterm", "id", "title", "url", "description"], row))
+              for row in rows]
+    from_row = FROM_ROW[kind]
+    from_parsed = FROM_PARSED[kind]
+    timings = {}
+    for name, function, arguments in [("from_row", from_row, rows),
+                                      ("from_parsed", from_parsed, parsed)]:
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            job_ads = [function(argument) for argument in arguments]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            del job_ads
+        timings[name] = round(best / count * 1e6, 3)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    job_ads = [from_row(row) for row in rows]
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return {"name": "job_ad/%s" % kind, "count": count,
+            "bytes_per_ad": round(memory / count, 1),
+            "from_row_us_per_ad": timings["from_row"],
+            "from_parsed_us_per_ad": timings["from_parsed"],
+            "peak_rss_kb": peak_rss()}
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=
+        "Benchmarks memory use and construction time of job ads.")
+    argparser.add_argument("-output", default="bench_job_ad.json",
+        help="""Name of JSON file to write results to, - for standard output.
+                If not provided, bench_job_ad.json is used.""")
+    argparser.add_argument("-count", type=int, default=100000,
+        help="Number of job ads created.")
+    argparser.add_argument("-repeat", type=int, default=5,
+        help="Number of times job ads are created, the best time is reported.")
+    args = argparser.parse_args()
+
+    results = [run_isolated(bench_kind, kind, args.count, args.repeat)
+               for kind in ["JobAd", "DictJobAd", "dict"]]
+    for result in results:
+        print("%-16s %8.1f bytes/ad  from row %7.3f us/ad  from parsed %7.3f us/ad" %
+              (result["name"], result["bytes_per_ad"], result["from_row_us_per_ad"],
+               result["from_parsed_us_per_ad"]))
+    write_results("job_ad", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+﻿"""Throughput benchmark of job ad parsers.
+
+Three kinds of cases are run, each in a separate process:
+
+- parse/<site>: parsing synthetic result pages of a site in memory.
+- search/<site>: searching a local stand-in server with a single parser.
+- collector: end-to-end :meth:`JobAdCollector.start_search` against the
+  stand-in server, storing job ads in a temporary database.
+
+Pages/sec, ads/sec, bytes/sec and peak memory use are reported for each case.
+Run from the repository root::
+
+    python -m benchmarks.bench_parsers -output bench_parsers.json
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from jobadcollector import parsers, fetching, JobAdCollector
+
+from .common import run_isolated, throughput, timed, write_results
+from .standin import StandInServer, result_page, serve_in_thread
+
+
+def _unthrottle():
+    """Lifts rate limits of parsers, the stand-in server needn't be spared.
+    """
+    for parser_class in parsers.site_parsers.values():
+        parser_class.request_rate = 10000.0
+        parser_class.request_burst = 1000
+
+
+def bench_parse(site, pages, ads_per_page):
+    """Parses synthetic result pages of site in memory.
+    """
+    contents = [result_page(site, "analyst", page, ads_per_page)
+                for page in range(pages)]
+    parser_name = parsers.parser_name(parsers.site_parsers[site])
+    results, seconds = timed(lambda: [parsers.parse_page(parser_name, page, "utf-8",
+                                                         "analyst")
+                                      for page in contents])
+
+    return throughput("parse/%s" % site, seconds, pages=pages,
+                      ads=sum([len(ad_tuples) for ad_tuples, known in results]),
+                      bytes=sum([len(page) for page in contents]))
+
+
+def bench_search(site, search_terms, pages, ads_per_page):
+    """Searches stand-in server for all search terms with a parser of site.
+    """
+    _unthrottle()
+
+    async def search():
+        async with StandInServer(pages, ads_per_page) as server:
+            async with fetching.JobAdFetcher(hosts=server.hosts) as fetcher:
+                ps = [parsers.site_parsers[site](fetcher, max_pages=pages + 1)
+                      for search_term in search_terms]
+                await asyncio.gather(*[parser.parse(search_term) for parser, search_term
+                                       in zip(ps, search_terms)])
+            return (server.requests, server.bytes,
+                    sum([len(parser.get_job_ads()) for parser in ps]))
+
+    loop = asyncio.new_event_loop()
+    try:
+        (requests, bytes, ads), seconds = timed(loop.run_until_complete, search())
+    finally:
+        loop.close()
+
+    return throughput("search/%s" % site, seconds, pages=requests, ads=ads,
+                      bytes=bytes)
+
+
+def bench_collector(search_terms, pages, ads_per_page, parse_workers):
+    """Searches stand-in server with :meth:`JobAdCollector.start_search`.
+    """
+    _unthrottle()
+    directory = tempfile.mkdtemp()
+    db_name = os.path.join(directory, "bench.db")
+    with serve_in_thread(StandInServer(pages, ads_per_page)) as server:
+        collector = JobAdCollector(search_terms, db_name, max_pages=pages + 1,
+                                   incremental=False, parse_workers=parse_workers,
+                                   hosts=server.hosts)
+        seconds = timed(collector.start_search)[1]
+    conn = sqlite3.connect(db_name)
+    ads = conn.execute("SELECT COUNT(*) FROM JobEntries").fetchone()[0]
+    conn.close()
+    os.remove(db_name)
+    os.rmdir(directory)
+
+    return throughput("collector", seconds, pages=server.requests, ads=ads,
+                      bytes=server.bytes, parse_workers=parse_workers)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=
+        "Benchmarks parsing and searching of job ad sites offline.")
+    argparser.add_argument("-output", default="bench_parsers.json",
+        help="""Name of JSON file to write results to, - for standard output.
+                If not provided, bench_parsers.json is used.""")
+    argparser.add_argument("-pages", type=int, default=3,
+        help="Number of result pages with job ads per search term.")
+    argparser.add_argument("-ads", type=int, default=50,
+        help="Number of job ads per result page.")
+    argparser.add_argument("-terms", type=int, default=8,
+        help="Number of search terms.")
+    argparser.add_argument("-parse_workers", type=int,
+        help="Number of worker processes for parsing in end-to-end search.")
+    args = argparser.parse_args()
+
+    search_terms = ["term%d" % i for i in range(args.terms)]
+    results = []
+    for site in parsers.JobAdParser.parsers_impl:
+        results.append(run_isolated(bench_parse, site, args.pages * args.terms, args.ads))
+        results.append(run_isolated(bench_search, site, search_terms, args.pages,
+                                    args.ads))
+    results.append(run_isolated(bench_collector, search_terms, args.pages, args.ads,
+                                args.parse_workers))
+    for result in results:
+        print("%-18s %8.1f pages/s %9.1f ads/s %12.0f B/s  peak RSS %s kB" %
+              (result["name"], result["pages_per_sec"], result["ads_per_sec"],
+               result["bytes_per_sec"], result["peak_rss_kb"]))
+    write_results("parsers", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+﻿"""Benchmark of writing job ad reports.
+
+For each number of rows, synthetic job ads with full length descriptions
+are written with :meth:`JobAdDB.write_HTML_file`, with and without gzip
+compression, as a lazily loading page with :meth:`JobAdDB.write_HTML_report`
+and with :meth:`JobAdDB.write_CSV_file`. Job ads are repeated
+from a small pool as they are written, so time is spent writing rather than
+generating job ads, and peak memory use shows whether the writers hold the
+report in memory. Rows/sec, file size and peak memory use are reported for
+each case, each run in a separate process. Run from the repository root::
+
+    python -m benchmarks.bench_report -rows 10000 100000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from jobadcollector.db_controls import JobAdDB
+
+from .bench_db import synthetic_ads
+from .common import peak_rss, run_isolated, write_results
+
+
+# writers of cases, names as keys, and keyword arguments of writers
+WRITERS = {"html": ("write_HTML_file", {}), "html_gzip": ("write_HTML_file", {"compress": True}),
+           "html_paged": ("write_HTML_report", {}), "csv": ("write_CSV_file", {})}
+
+
+def bench_writer(name, rows):
+    """Writes rows synthetic job ads with a writer and measures it.
+    """
+    method, options = WRITERS[name]
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "report")
+    writer = getattr(JobAdDB(""), method)
+    pool = list(synthetic_ads(1000, long_descriptions=True))
+    job_ads = (pool[i % len(pool)] for i in range(rows))
+    start = time.perf_counter()
+    writer(job_ads, filename, **options)
+    seconds = time.perf_counter() - start
+    # size of page, data files of paged reports are not counted
+    size = os.path.getsize(filename)
+    shutil.rmtree(directory)
+
+    return {"name": "%s/%d" % (name, rows), "rows": rows,
+            "seconds": round(seconds, 4), "rows_per_sec": round(rows / seconds, 2),
+            "file_bytes": size, "peak_rss_kb": peak_rss()}
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=
+        "Benchmarks writing job ads to HTML and CSV reports.")
+    argparser.add_argument("-output", default="bench_report.json",
+        help="""Name of JSON file to write results to, - for standard output.
+                If not provided, bench_report.json is used.""")
+    argparser.add_argument("-rows", type=int, nargs="+", default=[10000, 100000],
+        help="Numbers of job ads written.")
+    args = argparser.parse_args()
+
+    results = [run_isolated(bench_writer, name, rows)
+               for rows in args.rows for name in WRITERS]
+    for result in results:
+        print("%-18s %7.3f s %10.0f rows/s %12d bytes  peak RSS %s kB" %
+              (result["name"], result["seconds"], result["rows_per_sec"],
+               result["file_bytes"], result["peak_rss_kb"]))
+    write_results("report", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+﻿"""Helpers shared by benchmarks.
+
+Each benchmark case is run in a separate process with :func:`run_isolated`,
+so that peak memory use is measured for the case alone. Results are written
+as JSON with :func:`write_results`, to be compared across releases.
+"""
+import datetime
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+try:
+    # resource is only available on Unix, peak memory is not reported without it
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Returns peak resident set size of the process and its children.
+
+    Returns
+    ----------
+    peak_rss : int
+        Peak resident set size in kilobytes. None if it can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # reported in bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def throughput(name, seconds, pages=0, ads=0, bytes=0, **extra):
+    """Returns result of benchmark case with rates per second.
+
+    Arguments
+    ----------
+    name : str
+        Name of benchmark case.
+    seconds : float
+        Elapsed time of case.
+    pages : int
+        Number of pages handled.
+    ads : int
+        Number of job ads handled.
+    bytes : int
+        Number of bytes handled.
+    **extra
+        Additional values to include in result.
+
+    Returns
+    ----------
+    result : dict
+        Result with counts, rates and peak memory use.
+    """
+    result = {"name": name, "seconds": round(seconds, 4), "pages": pages,
+              "ads": ads, "bytes": bytes,
+              "pages_per_sec": round(pages / seconds, 2),
+              "ads_per_sec": round(ads / seconds, 2),
+              "bytes_per_sec": round(bytes / seconds, 2),
+              "peak_rss_kb": peak_rss()}
+    result.update(extra)
+
+    return result
+
+
+def _run_child(connection, function, args):
+    connection.send(function(*args))
+    connection.close()
+
+
+def run_isolated(function, *args):
+    """Runs benchmark case in a new process and returns its result.
+
+    Arguments
+    ----------
+    function : callable
+        Module level function running the case and returning its result.
+    *args
+        Arguments of function.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_child,
+                                      args=(sender, function, args))
+    process.start()
+    result = receiver.recv()
+    process.join()
+
+    return result
+
+
+def timed(function, *args):
+    """Calls function and returns its result and elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+
+    return result, time.perf_counter() - start
+
+
+def write_results(benchmark, results, filename):
+    """Writes benchmark results to a JSON file.
+
+    Arguments
+    ----------
+    benchmark : str
+        Name of benchmark.
+    results : list[dict]
+        Results of benchmark cases.
+    filename : str
+        Name of output file. If "-", results are written to standard output.
+    """
+    output = {"benchmark": benchmark,
+              "created": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "results": results}
+    if filename == "-":
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=2)
@@ -0,0 +1,232 @@
+﻿"""Local stand-in server for job ad sites.
+
+Serves synthetic result pages in the markup of each site parsed by
+:mod:`jobadcollector.parsers`, so parsers can be run and benchmarked without
+network access. Each site is served under its own path prefix, see
+:func:`stand_in_hosts`.
+"""
+import asyncio
+import contextlib
+import hashlib
+import html
+import json
+import threading
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+# site hosts of parsers, site names as keys
+SITE_HOSTS = {"indeed": "www.indeed.fi", "monster": "www.monster.fi",
+              "duunitori": "duunitori.fi", "oikotie": "tyopaikat.oikotie.fi"}
+
+# markup around ads, resembling the size of real result pages
+FILLER = """<div class="filler"><span class="company">Company %d Oy</span>
+    <span class="location">Helsinki</span><span class="date">1 day ago</span>
+    <div class="tags"><span>full time</span><span>permanent</span></div></div>
+    """
+
+
+def _ad_texts(search_term, page, number):
+    """Returns id, title and description of a synthetic job ad.
+    """
+    id = hashlib.md5(("%s-%d-%d" % (search_term, page, number)).encode()).hexdigest()[:12]
+    title = "%s developer %d" % (search_term.capitalize(), number)
+    description = ("Company %d is looking for a %s with experience of Python, "
+                   "SQL &amp; R. Great&nbsp;team, flexible hours." % (number, search_term))
+
+    return id, title, description
+
+
+def _indeed_ad(search_term, page, number):
+    id, title, description = _ad_texts(search_term, page, number)
+    return """<div class="row result"><h2 class="jobtitle" id="jl_%s">
+        <a href="/rc/clk?jk=%s" class="turnstileLink">%s</a></h2>
+        <span class="summary">%s</span>%s
+        <div class="result-link-bar-container"><a href="#">Save job</a></div></div>
+        """ % (id, id, html.escape(title), description, FILLER % number)
+
+
+def _monster_ad(search_term, page, number):
+    id, title, description = _ad_texts(search_term, page, number)
+    posting = {"@context": "http://schema.org", "@type": "JobPosting",
+               "title": title, "description": html.unescape(description),
+               "url": "http://www.monster.fi/tyopaikka/%s-%d.aspx" %
+                      (id, int(id[:8], 16))}
+    return """<script type="application/ld+json">%s</script>%s
+        """ % (json.dumps(posting), FILLER % number)
+
+
+def _duunitori_ad(search_term, page, number):
+    id, title, description = _ad_texts(search_term, page, number)
+    return """<a class="jobentry--item" href="/tyopaikat/tyo/%s-%s">
+        <h3 itemprop="title">%s</h3><span>%s</span></a>%s
+        """ % (title.lower().replace(" ", "-"), id, html.escape(title), description,
+               FILLER % number)
+
+
+def _oikotie_ad(search_term, page, number):
+    id, title, description = _ad_texts(search_term, page, number)
+    return """<li><a class="list-link joblisting-wrapper" href="/tyopaikka/%s" id="%s">
+        <h4 class="job-title">%s</h4><h6 class="metadata">%s</h6>%s
+        <div class="action-wrap as"></div></a></li>
+        """ % (id, id, html.escape(title), description, FILLER % number)
+
+
+# functions generating synthetic job ads, site names as keys
+AD_TEMPLATES = {"indeed": _indeed_ad, "monster": _monster_ad,
+                "duunitori": _duunitori_ad, "oikotie": _oikotie_ad}
+
+# query parameters of search term and page number, and page number of first
+# page, site names as keys
+QUERY_PARAMS = {"indeed": ("as_and", "start", 0), "monster": ("q", "page", 1),
+                "duunitori": ("haku", "sivu", 1), "oikotie": ("jq", "page", 1)}
+
+
+def result_page(site, search_term, page=0, ads_per_page=50):
+    """Returns synthetic result page of site.
+
+    Arguments
+    ----------
+    site : str
+        Name of job ad site.
+    search_term : str
+        Search term of page. Job ads differ between search terms and pages.
+    page : int
+        Number of result page, starting from 0.
+    ads_per_page : int
+        Number of job ads on page.
+
+    Returns
+    ----------
+    page : bytes
+        Result page encoded in UTF-8.
+    """
+    ads = "".join([AD_TEMPLATES[site](search_term, page, number)
+                   for number in range(ads_per_page)])
+    if site == "oikotie":
+        ads = '<ul class="joblist">%s</ul>' % ads
+
+    return ("""<!DOCTYPE html><html><head><meta charset="utf-8">
+        <title>%s - %s</title></head><body><div id="results">%s</div>
+        <footer>Stand-in page</footer></body></html>""" %
+            (html.escape(search_term), site, ads)).encode("utf-8")
+
+
+class StandInServer:
+    """Local HTTP server serving synthetic result pages of all sites.
+
+    Should be used as an asynchronous context manager::
+
+        async with StandInServer(pages=3) as server:
+            hosts = server.hosts
+
+    Arguments
+    ----------
+    pages : int
+        Number of result pages with job ads for each search term. Later
+        pages are empty.
+    ads_per_page : int
+        Number of job ads on each result page.
+    """
+
+    def __init__(self, pages=3, ads_per_page=50):
+        self._pages = pages
+        self._ads_per_page = ads_per_page
+        self._server = None
+        # served pages and bytes
+        self.requests = 0
+        self.bytes = 0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        """Starts server on a free local port.
+        """
+        app = web.Application()
+        app.router.add_get("/{site}/{tail:.*}", self._handler)
+        self._server = TestServer(app)
+        await self._server.start_server()
+
+    async def close(self):
+        """Stops server.
+        """
+        if self._server is not None:
+            await self._server.close()
+            self._server = None
+
+    @property
+    def base_url(self):
+        """Base URL of server.
+        """
+        return str(self._server.make_url("")).rstrip("/")
+
+    @property
+    def hosts(self):
+        """Replacement base URLs of site hosts for :class:`JobAdFetcher`.
+        """
+        return stand_in_hosts(self.base_url)
+
+    async def _handler(self, request):
+        site = request.match_info["site"]
+        if site not in AD_TEMPLATES:
+            raise web.HTTPNotFound()
+        term_param, page_param, first = QUERY_PARAMS[site]
+        page = int(request.query.get(page_param, first))
+        page = page // 50 if site == "indeed" else page - first
+        ads_per_page = self._ads_per_page if page < self._pages else 0
+        body = result_page(site, request.query.get(term_param, ""), page, ads_per_page)
+        self.requests += 1
+        self.bytes += len(body)
+
+        return web.Response(body=body, content_type="text/html", charset="utf-8")
+
+
+def stand_in_hosts(base_url):
+    """Returns replacement base URLs of site hosts for a stand-in server.
+
+    Arguments
+    ----------
+    base_url : str
+        Base URL of stand-in server.
+
+    Returns
+    ----------
+    hosts : dict
+        Base URLs, host names as keys.
+    """
+    return dict([(host, "%s/%s" % (base_url, site))
+                 for site, host in SITE_HOSTS.items()])
+
+
+@contextlib.contextmanager
+def serve_in_thread(server):
+    """Runs stand-in server in its own event loop in a background thread.
+
+    Allows code running its own event loop, such as
+    :meth:`JobAdCollector.start_search`, to search the server::
+
+        with serve_in_thread(StandInServer()) as server:
+            collector = JobAdCollector(terms, db_name, hosts=server.hosts)
+
+    Arguments
+    ----------
+    server : :class:`StandInServer`
+        Server to run.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
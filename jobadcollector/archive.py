@@ -0,0 +1,297 @@
+﻿import os
+import gzip
+import zlib
+import uuid
+import hashlib
+import sqlite3
+import datetime
+
+try:
+    # zstandard is optional, pages are compressed with gzip if it is missing
+    import zstandard
+    ZSTD = True
+except ImportError:
+    ZSTD = False
+
+from . import parsers
+from .job_ad import JobAd
+
+
+class PageArchive:
+    """Compressed, content-addressed archive of fetched result pages.
+
+    Each page is compressed (zstd if :mod:`zstandard` is installed, otherwise
+    gzip) and stored in a file named by the SHA-256 hash of its contents, so
+    identical pages are only stored once. An index in a :mod:`sqlite3`
+    database, index.db, records the site, search term, URL and time of every
+    fetch of a page.
+
+    Arguments
+    ----------
+    directory : str
+        Directory of archive. A new one is created if it doesn't exist.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._conn = None
+
+    def _connect(self):
+        """Opens connection to archive index.
+
+        Creates the archive directory and an empty index if they don't exist.
+        """
+        os.makedirs(os.path.join(self._directory, "pages"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self._directory, "index.db"))
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS Pages (
+                              hash varchar(64), site varchar(255),
+                              searchterm varchar(255), url varchar(1000),
+                              fetched timestamp, encoding varchar(100),
+                              compression varchar(10));""")
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS Pages_fetched
+                              ON Pages (fetched);""")
+
+    def close(self):
+        """Closes the archive index.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def store(self, site, search_term, url, page, encoding):
+        """Stores fetched page in archive.
+
+        Arguments
+        ----------
+        site : str
+            Name of job ad site.
+        search_term : str
+            Search term of page.
+        url : str
+            URL of page.
+        page : bytes
+            Contents of page.
+        encoding : str
+            Encoding of page contents.
+
+        Returns
+        ----------
+        hash : str
+            SHA-256 hash of page contents.
+        """
+        writer = self.open_page()
+        writer.write(page)
+
+        return writer.close(site, search_term, url, encoding)
+
+    def open_page(self):
+        """Opens a writer for storing a page in the archive as it is fetched.
+
+        Returns
+        ----------
+        writer : :class:`PageWriter`
+            Writer of page, chunks of the page are given with 
+            :meth:`PageWriter.write`.
+        """
+        if self._conn is None:
+            self._connect()
+
+        return PageWriter(self)
+
+    def _add_page(self, hash, compression, temp_path, site, search_term, url, 
+                  encoding):
+        """Moves a written page file in place and records the fetch in the index.
+        """
+        path = page_path(self._directory, hash, compression)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        self._conn.execute("""INSERT INTO Pages VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                           (hash, site, search_term, url,
+                            datetime.datetime.now().isoformat(" "), encoding,
+                            compression))
+        self._conn.commit()
+
+    def get_pages(self, date_start=None, date_end=None):
+        """Returns index entries of archived pages.
+
+        Pages fetched several times for the same site and search term are
+        only returned once, with the time of the latest fetch. Pages without
+        a site can't be parsed and are not returned.
+
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+            Earliest fetch date of pages. If None, pages since the start of the
+            archive are returned.
+        date_end : :class:`datetime`
+            Latest fetch date of pages. If None, pages until the end of the
+            archive are returned.
+
+        Returns
+        ----------
+        pages : list[dict]
+            Index entries with keys hash, site, searchterm, url, fetched,
+            encoding and compression.
+        """
+        if self._conn is None:
+            self._connect()
+        date_start = date_start if date_start is not None else datetime.date.min
+        date_end = date_end if date_end is not None else datetime.date.max
+        # dates compare as strings, include whole last day
+        entries = self._conn.execute("""
+                                     SELECT hash, site, searchterm, url,
+                                     MAX(fetched), encoding, compression
+                                     FROM Pages
+                                     WHERE site IS NOT NULL AND
+                                     fetched >= ? AND date(fetched) <= ?
+                                     GROUP BY hash, site, searchterm
+                                     ORDER BY MAX(fetched)""",
+                                     (str(date_start), str(date_end)[:10]))
+        columns = ["hash", "site", "searchterm", "url", "fetched", "encoding",
+                   "compression"]
+
+        return [dict(zip(columns, entry)) for entry in entries.fetchall()]
+
+
+class PageWriter:
+    """Writer storing a page in a :class:`PageArchive` chunk by chunk.
+
+    Chunks are hashed and compressed as they are written into a temporary 
+    file, so the whole page is never held in memory. The page is only added
+    to the archive once the writer is closed, and an aborted page leaves 
+    nothing behind.
+
+    Arguments
+    ----------
+    archive : :class:`PageArchive`
+        Archive to store page in.
+    """
+
+    def __init__(self, archive):
+        self._archive = archive
+        self._compression = "zstd" if ZSTD else "gzip"
+        self._hash = hashlib.sha256()
+        if self._compression == "zstd":
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            # gzip format, like gzip.compress
+            self._compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        temp_directory = os.path.join(archive._directory, "pages", "tmp")
+        os.makedirs(temp_directory, exist_ok=True)
+        self._temp_path = os.path.join(temp_directory, uuid.uuid4().hex + ".tmp")
+        self._file = open(self._temp_path, "wb")
+
+    def write(self, chunk):
+        """Writes a chunk of the page.
+
+        Arguments
+        ----------
+        chunk : bytes
+            Next chunk of page contents.
+        """
+        self._hash.update(chunk)
+        self._file.write(self._compressor.compress(chunk))
+
+    def close(self, site, search_term, url, encoding):
+        """Finishes the page and records it in the archive.
+
+        Arguments
+        ----------
+        site : str
+            Name of job ad site.
+        search_term : str
+            Search term of page.
+        url : str
+            URL of page.
+        encoding : str
+            Encoding of page contents.
+
+        Returns
+        ----------
+        hash : str
+            SHA-256 hash of page contents.
+        """
+        self._file.write(self._compressor.flush())
+        self._file.close()
+        hash = self._hash.hexdigest()
+        self._archive._add_page(hash, self._compression, self._temp_path, site, 
+                                search_term, url, encoding)
+
+        return hash
+
+    def abort(self):
+        """Discards the page, e.g. if fetching it failed.
+        """
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def page_path(directory, hash, compression):
+    """Returns path of archived page file.
+
+    Arguments
+    ----------
+    directory : str
+        Directory of archive.
+    hash : str
+        SHA-256 hash of page contents.
+    compression : str
+        Compression of page, "zstd" or "gzip".
+    """
+    extension = ".zst" if compression == "zstd" else ".gz"
+    return os.path.join(directory, "pages", hash[:2], hash + extension)
+
+
+def load_page(directory, entry):
+    """Loads archived page.
+
+    Arguments
+    ----------
+    directory : str
+        Directory of archive.
+    entry : dict
+        Index entry of page, see :meth:`PageArchive.get_pages`.
+
+    Returns
+    ----------
+    page : bytes
+        Contents of page.
+    """
+    with open(page_path(directory, entry["hash"], entry["compression"]), "rb") as file:
+        data = file.read()
+    if entry["compression"] == "zstd":
+        # frames written in chunks don't record their size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    return gzip.decompress(data)
+
+
+def parse_archived_page(directory, entry):
+    """Parses job ads from an archived page with the current parsers.
+
+    Intended to be run in a worker process.
+
+    Arguments
+    ----------
+    directory : str
+        Directory of archive.
+    entry : dict
+        Index entry of page, see :meth:`PageArchive.get_pages`.
+
+    Returns
+    ----------
+    ad_tuples : list[tuple]
+        Parsed job ads, values in order of :class:`JobAd` columns. The date
+        of each job ad is the date the page was fetched.
+    """
+    parser_name = parsers.parser_name(parsers.site_parsers[entry["site"]])
+    ad_tuples, known = parsers.parse_page(parser_name, load_page(directory, entry),
+                                          entry["encoding"], entry["searchterm"])
+    date = datetime.datetime.strptime(entry["fetched"][:10], "%Y-%m-%d").date()
+    date_col = JobAd._cols.index("date")
+
+    return [ad[:date_col] + (date,) + ad[date_col + 1:] for ad in ad_tuples]
@@ -0,0 +1,147 @@
+﻿import sqlite3
+import time
+
+
+class ResponseCache:
+    """On-disk cache of fetched pages stored in a :mod:`sqlite3` database.
+
+    For each URL, the cache stores the validators (ETag, Last-Modified) sent
+    by the site. Page contents are not stored, as unchanged pages have 
+    already been handled and are not parsed again. Cached entries are used
+    by :class:`JobAdFetcher` to send conditional requests, and pages fetched
+    less than fresh seconds ago are not requested again at all.
+
+    Entries older than ttl seconds are removed, and the oldest entries are
+    removed once there are more than max_entries.
+
+    Arguments
+    ----------
+    filename : str
+        Name of cache database file. If file doesn't exist, a new one is
+        created.
+    max_entries : int
+        Maximum number of cached pages.
+    ttl : float
+        Time in seconds after which an entry is removed.
+    fresh : float
+        Time in seconds during which a stored page is used without
+        contacting the site.
+    """
+
+    def __init__(self, filename, max_entries=100000, ttl=7*24*3600, fresh=1800):
+        self._filename = filename
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._fresh = fresh
+        self._conn = None
+
+    def _connect(self):
+        """Opens connection to cache database.
+
+        Creates an empty table for responses if one doesn't exist. Caches of
+        earlier versions, which stored page contents, are emptied.
+        """
+        self._conn = sqlite3.connect(self._filename)
+        columns = [column[1] for column in 
+                   self._conn.execute("PRAGMA table_info(Responses);")]
+        if "body" in columns:
+            self._conn.execute("DROP TABLE Responses;")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS Responses (
+                              url varchar(1000) PRIMARY KEY, etag varchar(255),
+                              last_modified varchar(255), stored real);""")
+
+    def close(self):
+        """Closes the cache database.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, url):
+        """Returns cached entry for URL.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+
+        Returns
+        ----------
+        entry : dict
+            Dictionary with keys etag, last_modified and stored. None if URL 
+            is not cached or entry has expired.
+        """
+        if self._conn is None:
+            self._connect()
+        row = self._conn.execute("""SELECT etag, last_modified, stored 
+                                    FROM Responses WHERE url = ?""",
+                                 (url,)).fetchone()
+        if row is None:
+            return None
+        if row[2] < time.time() - self._ttl:
+            self._conn.execute("DELETE FROM Responses WHERE url = ?", (url,))
+            self._conn.commit()
+            return None
+
+        return dict(zip(["etag", "last_modified", "stored"], row))
+
+    def is_fresh(self, entry):
+        """Checks whether entry is recent enough to be used without a request.
+
+        Arguments
+        ----------
+        entry : dict
+            Entry returned by :meth:`get`.
+
+        Returns
+        ----------
+        fresh : bool
+            Whether entry is fresh.
+        """
+        return entry["stored"] >= time.time() - self._fresh
+
+    def store(self, url, etag=None, last_modified=None):
+        """Stores page in cache, replacing any earlier entry for URL.
+
+        Should only be called once the page has been handled, e.g. its job 
+        ads stored, as the page is not returned again while it is unchanged.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+        etag : str
+            Value of ETag header of response.
+        last_modified : str
+            Value of Last-Modified header of response.
+        """
+        if self._conn is None:
+            self._connect()
+        self._conn.execute("""REPLACE INTO Responses VALUES (?, ?, ?, ?)""",
+                           (url, etag, last_modified, time.time()))
+        self._evict()
+        self._conn.commit()
+
+    def touch(self, url):
+        """Marks cached page as fresh again, e.g. after a 304 response.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+        """
+        if self._conn is None:
+            self._connect()
+        self._conn.execute("UPDATE Responses SET stored = ? WHERE url = ?",
+                           (time.time(), url))
+        self._conn.commit()
+
+    def _evict(self):
+        """Removes expired entries and oldest entries exceeding maximum count.
+        """
+        self._conn.execute("DELETE FROM Responses WHERE stored < ?",
+                           (time.time() - self._ttl,))
+        self._conn.execute("""DELETE FROM Responses WHERE url IN (
+                              SELECT url FROM Responses 
+                              ORDER BY stored DESC, url LIMIT -1 OFFSET ?)""",
+                           (self._max_entries,))
@@ -3,8 +3,9 @@ from rpy2.robjects.vectors import StrVector, FloatVector, IntVector
 from rpy2.robjects.packages import SignatureTranslatedAnonymousPackage as STAP, importr
 import datetime
 import time
+from itertools import islice
 
-from .job_ad import JobAd
+from .job_ad import JobAd, JobAdBatch
 
 class JobAdClassification:
     """Classification of job ads using R and rpy2.
@@ -188,6 +189,8 @@ class JobAdClassification:
                       "relevant"]
     #columns needed for classifying new job ads
     _class_columns = ["id", "site", "searchterm", "title", "description"]
+    #number of job ads recommended at a time by iter_recommend_ads
+    _batch_size = 1000
 
     def __init__(self, Rlibpath, search_terms, sites, language):
         self._RFmodel = None
@@ -253,8 +256,8 @@ class JobAdClassification:
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances.
+        job_ads : :class:`JobAdBatch` or list[:class:`JobAd`]
+            Job ads, a list is converted to a :class:`JobAdBatch`.
         include_columns : list[str]
             Defines which columns are included in the dataframe. 
 
@@ -265,13 +268,15 @@ class JobAdClassification:
         """
         
         #modify structure to type {column:[rows]}   
+        if not isinstance(job_ads, JobAdBatch):
+            job_ads = JobAdBatch.from_job_ads(job_ads, include_columns)
         if len(job_ads) == 0:
             raise Exception("No job ads to convert to R dataframe.")
 
         job_ads_dataf = {}
         for column in include_columns:
-            job_ads_dataf[column] = [self._remove_diacritics(ad[column]) 
-                                       for ad in job_ads]
+            job_ads_dataf[column] = [self._remove_diacritics(value) 
+                                     for value in job_ads[column]]
             if (column == "relevant"):
                 job_ads_dataf[column] = IntVector(job_ads_dataf[column])
             else:
@@ -286,9 +291,9 @@ class JobAdClassification:
 
         Arguments
         ----------
-        class_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances used to train model. Each instance
-            should have site, searchterm, title, description and relevant defined.
+        class_ads : :class:`JobAdBatch` or list[:class:`JobAd`]
+            Job ads used to train model. Each job ad should have site, 
+            searchterm, title, description and relevant defined.
         """
         ##parameters for training
         #typical value
@@ -346,16 +351,19 @@ class JobAdClassification:
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            Each instance should have id, site, searchterm, title 
+        job_ads : :class:`JobAdBatch` or list[:class:`JobAd`]
+            Each job ad should have id, site, searchterm, title 
             and description defined.
 
         Returns
         ----------
         results : list[:class:`JobAd`]
-            Each instance has id and recommendation defined.
+            Each instance has site, id and recommendation defined.
         """
         #convert to dataframe and clean ads
+        if not isinstance(job_ads, JobAdBatch):
+            job_ads = JobAdBatch.from_job_ads(job_ads, self._class_columns)
+        sites = job_ads["site"]
         dataf = self._create_R_dataframe(job_ads, self._class_columns)
         ids = dataf.rx2('id') 
         dataf = self._R_functions.cleanJobAds(dataf, StrVector(self._search_terms), 
@@ -367,11 +375,44 @@ class JobAdClassification:
         pred = self._R_functions.RFpred(self._RFmodel, dataf)
 
         #combine predictions with ids in a list of dictionaries
-        results = [JobAd.create({"id" : ids[i], "recommendation": int(pred[i])-1}) 
+        results = [JobAd.create({"site": sites[i], "id" : ids[i], 
+                                 "recommendation": int(pred[i])-1}) 
                    for i in range(0, robjects.r['length'](ids)[0])]
                            
         return results
-        
+
+    def iter_recommend_ads(self, job_ads, batch_size=None):
+        """Provides recommendations for ads in batches, yielding results.
+
+        Job ads are read from job_ads and recommended batch_size at a time
+        with :meth:`recommend_ads`, so any number of job ads can be
+        recommended in constant memory.
+
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            Each instance should have id, site, searchterm, title 
+            and description defined. Can be an iterator, e.g.
+            :meth:`JobAdDB.iter_ads`.
+        batch_size : int
+            Number of job ads recommended at a time. If None, _batch_size is
+            used.
+
+        Yields
+        ----------
+        result : :class:`JobAd`
+            Instance with site, id, recommendation and cluster defined.
+        """
+        job_ads = iter(job_ads)
+        batch_size = batch_size if batch_size is not None else self._batch_size
+        columns = self._class_columns + ["cluster"]
+        batch = list(islice(job_ads, batch_size))
+        while batch:
+            batch = JobAdBatch.from_job_ads(batch, columns)
+            for cluster, result in zip(batch["cluster"], self.recommend_ads(batch)):
+                result["cluster"] = cluster
+                yield result
+            batch = list(islice(job_ads, batch_size))
 
     def _determine_lang(self, title, description):
         """Tries to determine which language a job ad is using the textcat package. 
@@ -414,24 +455,40 @@ class JobAdClassification:
     def det_lang_ads(self, job_ads):
         """Attempts to determine language of job ads.
 
-        Returns list of :class:`JobAd` instances with id and language.
+        Returns list of :class:`JobAd` instances with id and language. See
+        :meth:`iter_lang_ads` for determining languages one job ad at a time.
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances. Each instance should have 
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances. Each instance should have 
             id, title and description defined.
 
         Returns
         ----------
         results : list[:class:`JobAd`]
-            List of :class:`JobAd` instances. Each instance has id and
-            language defined.
+            List of :class:`JobAd` instances. Each instance has site, id,
+            language and cluster defined.
         """
+        return list(self.iter_lang_ads(job_ads))
 
-        results = [{"id": ad["id"], 
-                    "language": self._determine_lang(ad["title"], ad["description"])}
-                   for ad in job_ads]
+    def iter_lang_ads(self, job_ads):
+        """Determines languages of job ads as they are iterated.
 
-        return results
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances. Each instance should have id, title and
+            description defined. Can be an iterator, e.g. 
+            :meth:`JobAdDB.iter_ads`.
 
+        Yields
+        ----------
+        result : :class:`JobAd`
+            Instance with site, id, language and cluster defined.
+        """
+        for ad in job_ads:
+            yield JobAd.create({"site": ad.get("site"), "id": ad["id"], 
+                                "cluster": ad.get("cluster"),
+                                "language": self._determine_lang(ad["title"], 
+                                                                 ad["description"])})
@@ -0,0 +1,209 @@
+﻿import zlib
+import struct
+from collections import Counter
+
+try:
+    # zstandard is optional, only zlib is available without it
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# codecs of compressed values, names as keys and tags as values
+CODECS = {"zlib": b"z", "zstd": b"s"}
+# codec tag and dictionary id preceding compressed data
+_HEADER = struct.Struct(">cI")
+
+
+class CompressedText:
+    """Compressed text, decompressed when its text is needed.
+
+    Stored in :class:`JobAd` instances in place of text, see
+    :meth:`JobAd.__getitem__`.
+
+    Arguments
+    ----------
+    value : bytes
+        Compressed text.
+    codec : :class:`TextCodec`
+        Codec with dictionaries for decompressing value.
+    """
+    __slots__ = ("value", "codec")
+
+    def __init__(self, value, codec):
+        self.value = value
+        self.codec = codec
+
+    def text(self):
+        """Returns decompressed text.
+        """
+        return self.codec.decompress(self.value)
+
+
+class TextCodec:
+    """Compression of text with shared dictionaries.
+
+    Compressed values start with a codec tag and the id of the dictionary
+    they were compressed with (0 for none), so values compressed with
+    different codecs and dictionaries can be decompressed side by side.
+    Text is compressed with the current codec and dictionary, see
+    :meth:`set_current`.
+    """
+
+    def __init__(self):
+        self._dictionaries = {0: b""}
+        self._compressors = {}
+        self._decompressors = {}
+        self.codec = None
+        self.dictionary_id = 0
+
+    def add_dictionary(self, dictionary_id, dictionary):
+        """Adds a dictionary for compressing and decompressing values.
+
+        Arguments
+        ----------
+        dictionary_id : int
+            Id of dictionary, stored in compressed values.
+        dictionary : bytes
+            Dictionary, None or empty for none.
+        """
+        self._dictionaries[dictionary_id] = dictionary or b""
+
+    def set_current(self, codec, dictionary_id=0):
+        """Sets codec and dictionary used for compressing text.
+
+        Arguments
+        ----------
+        codec : str
+            Name of codec, one of CODECS, or None for no compression.
+        dictionary_id : int
+            Id of added dictionary, 0 for none.
+        """
+        if codec is not None and codec not in CODECS:
+            raise ValueError("Unknown codec %s, should be one of %s." %
+                             (codec, ", ".join(sorted(CODECS))))
+        if codec == "zstd" and zstandard is None:
+            raise EnvironmentError("zstd compression requires the zstandard package.")
+        self.codec = codec
+        self.dictionary_id = dictionary_id
+
+    def _zstd_dictionary(self, dictionary_id):
+        dictionary = self._dictionaries[dictionary_id]
+        if not dictionary:
+            return None
+        return zstandard.ZstdCompressionDict(dictionary)
+
+    def compress(self, text):
+        """Returns text compressed with the current codec.
+
+        Arguments
+        ----------
+        text : str
+            Text to compress. None and, without a current codec, text are
+            returned as is.
+
+        Returns
+        ----------
+        value : bytes
+            Compressed text.
+        """
+        if text is None or self.codec is None:
+            return text
+        data = text.encode("utf-8")
+        if self.codec == "zlib":
+            compressor = zlib.compressobj(9, zdict=self._dictionaries[self.dictionary_id]) \
+                if self.dictionary_id else zlib.compressobj(9)
+            data = compressor.compress(data) + compressor.flush()
+        else:
+            key = self.dictionary_id
+            if key not in self._compressors:
+                self._compressors[key] = zstandard.ZstdCompressor(
+                    level=19, dict_data=self._zstd_dictionary(key))
+            data = self._compressors[key].compress(data)
+
+        return _HEADER.pack(CODECS[self.codec], self.dictionary_id) + data
+
+    def decompress(self, value):
+        """Returns text of a value, decompressing it if compressed.
+
+        Arguments
+        ----------
+        value : bytes
+            Value stored by :meth:`compress`. Text and None are returned as
+            is.
+
+        Returns
+        ----------
+        text : str
+            Decompressed text.
+        """
+        if not isinstance(value, bytes):
+            return value
+        tag, dictionary_id = _HEADER.unpack_from(value)
+        data = value[_HEADER.size:]
+        if tag == CODECS["zlib"]:
+            decompressor = zlib.decompressobj(zdict=self._dictionaries[dictionary_id]) \
+                if dictionary_id else zlib.decompressobj()
+            data = decompressor.decompress(data) + decompressor.flush()
+        elif tag == CODECS["zstd"]:
+            if zstandard is None:
+                raise EnvironmentError("zstd compressed text requires the zstandard package.")
+            if dictionary_id not in self._decompressors:
+                self._decompressors[dictionary_id] = zstandard.ZstdDecompressor(
+                    dict_data=self._zstd_dictionary(dictionary_id))
+            data = self._decompressors[dictionary_id].decompress(data)
+        else:
+            raise ValueError("Unknown codec tag %r of compressed text." % tag)
+
+        return data.decode("utf-8")
+
+
+def train_dictionary(samples, codec="zlib", size=None):
+    """Returns a dictionary for compressing texts similar to samples.
+
+    For zstd, the dictionary is trained with zstandard. For zlib, and if
+    training fails, the dictionary consists of word sequences common in
+    the samples, the most common ones last, as zlib favors near matches.
+
+    Arguments
+    ----------
+    samples : list[str]
+        Sample texts.
+    codec : str
+        Codec the dictionary is used with, one of CODECS.
+    size : int
+        Maximum size of dictionary in bytes. By default 32 kB for zlib,
+        which can't use a larger one, and 64 kB for zstd.
+
+    Returns
+    ----------
+    dictionary : bytes
+        Dictionary, empty if samples have nothing in common.
+    """
+    size = size if size is not None else (2**15 if codec == "zlib" else 2**16)
+    samples = [sample for sample in samples if sample]
+    if codec == "zstd" and zstandard is not None:
+        try:
+            return zstandard.train_dictionary(
+                size, [sample.encode("utf-8") for sample in samples]).as_bytes()
+        except zstandard.ZstdError:
+            pass
+
+    # word sequences occurring in at least two samples, counted once per sample
+    counts = Counter()
+    for sample in samples:
+        words = sample.split()
+        counts.update(set([" ".join(words[i:i + 4]) for i in range(len(words) - 3)]))
+    common = [(count * len(sequence), sequence) for sequence, count in counts.items()
+              if count > 1]
+    common.sort(reverse=True)
+    chosen = []
+    total = 0
+    for score, sequence in common:
+        length = len(sequence.encode("utf-8")) + 1
+        if total + length > size:
+            break
+        chosen.append(sequence)
+        total += length
+
+    return " ".join(reversed(chosen)).encode("utf-8")
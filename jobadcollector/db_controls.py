@@ -1,18 +1,226 @@
 ﻿import sqlite3
 import datetime
+import os
 import csv
-import codecs
+import gzip
+import hashlib
+import base64
+import json
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+try:
+    # pyarrow is optional, only needed for Arrow and Parquet files
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .job_ad import JobAd, JobAdBatch
+from .compression import CompressedText, TextCodec, train_dictionary
+
+# start, row and end of HTML table written by JobAdDB.write_HTML_file
+_HTML_HEADER = """<!DOCTYPE HTML><html><head>
+            <meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+            <script type="text/javascript">function hideRow(rownumber)
+            {document.getElementById(rownumber).style.display='none';}
+            </script><link rel="stylesheet" href='jobsearch.css' />
+            </head><body><table>
+            <tr class="headers">
+                <th class="searchterm">Search term</th>
+                <th class="site">Site</th>
+                <th class="jobtitle">Job title</th>
+                <th class="description">Description</th>
+                <th class="date">Date</th>
+                <th class="url">URL</th>
+                <th class="language">Language</th>
+                <th class="relevant">Relevant</th>
+                <th class="relevant">Recommendation</th>
+                <th></th>
+            </tr>"""
+_HTML_ROW = """
+            <tr class="%(searchterm)s" origsite="%(site)s" id="%(row)d">
+                <td class="searchterm">%(searchterm)s</td>
+                <td class="site">%(site)s</td>
+                <td class="jobtitle">%(title)s</td>
+                <td class="description">%(description)s</td>
+                <td class="date">%(date)s</td>
+                <td class="url"><a href="%(url)s">Link</a></td>
+                <td class="language">%(language)s</td>
+                <td class="relevant">%(relevant)s</td>
+                <td class="recommendation">%(recommendation)s</td>
+                <td class="hidebutton">
+                    <input type="button" id="hidebutton" value="Hide" 
+                    onclick='hideRow("%(row)d");' />
+                </td>
+            </tr>"""
+_HTML_FOOTER = "</table></body></html>"
+
+# page of JobAdDB.write_HTML_report, rendering rows of lazily loaded chunks
+# while scrolling, only rows in view are in the document
+_HTML_REPORT = """<!DOCTYPE HTML><html><head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+<link rel="stylesheet" href='jobsearch.css' />
+<style>
+#view {height:95vh; overflow-y:scroll;}
+#view td {height:%(row_height)dpx; overflow:hidden;}
+#view td div {max-height:%(row_height)dpx; overflow-y:auto;}
+</style>
+<script type="text/javascript">
+var REPORT = {rows: %(rows)d, chunkSize: %(chunk_size)d, prefix: %(prefix)s};
+var ROW_HEIGHT = %(row_height)d;
+var COLUMNS = ["searchterm", "site", "jobtitle", "description", "date", "url",
+               "language", "relevant", "recommendation"];
+var chunks = {};
+var requested = {};
+// numbers of rows not hidden, in order
+var shown = [];
+for (var i = 0; i < REPORT.rows; i++) {shown.push(i);}
+
+function jobAdChunk(number, rows) {
+    chunks[number] = rows;
+    render();
+}
+function loadChunk(number) {
+    if (requested[number]) {return;}
+    requested[number] = true;
+    var script = document.createElement("script");
+    script.src = REPORT.prefix + ("0000" + number).slice(-5) + ".js";
+    document.head.appendChild(script);
+}
+function hideRow(row) {
+    shown.splice(shown.indexOf(row), 1);
+    render();
+}
+function cell(tr, column, value) {
+    var td = document.createElement("td");
+    td.className = column;
+    if (column == "url") {
+        var link = document.createElement("a");
+        link.href = value;
+        link.textContent = "Link";
+        td.appendChild(link);
+    } else {
+        var div = document.createElement("div");
+        div.textContent = value === null ? "None" : value;
+        td.appendChild(div);
+    }
+    tr.appendChild(td);
+}
+function spacer(height) {
+    var tr = document.createElement("tr");
+    tr.style.height = height + "px";
+    return tr;
+}
+function render() {
+    var view = document.getElementById("view");
+    var body = document.getElementById("rows");
+    var first = Math.max(0, Math.floor(view.scrollTop / ROW_HEIGHT) - 10);
+    var last = Math.min(shown.length, 
+                        first + Math.ceil(view.clientHeight / ROW_HEIGHT) + 20);
+    var fragment = document.createDocumentFragment();
+    fragment.appendChild(spacer(first * ROW_HEIGHT));
+    for (var i = first; i < last; i++) {
+        var row = shown[i];
+        var chunk = Math.floor(row / REPORT.chunkSize);
+        var tr = document.createElement("tr");
+        tr.id = row;
+        tr.style.height = ROW_HEIGHT + "px";
+        if (!(chunk in chunks)) {
+            loadChunk(chunk);
+            cell(tr, "searchterm", "Loading...");
+        } else {
+            var values = chunks[chunk][row %% REPORT.chunkSize];
+            tr.className = values[0];
+            tr.setAttribute("origsite", values[1]);
+            for (var j = 0; j < COLUMNS.length; j++) {cell(tr, COLUMNS[j], values[j]);}
+            var td = document.createElement("td");
+            td.className = "hidebutton";
+            var button = document.createElement("input");
+            button.type = "button";
+            button.value = "Hide";
+            button.onclick = hideRow.bind(null, row);
+            td.appendChild(button);
+            tr.appendChild(td);
+        }
+        fragment.appendChild(tr);
+    }
+    fragment.appendChild(spacer((shown.length - last) * ROW_HEIGHT));
+    body.replaceChildren(fragment);
+}
+var scheduled = false;
+function scrolled() {
+    if (scheduled) {return;}
+    scheduled = true;
+    window.requestAnimationFrame(function () {scheduled = false; render();});
+}
+</script></head>
+<body onload="render();">
+<div id="view" onscroll="scrolled();"><table>
+<tr class="headers">
+    <th class="searchterm">Search term</th>
+    <th class="site">Site</th>
+    <th class="jobtitle">Job title</th>
+    <th class="description">Description</th>
+    <th class="date">Date</th>
+    <th class="url">URL</th>
+    <th class="language">Language</th>
+    <th class="relevant">Relevant</th>
+    <th class="relevant">Recommendation</th>
+    <th></th>
+</tr>
+<tbody id="rows"></tbody></table></div></body></html>"""
+
+
+class KnownAds:
+    """Compact set of (site, id) pairs of stored job ads.
+
+    Pairs are stored as sorted 64-bit hashes in an :class:`array.array`, i.e.
+    8 bytes per job ad, and looked up with a binary search. Hash collisions
+    are possible but negligibly rare for the number of job ads in a database.
+    Job ads stored without a site match the same id on any site.
+
+    Arguments
+    ----------
+    pairs : iterable
+        (site, id) pairs of job ads.
+    """
+
+    def __init__(self, pairs=()):
+        self._hashes = array("Q", sorted(set([self._hash(site, id) 
+                                              for site, id in pairs])))
+
+    @staticmethod
+    def _hash(site, id):
+        """Returns 64-bit hash of (site, id) pair.
+        """
+        key = "%s\x00%s" % (site if site is not None else "", id)
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), 
+                                              digest_size=8).digest(), "little")
+
+    def _contains_hash(self, hash):
+        i = bisect_left(self._hashes, hash)
+        return i < len(self._hashes) and self._hashes[i] == hash
+
+    def __contains__(self, pair):
+        site, id = pair
+        return (self._contains_hash(self._hash(site, id)) or 
+                self._contains_hash(self._hash(None, id)))
+
+    def __len__(self):
+        return len(self._hashes)
 
-from .job_ad import JobAd
 
 class JobAdDB:
     """Management of :mod:`sqlite3` database containing job ads.
 
     For each :class:`JobAd`, the database will store (column name in parentheses):
 
-    - name of job ad site (site, varchar(255))
+    - name of job ad site (site, varchar(255) NOT NULL, '' if not defined)
     - search term for job ad (searchterm, varchar(255))
-    - a unique id (id, varchar(255) PRIMARY KEY)
+    - an id unique within the site (id, varchar(255))
     - job title (title, varchar(255))
     - url to job ad (url, varchar(1000))
     - description (description, varchar(1000))
@@ -20,82 +228,630 @@ class JobAdDB:
     - language (language, varchar(100))
     - relevance (relevant, integer)
     - recommendation (recommendation, integer)
+    - cluster of near-duplicates (cluster, varchar(255))
+
+    Job ads are identified by (site, id), the primary key, as ids of
+    different sites may collide.
 
     The class supports:
 
     - Storing fresh job ads (i.e. language, relevance, recommendation).
-    - Retrieving job ads.
+    - Retrieving job ads, all at once or a page at a time.
     - Retrieving job ads for classification.
-    - Updating language and recommendation for job ads.
+    - Updating language and recommendation for job ads, or for whole 
+      clusters of near-duplicate job ads.
+
+    Job ads are written in batches, each write method running in a single
+    transaction and returning counts of affected job ads.
+
+    The schema of the database is versioned, and missing migrations are
+    applied in order when connecting, see :meth:`_update_schema`.
+
+    The connection is tuned with a profile. The default profile uses the
+    defaults of sqlite. The performance profile enables write-ahead logging,
+    so that reading (e.g. an export or the GUI) and writing (a search) don't
+    block each other, and uses memory-mapped I/O, a 64 MB page cache,
+    temporary tables in memory and fewer disk syncs. Write-ahead logging is a
+    setting of the database file, which stays on once enabled.
 
     Arguments
     ----------
     filename : str
         Name of database file. If file doesn't exist, a new one is created.
+    profile : str
+        Connection profile, "default" or "performance".
     """
 
     #columns in database
     _db_columns = ["site", "searchterm", "id", "title", "url", 
                    "description", "date", "language", "relevant",
-                   "recommendation"]
+                   "recommendation", "cluster"]
+    #names of indexes for date, language and relevance in the current schema,
+    #each migration creates and drops indexes explicitly
+    _db_indexes = ("JobEntries_date_site_id", "JobEntries_language_date_site_id",
+                   "JobEntries_relevant_language_date")
+    #schema migrations in order, names of methods applying them
+    _migrations = ["_migrate_create_table", "_migrate_indexes", "_migrate_fulltext",
+                   "_migrate_keyset_indexes", "_migrate_clusters", "_migrate_site_key",
+                   "_migrate_compression"]
+    #weights of title and description in ranking of full-text search
+    _fts_weights = (5.0, 1.0)
+    #formats of write_arrow_file and import_arrow_file
+    _arrow_formats = ["arrow", "parquet"]
+    #buffer size of HTML and CSV files in bytes
+    _output_buffer_size = 2**16
+    #number of job ads in each data file of write_HTML_report
+    _report_chunk_size = 1000
+    #number of job ads written with a single executemany
+    _batch_size = 1000
+    #number of job ads in a page of get_ads_page
+    _page_size = 500
+    #connection settings of profiles, pragmas and their values
+    _profiles = {"default": [],
+                 "performance": [("journal_mode", "WAL"),
+                                 ("synchronous", "NORMAL"),
+                                 ("mmap_size", 256 * 2**20),
+                                 ("cache_size", -64 * 2**10),
+                                 ("temp_store", "MEMORY")]}
 
-    def __init__(self, filename):
+    def __init__(self, filename, profile="default"):
+        if profile not in self._profiles:
+            raise ValueError("Unknown JobAdDB profile %s, should be one of %s." %
+                             (profile, ", ".join(sorted(self._profiles))))
         self._db_filename = filename
+        self._profile = profile
         self._conn = None
+        self._codec = TextCodec()
 
     def _connect_db(self):
         """Opens connection to instance database.
         
-        Creates an empty table for job ads in the database if one doesn't exist.
+        Applies the pragmas of the instance profile and brings the schema of 
+        the database up to date, creating an empty table for job ads if one 
+        doesn't exist, see :meth:`_update_schema`.
         """
         if (self._db_filename != ""):
             self._conn = sqlite3.connect(self._db_filename)
-            c = self._conn.cursor()
-            if (c.execute("""SELECT * FROM sqlite_master WHERE name='JobEntries';""")
-                .fetchone() == None):
-                c.execute("""CREATE TABLE JobEntries (site varchar(255), 
-                             searchterm varchar(255), id varchar(255) PRIMARY KEY, 
-                             title varchar(255), url varchar(1000), 
-                             description varchar(1000), date date,
-                             language varchar(100), relevant integer,
-                             recommendation integer);""")
+            for pragma, value in self._profiles[self._profile]:
+                self._conn.execute("PRAGMA %s = %s;" % (pragma, value))
+            # functions for compressed descriptions, see compress_descriptions
+            self._conn.create_function("description_text", 1, self._codec.decompress,
+                                       deterministic=True)
+            self._conn.create_function("compress_description", 1, self._codec.compress)
+            self._update_schema()
+            self._load_compression()
+
+    def _update_schema(self):
+        """Applies migrations the database is missing, in order.
+
+        The number of migrations applied is stored as the user_version of the
+        database. Each migration is run in a transaction together with
+        updating user_version, so an interrupted migration is run again on
+        the next connection. The transaction takes the write lock before 
+        user_version is read again, so a migration already applied by another
+        connection is skipped. Migrations rewriting tables commit in batches,
+        see :meth:`_rewrite_table`.
+        """
+        c = self._conn.cursor()
+        version = c.execute("PRAGMA user_version;").fetchone()[0]
+        if version > len(self._migrations):
+            raise ValueError("Database %s has schema version %d, newer than supported %d."
+                             % (self._db_filename, version, len(self._migrations)))
+        while version < len(self._migrations):
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                version = c.execute("PRAGMA user_version;").fetchone()[0]
+                if version < len(self._migrations):
+                    getattr(self, self._migrations[version])(c)
+                    # batched migrations may have been finished by another connection
+                    version = max(version + 1,
+                                  c.execute("PRAGMA user_version;").fetchone()[0])
+                    c.execute("PRAGMA user_version = %d;" % version)
+                self._conn.commit()
+            except:
+                self._conn.rollback()
+                raise
+
+    def _migrate_create_table(self, c):
+        """Migration 1: creates job ad table.
+        """
+        c.execute("""CREATE TABLE IF NOT EXISTS JobEntries (site varchar(255), 
+                     searchterm varchar(255), id varchar(255) PRIMARY KEY, 
+                     title varchar(255), url varchar(1000), 
+                     description varchar(1000), date date,
+                     language varchar(100), relevant integer,
+                     recommendation integer);""")
+
+    def _migrate_indexes(self, c):
+        """Migration 2: creates indexes for date, language and relevance.
+
+        Indexes are created for the filters of :meth:`get_ads` and
+        :meth:`get_classified_ads`, so that queries don't scan the whole table.
+        """
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_date 
+                     ON JobEntries (date);""")
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_language_date 
+                     ON JobEntries (language, date);""")
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_relevant_language_date 
+                     ON JobEntries (relevant, language, date);""")
+
+    def _migrate_fulltext(self, c):
+        """Migration 3: creates full-text index of titles and descriptions.
+
+        The FTS5 table JobEntriesFTS indexes the title and description of
+        job ads in JobEntries, and is kept in sync by triggers. Existing job
+        ads are indexed in the migration. If sqlite was built without FTS5,
+        no index is created and :meth:`search_ads` is unavailable.
+        """
+        try:
+            c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS JobEntriesFTS 
+                         USING fts5(title, description, content='JobEntries', 
+                                    content_rowid='rowid', prefix='2 3');""")
+        except sqlite3.OperationalError as e:
+            if "fts5" not in str(e):
+                raise
+            print("Full-text search not available, sqlite lacks FTS5.")
+            return
+        c.execute("""CREATE TRIGGER IF NOT EXISTS JobEntries_fts_insert 
+                     AFTER INSERT ON JobEntries BEGIN
+                     INSERT INTO JobEntriesFTS (rowid, title, description)
+                     VALUES (new.rowid, new.title, new.description);
+                     END;""")
+        c.execute("""CREATE TRIGGER IF NOT EXISTS JobEntries_fts_delete 
+                     AFTER DELETE ON JobEntries BEGIN
+                     INSERT INTO JobEntriesFTS (JobEntriesFTS, rowid, title, description)
+                     VALUES ('delete', old.rowid, old.title, old.description);
+                     END;""")
+        c.execute("""CREATE TRIGGER IF NOT EXISTS JobEntries_fts_update 
+                     AFTER UPDATE OF title, description ON JobEntries BEGIN
+                     INSERT INTO JobEntriesFTS (JobEntriesFTS, rowid, title, description)
+                     VALUES ('delete', old.rowid, old.title, old.description);
+                     INSERT INTO JobEntriesFTS (rowid, title, description)
+                     VALUES (new.rowid, new.title, new.description);
+                     END;""")
+        c.execute("""INSERT INTO JobEntriesFTS (JobEntriesFTS) VALUES ('rebuild');""")
+
+    def _migrate_keyset_indexes(self, c):
+        """Migration 4: extends date indexes with the key for keyset pagination.
+
+        The date and (language, date) indexes are replaced by ones extended
+        with the key of job ads, which also serve the filters of 
+        :meth:`get_ads` and let :meth:`get_ads_page` seek directly to the 
+        start of a page.
+        """
+        c.execute("""DROP INDEX IF EXISTS JobEntries_date;""")
+        c.execute("""DROP INDEX IF EXISTS JobEntries_language_date;""")
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_date_id 
+                     ON JobEntries (date, id);""")
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_language_date_id 
+                     ON JobEntries (language, date, id);""")
+
+    def _migrate_clusters(self, c):
+        """Migration 5: adds clusters of near-duplicate job ads.
+
+        Adds an indexed cluster column to JobEntries, and the Clusters table
+        storing the signature of each cluster, see :mod:`jobadcollector.dedup`.
+        Job ads stored before the migration are not clustered.
+        """
+        columns = [column[1] for column in c.execute("PRAGMA table_info(JobEntries);")]
+        if "cluster" not in columns:
+            c.execute("""ALTER TABLE JobEntries ADD COLUMN cluster varchar(255);""")
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_cluster 
+                     ON JobEntries (cluster);""")
+        c.execute("""CREATE TABLE IF NOT EXISTS Clusters (
+                     cluster varchar(255) PRIMARY KEY, signature blob, date date);""")
+        c.execute("""CREATE INDEX IF NOT EXISTS Clusters_date ON Clusters (date);""")
+
+    def _migrate_site_key(self, c):
+        """Migration 6: makes (site, id) the primary key of job ads.
+
+        JobEntries is rewritten with :meth:`_rewrite_table`, keeping rowids so
+        that the full-text index stays valid. Missing sites are stored as ''.
+        Date indexes are extended with site, see :meth:`_migrate_keyset_indexes`.
+        """
+        c.execute("""DROP INDEX IF EXISTS JobEntries_date_id;""")
+        c.execute("""DROP INDEX IF EXISTS JobEntries_language_date_id;""")
+        self._rewrite_table(c, "JobEntries", 
+            """CREATE TABLE %s (site varchar(255) NOT NULL ON CONFLICT REPLACE DEFAULT '', 
+               searchterm varchar(255), id varchar(255), 
+               title varchar(255), url varchar(1000), 
+               description varchar(1000), date date,
+               language varchar(100), relevant integer,
+               recommendation integer, cluster varchar(255),
+               PRIMARY KEY (site, id));""",
+            self._db_columns, ["COALESCE(site, '')"] + self._db_columns[1:])
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_date_site_id 
+                     ON JobEntries (date, site, id);""")
+        c.execute("""CREATE INDEX IF NOT EXISTS JobEntries_language_date_site_id 
+                     ON JobEntries (language, date, site, id);""")
+
+    def _migrate_compression(self, c):
+        """Migration 7: supports compressed descriptions.
+
+        Creates the Compression table of codecs and dictionaries, see
+        :meth:`compress_descriptions`. The full-text index of migration 3 is
+        kept, and only switched to compressed descriptions once they are 
+        enabled, see :meth:`_create_fulltext`.
+        """
+        c.execute("""CREATE TABLE IF NOT EXISTS Compression (
+                     id integer PRIMARY KEY, codec varchar(10), dictionary blob,
+                     date date);""")
+
+    def _create_fulltext(self, c, compressed):
+        """Creates the full-text index again for plain or compressed descriptions.
+
+        For plain descriptions, JobEntriesFTS indexes JobEntries like in 
+        migration 3. For compressed descriptions, it indexes the view 
+        JobEntriesText, which decompresses descriptions with the function 
+        description_text(), as do the triggers keeping the index in sync. 
+        Job ads can then only be written through :class:`JobAdDB`. Nothing 
+        is done if the index doesn't exist or already is of the right kind.
+
+        Arguments
+        ----------
+        c : :class:`sqlite3.Cursor`
+            Cursor of connection, within a transaction.
+        compressed : bool
+            Whether descriptions may be stored compressed.
+        """
+        if c.execute("""SELECT * FROM sqlite_master WHERE name = 'JobEntriesFTS'""") \
+            .fetchone() == None:
+            return
+        view = c.execute("""SELECT * FROM sqlite_master 
+                            WHERE name = 'JobEntriesText'""").fetchone()
+        if (view != None) == compressed:
+            return
+        for trigger in ["JobEntries_fts_insert", "JobEntries_fts_delete", 
+                        "JobEntries_fts_update"]:
+            c.execute("DROP TRIGGER IF EXISTS %s;" % trigger)
+        c.execute("DROP TABLE JobEntriesFTS;")
+        c.execute("DROP VIEW IF EXISTS JobEntriesText;")
+        if compressed:
+            c.execute("""CREATE VIEW JobEntriesText AS
+                         SELECT rowid, title, description_text(description) AS description
+                         FROM JobEntries;""")
+            content = "JobEntriesText"
+            old, new = "description_text(old.description)", "description_text(new.description)"
+            # recompressing descriptions doesn't change their text
+            when = "WHEN old.title IS NOT new.title OR %s IS NOT %s" % (old, new)
+        else:
+            content = "JobEntries"
+            old, new = "old.description", "new.description"
+            when = ""
+        c.execute("""CREATE VIRTUAL TABLE JobEntriesFTS 
+                     USING fts5(title, description, content='%s', 
+                                content_rowid='rowid', prefix='2 3');""" % content)
+        c.execute("""CREATE TRIGGER JobEntries_fts_insert 
+                     AFTER INSERT ON JobEntries BEGIN
+                     INSERT INTO JobEntriesFTS (rowid, title, description)
+                     VALUES (new.rowid, new.title, %s);
+                     END;""" % new)
+        c.execute("""CREATE TRIGGER JobEntries_fts_delete 
+                     AFTER DELETE ON JobEntries BEGIN
+                     INSERT INTO JobEntriesFTS (JobEntriesFTS, rowid, title, description)
+                     VALUES ('delete', old.rowid, old.title, %s);
+                     END;""" % old)
+        c.execute("""CREATE TRIGGER JobEntries_fts_update 
+                     AFTER UPDATE OF title, description ON JobEntries %s
+                     BEGIN
+                     INSERT INTO JobEntriesFTS (JobEntriesFTS, rowid, title, description)
+                     VALUES ('delete', old.rowid, old.title, %s);
+                     INSERT INTO JobEntriesFTS (rowid, title, description)
+                     VALUES (new.rowid, new.title, %s);
+                     END;""" % (when, old, new))
+        c.execute("""INSERT INTO JobEntriesFTS (JobEntriesFTS) VALUES ('rebuild');""")
+
+    def _load_compression(self):
+        """Loads dictionaries and the current codec of descriptions.
+        """
+        entries = self._conn.execute("""SELECT id, codec, dictionary FROM Compression 
+                                        ORDER BY id""").fetchall()
+        for id, codec, dictionary in entries:
+            self._codec.add_dictionary(id, dictionary)
+        if entries:
+            id, codec, dictionary = entries[-1]
+            self._codec.set_current(codec, id)
+
+    def _description_param(self):
+        """Returns SQL expression storing the description parameter.
+        """
+        if self._conn == None:
+            self._connect_db()
+        if self._codec.codec is None:
+            return ":description"
+        return "compress_description(:description)"
+
+    def _create_ad(self, columns, db_entry):
+        """Returns job ad of row, with compressed description left compressed.
+        """
+        if columns == JobAd._cols:
+            job_ad = JobAd.from_values(db_entry[:len(columns)])
+            description = job_ad._values[JobAd._index["description"]]
+            if type(description) is bytes:
+                job_ad["description"] = CompressedText(description, self._codec)
+            return job_ad
+        values = dict(zip(columns, db_entry))
+        if type(values.get("description")) is bytes:
+            values["description"] = CompressedText(values["description"], self._codec)
+
+        return JobAd.create(values)
+
+    def _rewrite_table(self, c, table, create_sql, columns, select=None):
+        """Copies table into a new schema in batches and replaces it.
+
+        Rows are copied _batch_size at a time in order of rowid, keeping their
+        rowids and committing after each batch, so large tables are upgraded
+        without a single giant transaction. Progress is stored in the table 
+        MigrationProgress, and an interrupted copy continues where it left off.
+        The table is finally replaced in the transaction of the migration, and
+        its indexes and triggers, as well as views, are created again.
+
+        Other connections can write to the table between batches. Triggers on
+        the table copy rows inserted, updated or deleted after they have been
+        copied again, until the table is replaced. Each batch takes the write
+        lock before reading the progress, so connections migrating the 
+        database at the same time copy separate batches.
+
+        Should only be called from a migration, see :meth:`_update_schema`.
+
+        Arguments
+        ----------
+        c : :class:`sqlite3.Cursor`
+            Cursor of migration, with a transaction open.
+        table : str
+            Name of table to rewrite.
+        create_sql : str
+            CREATE TABLE statement of new table, with %s in place of its name.
+        columns : list[str]
+            Columns of new table to copy values to, besides rowid.
+        select : list[str]
+            Expressions of old table to copy values from, by default columns.
+        """
+        new_table = table + "_new"
+        select = ["rowid"] + (select if select is not None else columns)
+        columns = ["rowid"] + columns
+        c.execute("""CREATE TABLE IF NOT EXISTS MigrationProgress (
+                     name varchar(255) PRIMARY KEY, last_rowid integer);""")
+        progress = c.execute("""SELECT last_rowid FROM MigrationProgress 
+                                WHERE name = ?""", (new_table,)).fetchone()
+        if progress is None:
+            c.execute("DROP TABLE IF EXISTS %s;" % new_table)
+            c.execute(create_sql % new_table)
+            c.execute("INSERT INTO MigrationProgress VALUES (?, 0)", (new_table,))
+            # rows changed after being copied are copied again
+            copy_row = """INSERT OR REPLACE INTO %s (%s) SELECT %s FROM %s 
+                          WHERE rowid = new.rowid AND rowid <= (SELECT last_rowid 
+                          FROM MigrationProgress WHERE name = '%s');""" % (
+                       new_table, ", ".join(columns), ", ".join(select), table,
+                       new_table)
+            delete_row = """DELETE FROM %s WHERE rowid = old.rowid;""" % new_table
+            c.execute("""CREATE TRIGGER %s_copy_insert AFTER INSERT ON %s 
+                         BEGIN %s END;""" % (new_table, table, copy_row))
+            c.execute("""CREATE TRIGGER %s_copy_update AFTER UPDATE ON %s 
+                         BEGIN %s %s END;""" % (new_table, table, delete_row, copy_row))
+            c.execute("""CREATE TRIGGER %s_copy_delete AFTER DELETE ON %s 
+                         BEGIN %s END;""" % (new_table, table, delete_row))
+        self._conn.commit()
+
+        while True:
+            c.execute("BEGIN IMMEDIATE")
+            progress = c.execute("""SELECT last_rowid FROM MigrationProgress 
+                                    WHERE name = ?""", (new_table,)).fetchone()
+            if progress is None:
+                # table replaced by another connection
+                return
+            last_rowid = progress[0]
+            rowids = c.execute("""SELECT MAX(rowid), COUNT(*) FROM (
+                                  SELECT rowid FROM %s WHERE rowid > ? 
+                                  ORDER BY rowid LIMIT ?)""" % table,
+                               (last_rowid, self._batch_size)).fetchone()
+            if rowids[1] == 0:
+                break
+            c.execute("""INSERT INTO %s (%s) SELECT %s FROM %s 
+                         WHERE rowid > ? AND rowid <= ?""" %
+                      (new_table, ", ".join(columns), ", ".join(select), table),
+                      (last_rowid, rowids[0]))
+            c.execute("UPDATE MigrationProgress SET last_rowid = ? WHERE name = ?",
+                      (rowids[0], new_table))
+            self._conn.commit()
+
+        # copy triggers are dropped with the table
+        indexes = [entry[0] for entry in c.execute(
+                   """SELECT sql FROM sqlite_master 
+                      WHERE type IN ('index', 'trigger') AND tbl_name = ? 
+                      AND sql IS NOT NULL AND name NOT LIKE ?""",
+                   (table, new_table + "_copy_%")).fetchall()]
+        # views would refer to a missing table while it is replaced
+        views = c.execute("""SELECT name, sql FROM sqlite_master 
+                             WHERE type = 'view'""").fetchall()
+        for name, sql in views:
+            c.execute("DROP VIEW %s;" % name)
+        c.execute("DROP TABLE %s;" % table)
+        c.execute("ALTER TABLE %s RENAME TO %s;" % (new_table, table))
+        for index in indexes:
+            c.execute(index)
+        for name, sql in views:
+            c.execute(sql)
+        c.execute("DELETE FROM MigrationProgress WHERE name = ?", (new_table,))
 
     def disconnect_db(self):
         """Closes the database connection and frees the database file from use.
+
+        Statistics used for choosing indexes are updated before closing, if
+        they are out of date.
         """    
         if self._conn != None:
+            self._conn.execute("PRAGMA optimize;")
             self._conn.close()
             self._conn = None
 
+    def _write_batched(self, sql, job_ads, commit_chunks=False):
+        """Executes sql for job ads in batches within a single transaction.
+
+        Job ads are read from job_ads in chunks of _batch_size, and each
+        chunk is sent to the database with a single executemany call. If
+        writing fails, the whole transaction is rolled back.
+
+        If commit_chunks is True, each chunk is instead read before a 
+        transaction is opened and committed on its own, so that slow producers
+        of job ads, e.g. classification in R, do not hold the write lock of
+        the database. If writing fails, only the failed chunk is rolled back.
+
+        Arguments
+        ----------
+        sql : str
+            Statement with named parameters of job ad columns.
+        job_ads : iterable[:class:`JobAd`]
+            Job ads to write, can be an iterator or a :class:`JobAdBatch`.
+        commit_chunks : bool
+            Whether to commit each chunk in a separate transaction.
+
+        Returns
+        ----------
+        counts : list[tuple(int, int)]
+            For each chunk, number of job ads and number of rows changed.
+        """
+        if self._conn == None:
+            self._connect_db()
+        c = self._conn.cursor()
+
+        # sqlite only binds named parameters of dictionaries
+        if isinstance(job_ads, JobAdBatch) and job_ads.columns == JobAd._cols:
+            job_ads = (dict(zip(JobAd._cols, row)) for row in job_ads.rows())
+        else:
+            job_ads = (job_ad.as_dict() if type(job_ad) is JobAd else job_ad
+                       for job_ad in job_ads)
+        counts = []
+        if commit_chunks:
+            chunk = list(islice(job_ads, self._batch_size))
+            while chunk:
+                with self._conn:
+                    c.executemany(sql, chunk)
+                    counts.append((len(chunk), c.rowcount))
+                chunk = list(islice(job_ads, self._batch_size))
+            return counts
+        with self._conn:
+            if not self._conn.in_transaction:
+                c.execute("BEGIN")
+            chunk = list(islice(job_ads, self._batch_size))
+            while chunk:
+                c.executemany(sql, chunk)
+                counts.append((len(chunk), c.rowcount))
+                chunk = list(islice(job_ads, self._batch_size))
+
+        return counts
+
     def store_ads(self, job_ads):
         """Stores NEW job ads in the database, existing ones are not updated.
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances containing job ads. Each dictionary 
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances containing job ads. Each dictionary 
             should have keys for site, searchterm, id, title, description, url. 
             See :class:'JobAdDB` description for details.
+
+        Returns
+        ----------
+        counts : dict
+            Numbers of inserted and ignored (already stored) job ads.
         """
+        counts = self._write_batched("""
+            INSERT INTO JobEntries
+            VALUES (:site, :searchterm, :id, :title, :url, %s, :date, 
+            :language, :relevant, :recommendation, :cluster)
+            ON CONFLICT DO NOTHING""" % self._description_param(), job_ads)
+        inserted = sum([changed for total, changed in counts])
 
+        return {"inserted": inserted,
+                "ignored": sum([total for total, changed in counts]) - inserted}
+
+    def upsert_ads(self, job_ads):
+        """Stores new job ads and updates parsed fields of existing ones.
+
+        For existing job ads, title, url and description are replaced, and
+        search term and cluster are filled in if missing. Date, language,
+        relevance and recommendation are kept.
+
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances.
+
+        Returns
+        ----------
+        counts : dict
+            Numbers of inserted and updated job ads.
+        """
+        if self._conn == None:
+            self._connect_db()
+        job_ads = list(job_ads)
+        site_ids = {}
+        for ad in job_ads:
+            site_ids.setdefault(ad["site"] or "", set()).add(ad["id"])
+        stored = sum([len(self.exists(site, ids)) for site, ids in site_ids.items()])
+        counts = self._write_batched("""
+            INSERT INTO JobEntries
+            VALUES (:site, :searchterm, :id, :title, :url, %s, :date, 
+            :language, :relevant, :recommendation, :cluster)
+            ON CONFLICT (site, id) DO UPDATE SET
+            title = excluded.title, url = excluded.url, 
+            description = excluded.description,
+            searchterm = COALESCE(searchterm, excluded.searchterm),
+            cluster = COALESCE(cluster, excluded.cluster)""" % self._description_param(),
+            job_ads)
+        changed = sum([changed for total, changed in counts])
+
+        return {"inserted": changed - stored, "updated": stored}
+
+    def exists(self, site, ids):
+        """Returns the ids of a site which are already stored in the database.
+
+        All ids are looked up with a single query on the primary key.
+
+        Arguments
+        ----------
+        site : str
+            Name of job ad site.
+        ids : iterable[str]
+            Ids of job ads to check.
+
+        Returns
+        ----------
+        stored_ids : set[str]
+            Ids which are stored in the database for the site.
+        """
         if self._conn == None:
             self._connect_db()
         c = self._conn.cursor()
 
-        for ad in job_ads:          
-            c.execute("""
-            INSERT OR IGNORE INTO JobEntries
-            VALUES (:site, :searchterm, :id, :title, :url, :description, :date, 
-            :language, :relevant, :recommendation)""", 
-            ad)
+        # ids are passed as a single JSON array, so any number can be checked
+        c.execute("""SELECT id FROM JobEntries WHERE site = ? 
+                     AND id IN (SELECT value FROM json_each(?))""",
+                  (site or "", json.dumps(list(ids))))
 
-        self._conn.commit()
+        return set([db_entry[0] for db_entry in c.fetchall()])
+
+    def get_known_ads(self):
+        """Returns (site, id) pairs of all job ads stored in the database.
+
+        Returns
+        ----------
+        known_ads : :class:`KnownAds`
+            Compact set of (site, id) pairs.
+        """
+        if self._conn == None:
+            self._connect_db()
+        c = self._conn.cursor()
+
+        return KnownAds(c.execute("""SELECT site, id FROM JobEntries"""))
 
     def get_ads(self, date_start, date_end, language="all"):
         """Returns job ads from the database.
 
         Filters by date and language. Jobs ads are returned as a list of
-        :class:`JobAd`.
+        :class:`JobAd`. See :meth:`iter_ads` for iterating over job ads 
+        without loading them all at once.
                 
         Arguments
         ----------
@@ -113,103 +869,581 @@ class JobAdDB:
         job_ads : list[:class:`JobAd`]
             List of :class:`JobAd` instances.
         """
+        return list(self.iter_ads(date_start, date_end, language))
+
+    def iter_ads(self, date_start, date_end, language="all", batch_size=None):
+        """Iterates over job ads in the database.
+
+        Filters by date and language like :meth:`get_ads`, but rows are
+        fetched batch_size at a time, so memory use doesn't grow with the
+        number of job ads. Job ads can be updated while iterating, as long as
+        their date is not changed.
+
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+             Earliest date of job ads. If None, all job ads since the start 
+             of the database are included.
+        date_end : :class:`datetime`
+            Latest date of job ads. If None, all job ads until end of database
+            are included.
+        language : str
+            Language of job ads, "all" for any language.
+        batch_size : int
+            Number of rows fetched at a time. If None, _batch_size is used.
+
+        Yields
+        ----------
+        job_ad : :class:`JobAd`
+            Job ad with all columns.
+        """
+        where, parameters = self._ad_filters(date_start, date_end, language)
+
+        return self._iter_query("SELECT * FROM JobEntries" + where, parameters,
+                                self._db_columns, batch_size)
+
+    def iter_ad_batches(self, date_start, date_end, language="all", batch_size=None):
+        """Iterates over job ads in the database in columnar batches.
+
+        Filters by date and language like :meth:`iter_ads`, but each batch
+        of rows is yielded as a :class:`JobAdBatch` without creating a 
+        :class:`JobAd` for each row.
+
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+             Earliest date of job ads. If None, all job ads since the start 
+             of the database are included.
+        date_end : :class:`datetime`
+            Latest date of job ads. If None, all job ads until end of database
+            are included.
+        language : str
+            Language of job ads, "all" for any language.
+        batch_size : int
+            Number of job ads in each batch. If None, _batch_size is used.
+
+        Yields
+        ----------
+        batch : :class:`JobAdBatch`
+            Job ads with all columns.
+        """
+        where, parameters = self._ad_filters(date_start, date_end, language)
+
+        return self._iter_query_batches("SELECT * FROM JobEntries" + where, parameters,
+                                        self._db_columns, batch_size)
+
+    def _ad_filters(self, date_start, date_end, language, named=False):
+        """Returns WHERE clause and its parameters filtering by date and language.
+
+        If named is True, parameters are named and returned as a dictionary.
+        """
+        filters = []
+        if language != "all":
+            filters.append(("language = %s", "filter_language", language))
+        if date_start != None:
+            filters.append(("date >= %s", "filter_date_start", date_start))
+        if date_end != None:
+            filters.append(("date <= %s", "filter_date_end", date_end))
+        if named:
+            conditions = [condition % (":" + name) for condition, name, value in filters]
+            parameters = dict([(name, value) for condition, name, value in filters])
+        else:
+            conditions = [condition % "?" for condition, name, value in filters]
+            parameters = [value for condition, name, value in filters]
+        if not conditions:
+            return "", parameters
+
+        return " WHERE " + " AND ".join(conditions), parameters
+
+    def _update_filtered(self, sql, job_ads, clusters, date_start, date_end, 
+                         language, commit_chunks):
+        """Executes an update of job ads, extended to their clusters if clusters.
+
+        Job ads in the same cluster are only updated if they match the date
+        and language filters, see :meth:`_ad_filters`.
+
+        Arguments
+        ----------
+        sql : str
+            UPDATE statement of job ads by site and id, with named parameters.
+        job_ads : iterable[:class:`JobAd`]
+            Job ads to update.
+
+        Other arguments are those of :meth:`update_ads_language`.
+
+        Returns
+        ----------
+        counts : dict
+            Number of updated job ads.
+        """
+        if clusters:
+            where, parameters = self._ad_filters(date_start, date_end, language, 
+                                                 named=True)
+            sql += " OR (cluster = :cluster%s)" % where.replace(" WHERE ", " AND ", 1)
+            if parameters:
+                job_ads = (dict(job_ad, **parameters) for job_ad in job_ads)
+        counts = self._write_batched(sql, job_ads, commit_chunks)
+
+        return {"updated": sum([changed for total, changed in counts])}
+
+    def iter_cluster_ads(self, date_start, date_end, language="all", batch_size=None):
+        """Iterates over one job ad of each cluster of near-duplicates.
+
+        Filters by date and language like :meth:`iter_ads`, and yields the
+        first stored job ad of each cluster within the filters. Job ads 
+        without a cluster are yielded individually. Results of processing 
+        the job ads can be stored for whole clusters, e.g. with 
+        :meth:`update_ads_language`.
+
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+             Earliest date of job ads. If None, all job ads since the start 
+             of the database are included.
+        date_end : :class:`datetime`
+            Latest date of job ads. If None, all job ads until end of database
+            are included.
+        language : str
+            Language of job ads, "all" for any language.
+        batch_size : int
+            Number of rows fetched at a time. If None, _batch_size is used.
+
+        Yields
+        ----------
+        job_ad : :class:`JobAd`
+            Job ad with all columns.
+        """
+        where, parameters = self._ad_filters(date_start, date_end, language)
+        # columns of the row with the smallest rowid are selected in each group,
+        # job ads without a cluster are grouped by site and id, as ids are 
+        # only unique within a site
+        sql = """SELECT *, MIN(rowid) FROM JobEntries%s 
+                 GROUP BY COALESCE(cluster, site || char(0) || id)""" % where
+
+        return self._iter_query(sql, parameters, self._db_columns, batch_size)
+
+    def store_clusters(self, clusters):
+        """Stores signatures of new clusters of near-duplicate job ads.
+
+        Arguments
+        ----------
+        clusters : iterable[tuple(str, bytes)]
+            Ids and packed signatures of clusters, see 
+            :meth:`ClusterIndex.assign`.
+        """
+        today = datetime.date.today()
+        self._write_batched("""INSERT OR IGNORE INTO Clusters VALUES (?, ?, ?)""",
+                            ((cluster, signature, today) 
+                             for cluster, signature in clusters))
+
+    def get_clusters(self, date_start=None):
+        """Returns signatures of clusters of near-duplicate job ads.
+
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+            Earliest creation date of clusters. If None, all clusters are
+            returned.
 
+        Returns
+        ----------
+        clusters : list[tuple(str, bytes)]
+            Ids and packed signatures of clusters, see 
+            :class:`ClusterIndex`.
+        """
         if self._conn == None:
-            self._conn = sqlite3.connect(self._db_filename)
+            self._connect_db()
         c = self._conn.cursor()
-
-        if language == "all":
-            if (date_start == None and date_end == None):
-                c.execute("""SELECT * FROM JobEntries""")
-            elif(date_start == None):
-                c.execute("""SELECT * FROM JobEntries WHERE date <= ? """, (date_2,)) 
-            elif(date_end == None):
-                c.execute("""SELECT * FROM JobEntries WHERE date >= ? """, (date_1,)) 
-            else:
-                c.execute("""SELECT * FROM JobEntries WHERE date >= ? AND date <= ? """,
-                          (date_start,date_end,)) 
+        if date_start == None:
+            c.execute("""SELECT cluster, signature FROM Clusters""")
         else:
-            if (date_start == None and date_end == None):
-                c.execute("""SELECT * FROM JobEntries WHERE language = ?""", (language,))
-            elif(date_start == None):
-                c.execute("""SELECT * FROM JobEntries 
-                             WHERE language = ? AND date <= ? """, (language,date_2)) 
-            elif(date_end == None):
-                c.execute("""SELECT * FROM JobEntries
-                             WHERE language = ? AND date >= ? """, (language,date_1)) 
-            else:
-                c.execute("""SELECT * FROM JobEntries
-                             WHERE language = ? AND date >= ? AND date <= ? """,
-                          (language, date_start,date_end,)) 
-        
-        results =  [JobAd.create(dict(zip(self._db_columns, db_entry))) 
-                for db_entry in c.fetchall()]
+            c.execute("""SELECT cluster, signature FROM Clusters WHERE date >= ?""",
+                      (date_start,))
 
-        return results
+        return c.fetchall()
 
-    def update_ads(self, job_ads):
-        """Updates existing job ads.
+    def get_ads_page(self, date_start, date_end, language="all", page_size=None,
+                     cursor=None):
+        """Returns a page of job ads from the database, ordered by date and key.
+
+        Filters by date and language like :meth:`get_ads`. Pages are read with
+        keyset pagination: the cursor of a page holds the (date, site, id) of its
+        last job ad, and the next page starts right after it in the index, so
+        later pages cost as much as the first one. Job ads stored while paging
+        are included if they sort after the cursor. Job ads without a date
+        are not included.
 
         Arguments
         ----------
+        date_start : :class:`datetime`
+             Earliest date of job ads. If None, all job ads since the start 
+             of the database are included.
+        date_end : :class:`datetime`
+            Latest date of job ads. If None, all job ads until end of database
+            are included.
+        language : str
+            Language of job ads, "all" for any language.
+        page_size : int
+            Maximum number of job ads in page. If None, _page_size is used.
+        cursor : str
+            Cursor token returned with the previous page. If None, the first
+            page is returned.
+
+        Returns
+        ----------
         job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances.
+            Job ads of page.
+        next_cursor : str
+            Cursor token of next page. None if this is the last page.
+        """
+        page_size = page_size if page_size is not None else self._page_size
+        if page_size < 1:
+            raise ValueError("Page size must be positive, got %s." % page_size)
+        conditions = []
+        parameters = []
+        if language != "all":
+            conditions.append("language = ?")
+            parameters.append(language)
+        if cursor != None:
+            #the cursor is at or after date_start, replacing it as lower bound
+            conditions.append("(date, site, id) > (?, ?, ?)")
+            parameters.extend(self._decode_cursor(cursor))
+        elif date_start != None:
+            conditions.append("date >= ?")
+            parameters.append(date_start)
+        else:
+            conditions.append("date IS NOT NULL")
+        if date_end != None:
+            conditions.append("date <= ?")
+            parameters.append(date_end)
+        #one extra row tells whether there is a next page
+        sql = ("SELECT * FROM JobEntries WHERE " + " AND ".join(conditions) +
+               " ORDER BY date, site, id LIMIT ?")
+        parameters.append(page_size + 1)
+
+        job_ads = list(self._iter_query(sql, parameters, self._db_columns))
+        next_cursor = None
+        if len(job_ads) > page_size:
+            del job_ads[page_size:]
+            last = job_ads[-1]
+            next_cursor = self._encode_cursor(last["date"], last["site"], last["id"])
+
+        return job_ads, next_cursor
+
+    @staticmethod
+    def _encode_cursor(date, site, id):
+        """Returns cursor token of (date, site, id) position.
+        """
+        position = json.dumps([str(date), site, id]).encode("utf-8")
+        return base64.urlsafe_b64encode(position).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        """Returns (date, site, id) position of cursor token.
+        """
+        try:
+            date, site, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (ValueError, TypeError, AttributeError):
+            raise ValueError("Invalid cursor %r." % (cursor,))
+
+        return date, site, id
+
+    def _iter_query(self, sql, parameters, columns, batch_size=None):
+        """Executes query and yields its rows as job ads, fetched in batches.
+
+        Arguments
+        ----------
+        sql : str
+            Query to execute.
+        parameters : list
+            Parameters of query.
+        columns : list[str]
+            Column names of rows.
+        batch_size : int
+            Number of rows fetched at a time. If None, _batch_size is used.
+
+        Yields
+        ----------
+        job_ad : :class:`JobAd`
+            Job ad of row.
         """
         if self._conn == None:
             self._connect_db()
         c = self._conn.cursor()
+        batch_size = batch_size if batch_size is not None else self._batch_size
 
-        for ad in job_ads:
-            c.execute("""
-            REPLACE INTO JobEntries
-            VALUES (:site, :searchterm, :id, :title, :url, :description, :date, 
-            :language, :relevant, :recommendation)""", 
-            ad)
+        c.execute(sql, parameters)
+        rows = c.fetchmany(batch_size)
+        while rows:
+            for db_entry in rows:
+                yield self._create_ad(columns, db_entry)
+            rows = c.fetchmany(batch_size)
 
-        self._conn.commit()
+    def _iter_query_batches(self, sql, parameters, columns, batch_size=None):
+        """Executes query and yields its rows as batches of job ads.
 
-    def update_ads_recommendation(self, job_ads):
-        """Updates the recommendation of job ads.
+        Compressed descriptions are decompressed, as batches are meant for 
+        processing whole columns.
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances with id and recommendation defined.
+        sql : str
+            Query to execute.
+        parameters : list
+            Parameters of query.
+        columns : list[str]
+            Column names of rows.
+        batch_size : int
+            Number of rows in each batch. If None, _batch_size is used. If 0,
+            all rows are returned in a single batch.
+
+        Yields
+        ----------
+        batch : :class:`JobAdBatch`
+            Job ads of rows.
         """
         if self._conn == None:
             self._connect_db()
         c = self._conn.cursor()
+        batch_size = batch_size if batch_size is not None else self._batch_size
 
-        for ad in job_ads:
-            c.execute("""
+        c.execute(sql, parameters)
+        rows = c.fetchmany(batch_size) if batch_size else c.fetchall()
+        while rows:
+            batch = JobAdBatch.from_rows(columns, rows)
+            if "description" in batch:
+                descriptions = batch["description"]
+                if any([type(description) is bytes for description in descriptions]):
+                    batch["description"] = [self._codec.decompress(description)
+                                            for description in descriptions]
+            yield batch
+            rows = c.fetchmany(batch_size) if batch_size else []
+
+    def search_ads(self, terms, limit=20):
+        """Searches titles and descriptions of job ads, best matches first.
+
+        Job ads containing all terms are ranked with BM25, matches in the
+        title weighing more than matches in the description. A term ending
+        with * matches any word starting with it.
+
+        Arguments
+        ----------
+        terms : str
+            Search terms separated by whitespace.
+        limit : int
+            Maximum number of job ads returned.
+
+        Returns
+        ----------
+        results : list[tuple(:class:`JobAd`, float, str)]
+            Matching job ads with their score, lower being better, and a
+            snippet of the description with matching terms in brackets.
+        """
+        if self._conn == None:
+            self._connect_db()
+        c = self._conn.cursor()
+
+        if c.execute("""SELECT * FROM sqlite_master WHERE name = 'JobEntriesFTS'""") \
+            .fetchone() == None:
+            raise EnvironmentError("Full-text search requires sqlite with FTS5.")
+        # quote terms, so that they are not interpreted as query syntax
+        query = " ".join(['"%s"%s' % (term.rstrip("*").replace('"', '""'),
+                                      "*" if term.endswith("*") else "")
+                          for term in terms.split() if term.rstrip("*")])
+        if query == "":
+            return []
+        entries = c.execute("""
+            SELECT %s, bm25(JobEntriesFTS, ?, ?) AS score,
+            snippet(JobEntriesFTS, 1, '[', ']', '...', 12)
+            FROM JobEntriesFTS JOIN JobEntries ON JobEntries.rowid = JobEntriesFTS.rowid
+            WHERE JobEntriesFTS MATCH ?
+            ORDER BY score LIMIT ?""" % 
+            ", ".join(["JobEntries." + column for column in self._db_columns]),
+            self._fts_weights + (query, limit))
+
+        return [(self._create_ad(self._db_columns, db_entry),
+                 db_entry[-2], db_entry[-1]) for db_entry in entries.fetchall()]
+
+    def update_ads(self, job_ads):
+        """Updates existing job ads.
+
+        The cluster of a job ad is kept if not defined in the update.
+
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances.
+
+        Returns
+        ----------
+        counts : dict
+            Number of updated job ads.
+        """
+        counts = self._write_batched("""
+            INSERT INTO JobEntries
+            VALUES (:site, :searchterm, :id, :title, :url, %s, :date, 
+            :language, :relevant, :recommendation, :cluster)
+            ON CONFLICT (site, id) DO UPDATE SET
+            searchterm = excluded.searchterm, 
+            title = excluded.title, url = excluded.url, 
+            description = excluded.description, date = excluded.date, 
+            language = excluded.language, relevant = excluded.relevant, 
+            recommendation = excluded.recommendation,
+            cluster = COALESCE(excluded.cluster, cluster)""" % self._description_param(),
+            job_ads)
+
+        return {"updated": sum([changed for total, changed in counts])}
+
+    def update_ads_recommendation(self, job_ads, clusters=False, date_start=None, 
+                                  date_end=None, language="all", commit_chunks=False):
+        """Updates the recommendation of job ads.
+
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances with site, id and recommendation defined.
+        clusters : bool
+            If True, job ads in the same cluster are updated as well, and
+            job ads should have cluster defined.
+        date_start : :class:`datetime`
+            Earliest date of job ads in the same cluster to update. If None,
+            there is no earliest date.
+        date_end : :class:`datetime`
+            Latest date of job ads in the same cluster to update. If None,
+            there is no latest date.
+        language : str
+            Language of job ads in the same cluster to update, "all" for any 
+            language.
+        commit_chunks : bool
+            If True, job ads are committed _batch_size at a time, and are
+            only read from job_ads while no transaction is open.
+
+        Returns
+        ----------
+        counts : dict
+            Number of updated job ads.
+        """
+        return self._update_filtered("""
             UPDATE JobEntries
             SET recommendation = :recommendation
-            WHERE id = :id""",
-            ad)
-        
-        
-        self._conn.commit()
+            WHERE site = COALESCE(:site, '') AND id = :id""",
+            job_ads, clusters, date_start, date_end, language, commit_chunks)
 
-    def update_ads_language(self, job_ads):
+    def update_ads_language(self, job_ads, clusters=False, date_start=None, 
+                           date_end=None, language="all", commit_chunks=False):
         """Updates the language of job ads.
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances with id and language defined.
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances with site, id and language defined.
+        clusters : bool
+            If True, job ads in the same cluster are updated as well, and
+            job ads should have cluster defined.
+        date_start : :class:`datetime`
+            Earliest date of job ads in the same cluster to update. If None,
+            there is no earliest date.
+        date_end : :class:`datetime`
+            Latest date of job ads in the same cluster to update. If None,
+            there is no latest date.
+        language : str
+            Language of job ads in the same cluster to update, "all" for any 
+            language.
+        commit_chunks : bool
+            If True, job ads are committed _batch_size at a time, and are
+            only read from job_ads while no transaction is open.
+
+        Returns
+        ----------
+        counts : dict
+            Number of updated job ads.
+        """
+        return self._update_filtered("""
+            UPDATE JobEntries
+            SET language = :language
+            WHERE site = COALESCE(:site, '') AND id = :id""",
+            job_ads, clusters, date_start, date_end, language, commit_chunks)
+
+    def compress_descriptions(self, codec="zlib", sample_size=2000, 
+                              dictionary_size=None):
+        """Compresses descriptions of stored job ads and new job ads.
+
+        A dictionary is trained on a sample of stored descriptions, and all
+        descriptions are compressed again with it, _batch_size rows per 
+        transaction. Job ads stored later are compressed with the same codec
+        and dictionary, which are kept in the database. Descriptions are 
+        decompressed when read from a :class:`JobAd`. Finally the database
+        is vacuumed, so that the freed space is returned.
+
+        While descriptions are compressed, the full-text index decompresses
+        them with a function of this library, so other programs, such as 
+        the sqlite3 shell, can't store or update job ads in the database. 
+        Storing descriptions uncompressed again lifts the restriction.
+
+        Arguments
+        ----------
+        codec : str
+            "zlib", "zstd" (requires the zstandard package) or None to store
+            descriptions uncompressed again.
+        sample_size : int
+            Number of descriptions dictionary is trained on.
+        dictionary_size : int
+            Maximum size of dictionary in bytes, see :func:`train_dictionary`.
+
+        Returns
+        ----------
+        sizes : dict
+            Number of rewritten job ads, and bytes taken by descriptions 
+            before and after.
         """
         if self._conn == None:
             self._connect_db()
         c = self._conn.cursor()
+        size_sql = "SELECT SUM(LENGTH(CAST(description AS BLOB))) FROM JobEntries"
+        size_before = c.execute(size_sql).fetchone()[0] or 0
 
-        for ad in job_ads:
-            c.execute("""
-            UPDATE JobEntries
-            SET language = :language
-            WHERE id = :id""",
-            ad)
-        
-        self._conn.commit()
+        with self._conn:
+            if not self._conn.in_transaction:
+                c.execute("BEGIN")
+            dictionary = None
+            if codec is not None:
+                # unknown and unavailable codecs are rejected before training
+                TextCodec().set_current(codec)
+                samples = [entry[0] for entry in c.execute(
+                    """SELECT description_text(description) FROM JobEntries 
+                       WHERE description IS NOT NULL 
+                       ORDER BY random() LIMIT ?""", (sample_size,))]
+                dictionary = train_dictionary(samples, codec, dictionary_size)
+                self._create_fulltext(c, True)
+            c.execute("INSERT INTO Compression (codec, dictionary, date) VALUES (?, ?, ?)",
+                      (codec, dictionary, datetime.date.today()))
+            self._codec.add_dictionary(c.lastrowid, dictionary)
+            self._codec.set_current(codec, c.lastrowid)
+
+        last_rowid = 0
+        rows = 0
+        while True:
+            with self._conn:
+                batch = c.execute("""SELECT MAX(rowid), COUNT(*) FROM (
+                                     SELECT rowid FROM JobEntries WHERE rowid > ? 
+                                     ORDER BY rowid LIMIT ?)""",
+                                  (last_rowid, self._batch_size)).fetchone()
+                if batch[1] == 0:
+                    break
+                c.execute("""UPDATE JobEntries 
+                             SET description = compress_description(
+                                 description_text(description))
+                             WHERE rowid > ? AND rowid <= ?""", (last_rowid, batch[0]))
+                last_rowid = batch[0]
+                rows += batch[1]
+        if codec is None:
+            with self._conn:
+                c.execute("BEGIN")
+                self._create_fulltext(c, False)
+        c.execute("VACUUM;")
+
+        return {"rows": rows, "size_before": size_before,
+                "size_after": c.execute(size_sql).fetchone()[0] or 0}
 
     def get_classified_ads(self, 
             date_start=datetime.datetime.strptime("01-01-2015", "%d-%m-%Y"), 
@@ -217,6 +1451,9 @@ class JobAdDB:
         """Retrieves classified job ads, i.e. ads with relevant set to 0 or 1, 
         from database.
         
+        See :meth:`iter_classified_ads` for iterating over job ads without 
+        loading them all at once.
+
         Arguments
         ----------
         date_start : :class:`datetime`
@@ -234,116 +1471,300 @@ class JobAdDB:
         job_ads : list[:class:`JobAd`]
             List of :class:`JobAd` instances.
         """
+        return list(self.iter_classified_ads(date_start, date_end, language, 
+                                             all_columns))
 
-        if self._conn == None:
-            self._conn = sqlite3.connect(self._db_filename)
-        c = self._conn.cursor()
+    def iter_classified_ads(self, 
+            date_start=datetime.datetime.strptime("01-01-2015", "%d-%m-%Y"), 
+            date_end=datetime.date.today(), language="English", all_columns=False,
+            batch_size=None):
+        """Iterates over classified job ads, i.e. ads with relevant set to 0 or 1.
+
+        Filters like :meth:`get_classified_ads`, but rows are fetched
+        batch_size at a time, so memory use doesn't grow with the number of
+        job ads.
+        
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+            Earliest date of job ads. Default is start of 2015.
+        date_end : :class:`datetime`
+            Latest date of job ads. Default is present day. 
+        language : str
+            Language of job ads. Default is "English."
+        all_columns : bool
+            If True, all columns are included. If False, only site, search 
+            term, title, description, language and relevant are included.
+        batch_size : int
+            Number of rows fetched at a time. If None, _batch_size is used.
+
+        Yields
+        ----------
+        job_ad : :class:`JobAd`
+            Classified job ad.
+        """
+        columns, sql = self._classified_query(all_columns)
+
+        return self._iter_query(sql, [language, date_start, date_end], columns,
+                                batch_size)
+
+    def get_classified_batch(self, 
+            date_start=datetime.datetime.strptime("01-01-2015", "%d-%m-%Y"), 
+            date_end=datetime.date.today(), language="English", all_columns=False):
+        """Retrieves classified job ads as a single :class:`JobAdBatch`.
+
+        Filters like :meth:`get_classified_ads`, e.g. for training the 
+        classifier on whole columns.
+
+        Arguments
+        ----------
+        date_start : :class:`datetime`
+            Earliest date of job ads. Default is start of 2015.
+        date_end : :class:`datetime`
+            Latest date of job ads. Default is present day. 
+        language : str
+            Language of job ads. Default is "English."
+        all_columns : bool
+            If True, all columns are included. If False, only site, search 
+            term, title, description, language and relevant are included.
 
+        Returns
+        ----------
+        batch : :class:`JobAdBatch`
+            Classified job ads.
+        """
+        columns, sql = self._classified_query(all_columns)
+        for batch in self._iter_query_batches(sql, [language, date_start, date_end],
+                                              columns, 0):
+            return batch
+
+        return JobAdBatch.from_rows(columns, [])
+
+    def _classified_query(self, all_columns):
+        """Returns columns and query of classified job ads, see 
+        :meth:`iter_classified_ads`.
+        """
         if all_columns == 0:
             columns = ["site", "searchterm" , "title", "description", 
                        "language", "relevant"]
-            entries = c.execute("""
-                                SELECT site, searchterm, title, description, 
-                                language, relevant
-                                FROM JobEntries
-                                WHERE relevant != 'None' AND language == ? 
-                                      AND date >= ? AND date <= ?""",
-                                (language, date_start, date_end))
         else:
             columns = self._db_columns
-            entries = c.execute("""
-                                SELECT * FROM JobEntries
-                                WHERE relevant != 'None' AND language == ? 
-                                AND date >= ? AND date <= ?""",
-                                (language, date_start, date_end))
+        sql = """SELECT %s FROM JobEntries
+                 WHERE relevant IN (0, 1) AND language == ? 
+                 AND date >= ? AND date <= ?""" % ", ".join(columns)
 
-        results = [JobAd.create(dict(zip(columns, db_entry))) 
-                for db_entry in c.fetchall()]
+        return columns, sql
 
-        return results
+    def _open_output(self, filename, compress=False):
+        """Returns buffered UTF-8 text file for writing, gzip compressed if
+        compress is True.
+        """
+        if compress:
+            # level 6 compresses nearly as well as the default 9, and faster
+            return gzip.open(filename, "wt", compresslevel=6, encoding="utf-8", 
+                             newline="")
+        return open(filename, "w", encoding="utf-8", newline="", 
+                    buffering=self._output_buffer_size)
 
-    def write_HTML_file(self, job_ads, filename):
+    def write_HTML_file(self, job_ads, filename, compress=False):
         """Writes jobs ads to an HTML file.
 
-        The HTML file uses a local css file, jobsearch.css, as style
-        sheet.
+        The header of the table is written first, then a row for each job ad
+        as job ads are iterated, and finally the end of the table, so memory
+        use and time per job ad don't grow with the number of job ads. The 
+        HTML file uses a local css file, jobsearch.css, as style sheet.
 
         Arguments
         ----------
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances.
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances, written as they are iterated.
         filename : str
             Name of file to write. Any existing file is overwritten.
+        compress : bool
+            Whether the file is gzip compressed, e.g. for filenames ending 
+            with .html.gz.
         """
-        row_number = 0
-        html_start = """<!DOCTYPE HTML><html><head>
-            <meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
-            <script type="text/javascript">function hideRow(rownumber)
-            {document.getElementById(rownumber).style.display='none';}
-            </script><link rel="stylesheet" href='jobsearch.css' />
-            </head><body><table>"""
-        html_start = html_start + """
-            <tr class="headers">
-                <th class="searchterm">Search term</th>
-                <th class="site">Site</th>
-                <th class="jobtitle">Job title</th>
-                <th class="description">Description</th>
-                <th class="date">Date</th>
-                <th class="url">URL</th>
-                <th class="language">Language</th>
-                <th class="relevant">Relevant</th>
-                <th class="relevant">Recommendation</th>
-                <th></th>
-            </tr>"""
-        for ad in job_ads:
-            ad_list = [ad[column] for column in self._db_columns]
-            html_entry = """
-            <tr class="%s" origsite="%s" id="%d">
-                <td class="searchterm">%s</td>
-                <td class="site">%s</td>
-                <td class="jobtitle">%s</td>
-                <td class="description">%s</td>
-                <td class="date">%s</td>
-                <td class="url"><a href="%s">Link</a></td>
-                <td class="language">%s</td>
-                <td class="relevant">%s</td>
-                <td class="recommendation">%s</td>
-                <td class="hidebutton">
-                    <input type="button" id="hidebutton" value="Hide" 
-                    onclick='hideRow("%d");' />
-                </td>
-            </tr>""" % (
-                ad_list[1], ad_list[0], row_number, ad_list[1],
-                ad_list[0], ad_list[3], ad_list[5], 
-                ad_list[6], ad_list[4], ad_list[7], 
-                ad_list[8], ad_list[9], row_number)
-            html_start = html_start + html_entry
-            row_number = row_number + 1;
-        html_start = html_start + "</table></body></html>"
-        file = codecs.open(filename, "w", encoding="utf-8")
-        file.write(html_start)
-        file.close()
-
-    def write_CSV_file(self, job_ads, filename):
+        with self._open_output(filename, compress) as file:
+            file.write(_HTML_HEADER)
+            for row_number, ad in enumerate(job_ads):
+                file.write(_HTML_ROW % {
+                    "searchterm": ad["searchterm"], "site": ad["site"], 
+                    "row": row_number, "title": ad["title"], 
+                    "description": ad["description"], "date": ad["date"], 
+                    "url": ad["url"], "language": ad["language"],
+                    "relevant": ad["relevant"], 
+                    "recommendation": ad["recommendation"]})
+            file.write(_HTML_FOOTER)
+
+    def write_HTML_report(self, job_ads, filename, chunk_size=None):
+        """Writes job ads to an HTML page which loads and renders rows lazily.
+
+        Job ads are written as JSON to data files of chunk_size job ads in 
+        the directory <filename without extension>_data, as they are 
+        iterated. The page itself is small, rows are rendered only when 
+        scrolled into view and data files are loaded when their rows are 
+        first needed, so reports of any size open instantly. Rows can be 
+        hidden like in :meth:`write_HTML_file`. Data files are scripts 
+        rather than plain JSON, so that the page works when opened from 
+        the local file system.
+
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances, written as they are iterated.
+        filename : str
+            Name of page to write. Any existing page and data files are 
+            overwritten.
+        chunk_size : int
+            Number of job ads in each data file. If None, _report_chunk_size
+            is used.
+
+        Returns
+        ----------
+        rows : int
+            Number of job ads written.
+        """
+        chunk_size = chunk_size if chunk_size is not None else self._report_chunk_size
+        if chunk_size < 1:
+            raise ValueError("Chunk size should be positive, got %d." % chunk_size)
+        data_dir = os.path.splitext(filename)[0] + "_data"
+        os.makedirs(data_dir, exist_ok=True)
+        for name in os.listdir(data_dir):
+            if name.startswith("chunk_") and name.endswith(".js"):
+                os.remove(os.path.join(data_dir, name))
+
+        columns = ["searchterm", "site", "title", "description", "date", "url", 
+                   "language", "relevant", "recommendation"]
+        job_ads = iter(job_ads)
+        rows = 0
+        number = 0
+        chunk = list(islice(job_ads, chunk_size))
+        while chunk:
+            data = json.dumps([[ad[column] for column in columns] for ad in chunk],
+                              default=str, ensure_ascii=False, separators=(",", ":"))
+            with self._open_output(os.path.join(data_dir, "chunk_%05d.js" % number)) \
+                as file:
+                file.write("jobAdChunk(%d, %s);\n" % (number, data))
+            rows += len(chunk)
+            number += 1
+            chunk = list(islice(job_ads, chunk_size))
+        with self._open_output(filename) as file:
+            file.write(_HTML_REPORT % {"rows": rows, "chunk_size": chunk_size, 
+                                       "row_height": 120, "prefix": json.dumps(
+                                           os.path.basename(data_dir) + "/chunk_")})
+
+        return rows
+
+    def _arrow_format(self, filename, file_format):
+        """Returns format of Arrow file, checking that pyarrow is available.
+        """
+        if file_format is None:
+            file_format = "parquet" if filename.endswith((".parquet", ".pq")) else "arrow"
+        if file_format not in self._arrow_formats:
+            raise ValueError("Unknown file format %s, should be one of %s." %
+                             (file_format, ", ".join(self._arrow_formats)))
+        if pyarrow is None:
+            raise EnvironmentError("%s files require the pyarrow package." % 
+                                   file_format.capitalize())
+        return file_format
+
+    def write_arrow_file(self, batches, filename, file_format=None):
+        """Writes job ads to an Arrow IPC or Parquet file.
+
+        Job ads are written one record batch at a time, so memory use 
+        doesn't grow with the number of job ads. Arrow IPC files can be 
+        memory-mapped by readers. Columns are typed, see 
+        :meth:`JobAdBatch.to_arrow`.
+
+        Arguments
+        ----------
+        batches : iterable[:class:`JobAdBatch`]
+            Batches of job ads with all columns, e.g. from 
+            :meth:`iter_ad_batches`.
+        filename : str
+            Name of file to write. Any existing file is overwritten.
+        file_format : str
+            "arrow" or "parquet". If None, files ending with .parquet or .pq
+            are written as Parquet and others as Arrow.
+
+        Returns
+        ----------
+        rows : int
+            Number of job ads written.
+        """
+        file_format = self._arrow_format(filename, file_format)
+        schema = JobAdBatch.from_rows(self._db_columns, []).to_arrow().schema
+        if file_format == "parquet":
+            writer = pyarrow.parquet.ParquetWriter(filename, schema)
+        else:
+            writer = pyarrow.ipc.new_file(filename, schema)
+        rows = 0
+        try:
+            for batch in batches:
+                writer.write_batch(batch.to_arrow())
+                rows += len(batch)
+        finally:
+            writer.close()
+
+        return rows
+
+    def import_arrow_file(self, filename, file_format=None):
+        """Stores job ads of an Arrow IPC or Parquet file in the database.
+
+        Job ads are read one record batch at a time and written with 
+        :meth:`update_ads`, so job ads already in the database are replaced
+        by the ones in the file. Fields of the file which are not 
+        :class:`JobAd` columns are ignored.
+
+        Arguments
+        ----------
+        filename : str
+            Name of file, e.g. written by :meth:`write_arrow_file`.
+        file_format : str
+            "arrow" or "parquet". If None, files ending with .parquet or .pq
+            are read as Parquet and others as Arrow.
+
+        Returns
+        ----------
+        rows : int
+            Number of job ads read.
+        """
+        file_format = self._arrow_format(filename, file_format)
+        if file_format == "parquet":
+            record_batches = pyarrow.parquet.ParquetFile(filename).iter_batches(
+                batch_size=self._batch_size)
+        else:
+            reader = pyarrow.ipc.open_file(pyarrow.memory_map(filename))
+            record_batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        rows = 0
+        for record_batch in record_batches:
+            batch = JobAdBatch.from_arrow(record_batch)
+            self.update_ads(batch)
+            rows += len(batch)
+
+        return rows
+
+    def write_CSV_file(self, job_ads, filename, compress=False):
         """Writes jobs ads to a CSV file (Excel style).
 
-        job_ads : list[:class:`JobAd`]
-            List of :class:`JobAd` instances.
+        job_ads : iterable[:class:`JobAd`]
+            :class:`JobAd` instances, written as they are iterated.
         filename : str
             Name of file to write to. Any existing file is overwritten.
+        compress : bool
+            Whether the file is gzip compressed.
         """
 
         headers = ["Search term", "Site", "Job title", "Description", "Date", 
                    "URL", "Language", "Relevant", "Recommendation"]
-        file = codecs.open(filename, "w", encoding="utf-8")
-        csv_writer = csv.writer(file, dialect=csv.excel)
-        csv_writer.writerow(headers)
-        for ad in job_ads:
-            csv_writer.writerow([
-                ad[key] for key in ["searchterm", "site", "title", "description", 
-                                    "date", "url", "language", "relevant", 
-                                    "recommendation"]])
-        file.close()
+        with self._open_output(filename, compress) as file:
+            csv_writer = csv.writer(file, dialect=csv.excel)
+            csv_writer.writerow(headers)
+            for ad in job_ads:
+                csv_writer.writerow([
+                    ad[key] for key in ["searchterm", "site", "title", "description", 
+                                        "date", "url", "language", "relevant", 
+                                        "recommendation"]])
 
 
 
@@ -13,6 +13,10 @@ class JobAdGUI(tk.Frame):
     ----------
     db_data : list[:class:`JobAd`]
         List of :class:`JobAd` instances.
+    load_more : callable
+        Function without arguments returning the next list of :class:`JobAd`
+        instances to classify, an empty list when there are no more. If None,
+        only db_data is shown.
     """
 
     #db columns
@@ -23,13 +27,14 @@ class JobAdGUI(tk.Frame):
     language_options = [None, 'English', 'Finnish']
     relevant_options = [None, 0, 1]
 
-    def __init__(self, db_data):
+    def __init__(self, db_data, load_more=None):
         if (len(db_data) == 0):
             raise ValueError("No job ads provided to JobAdGUI.")
         #use ordered dictionary for grid display 
         self.ad_storage = OrderedDict()
-        for entry in db_data:
-            self.ad_storage[entry['id']] = [entry[column] for column in self._db_data_columns]
+        self.addAds(db_data)
+        self.load_more = load_more
+        self.load_button = None
         
         #init window, canvas needed for scrollbars
         self.parent = tk.Tk() #=root
@@ -67,6 +72,8 @@ class JobAdGUI(tk.Frame):
                 for widget in row:
                     widget.destroy()
         self.frame._widgets = []
+        #(site, id) keys of job ads in table rows
+        self.frame._keys = []
 
         #table headers
         current_row = []
@@ -91,6 +98,11 @@ class JobAdGUI(tk.Frame):
                            command=self.storeDataExit)
         button.grid(row=2, column=len(self._db_data_columns), sticky="nsew", 
                     padx=1, pady=1)
+        if (self.load_more != None and self.load_button == None):
+            self.load_button = tk.Button(self.frame,text="Store data and load more", 
+                                         command=self.storeLoadMore)
+            self.load_button.grid(row=3, column=len(self._db_data_columns), 
+                                  sticky="nsew", padx=1, pady=1)
         
         #process job ads   
         i=1
@@ -98,6 +110,7 @@ class JobAdGUI(tk.Frame):
             current_row = []
             #if not classified
             if (self.ad_storage[id][8] == None):
+                self.frame._keys.append(id)
                 for column in range(0, len(self.ad_storage[id])):
                     #Divide table text into lines and set widths of columns. Also 
                     #initialize optionmenus for language and relevant columns.
@@ -135,6 +148,18 @@ class JobAdGUI(tk.Frame):
                 self.frame._widgets.append(current_row)
                 i = i + 1
 
+    def addAds(self, db_data):
+        """Adds job ads to the instance variable ad_storage.
+
+        Arguments
+        ----------
+        db_data : list[:class:`JobAd`]
+            List of :class:`JobAd` instances.
+        """
+        for entry in db_data:
+            self.ad_storage[(entry['site'], entry['id'])] = [entry[column] for column 
+                                                              in self._db_data_columns]
+
     def onFrameConfigure(self, event):
         """Reset the scroll region to encompass the inner frame.
         """
@@ -148,7 +173,7 @@ class JobAdGUI(tk.Frame):
             return 
         else:
             for i in range(1, len(self.frame._widgets)):
-                id = self.frame._widgets[i][2]["text"]
+                id = self.frame._keys[i - 1]
                 if (self.frame._widgets[i][7].variable.get() == 'None'):
                     self.ad_storage[id][7] = None
                 else:
@@ -173,6 +198,22 @@ class JobAdGUI(tk.Frame):
         print("populated")
         print("length ", len(self.frame._widgets), len(self.ad_storage))
 
+    def storeLoadMore(self):
+        """Stores data from GUI table and adds the next job ads from load_more.
+        The button is removed when there are no more job ads. Should only be 
+        called while GUI is active!
+        """
+        if (self.ad_storage == None or self.frame == None):
+            return 
+        self.collectTableData()
+        db_data = self.load_more()
+        if (len(db_data) == 0):
+            self.load_more = None
+            self.load_button.destroy()
+            self.load_button = None
+        self.addAds(db_data)
+        self.populateTable()
+
     def storeDataExit(self):
         """Stores data from GUI table and exits. Should only be called while
         GUI is active!
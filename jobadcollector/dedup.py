@@ -0,0 +1,213 @@
+﻿import hashlib
+import random
+import re
+import struct
+import unicodedata
+import zlib
+
+
+# number of hash functions in MinHash signatures
+NUM_PERM = 64
+# length of character shingles
+SHINGLE_SIZE = 5
+# minimum length of normalized text for job ads to be clustered
+MIN_LENGTH = 20
+
+# Mersenne prime modulus and coefficients of hash functions (a * x + b) % p,
+# fixed so that signatures can be compared across runs
+_PRIME = 2**61 - 1
+_rng = random.Random(2017)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME))
+                 for i in range(NUM_PERM)]
+_SIGNATURE = struct.Struct("<%dQ" % NUM_PERM)
+
+
+def normalize_text(text):
+    """Returns text in lower case with punctuation and extra whitespace removed.
+
+    Arguments
+    ----------
+    text : str
+        Text to normalize. None is normalized to an empty string.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+def content_hash(text):
+    """Returns hash of normalized text as 16 hexadecimal characters.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def minhash_signature(text):
+    """Returns MinHash signature of the character shingles of text.
+
+    The share of equal values in the signatures of two texts estimates the
+    Jaccard similarity of their shingle sets.
+
+    Arguments
+    ----------
+    text : str
+        Normalized text.
+
+    Returns
+    ----------
+    signature : tuple[int]
+        NUM_PERM minimum hash values.
+    """
+    shingles = set([zlib.crc32(text[i:i + SHINGLE_SIZE].encode("utf-8"))
+                    for i in range(max(len(text) - SHINGLE_SIZE + 1, 1))])
+    return tuple([min([(a * x + b) % _PRIME for x in shingles])
+                  for a, b in _PERMUTATIONS])
+
+
+def fingerprints(texts):
+    """Returns content hashes and MinHash signatures of job ad texts.
+
+    Intended to be run in a worker process after parsing, arguments and
+    results are plain picklable values.
+
+    Arguments
+    ----------
+    texts : list[tuple(str, str)]
+        Titles and descriptions of job ads.
+
+    Returns
+    ----------
+    fingerprints : list[tuple(str, tuple[int])]
+        Content hash and signature of each job ad. None for job ads with
+        less than MIN_LENGTH characters of normalized text, which are not
+        clustered.
+    """
+    results = []
+    for title, description in texts:
+        text = normalize_text("%s %s" % (title or "", description or ""))
+        if len(text) < MIN_LENGTH:
+            results.append(None)
+        else:
+            results.append((content_hash(text), minhash_signature(text)))
+
+    return results
+
+
+def pack_signature(signature):
+    """Returns signature as bytes for storing in the database.
+    """
+    return _SIGNATURE.pack(*signature)
+
+
+def unpack_signature(packed):
+    """Returns signature stored with :func:`pack_signature`.
+    """
+    return _SIGNATURE.unpack(packed)
+
+
+def similarity(signature1, signature2):
+    """Returns estimated Jaccard similarity of texts of two signatures.
+    """
+    return sum([1 for value1, value2 in zip(signature1, signature2)
+                if value1 == value2]) / len(signature1)
+
+
+class ClusterIndex:
+    """Locality-sensitive hashing index of near-duplicate job ad clusters.
+
+    Each cluster is represented by the signature of its first job ad, and
+    has the content hash of that job ad as its id. Signatures are split into
+    bands, and a job ad is a candidate for a cluster if any band of their
+    signatures is equal. Candidates are accepted if their estimated
+    similarity is at least threshold, so near-duplicates are found without
+    comparing job ads to every cluster.
+
+    Arguments
+    ----------
+    clusters : iterable[tuple(str, bytes)]
+        Ids and packed signatures of existing clusters.
+    bands : int
+        Number of bands signatures are split into, should divide NUM_PERM.
+    threshold : float
+        Minimum estimated similarity of job ads in a cluster.
+    """
+
+    def __init__(self, clusters=(), bands=16, threshold=0.8):
+        if NUM_PERM % bands != 0:
+            raise ValueError("Number of bands %d doesn't divide signature length %d." %
+                             (bands, NUM_PERM))
+        self._rows = NUM_PERM // bands
+        self._threshold = threshold
+        self._signatures = {}
+        self._buckets = {}
+        for cluster, packed in clusters:
+            self.add(cluster, unpack_signature(packed))
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _bands(self, signature):
+        return [(band, signature[band:band + self._rows])
+                for band in range(0, NUM_PERM, self._rows)]
+
+    def add(self, cluster, signature):
+        """Adds a cluster to the index.
+
+        Arguments
+        ----------
+        cluster : str
+            Id of cluster.
+        signature : tuple[int]
+            Signature representing cluster.
+        """
+        self._signatures[cluster] = signature
+        for key in self._bands(signature):
+            self._buckets.setdefault(key, []).append(cluster)
+
+    def find(self, content_hash, signature):
+        """Returns the cluster of a job ad, or None if it has no near-duplicates.
+
+        Arguments
+        ----------
+        content_hash : str
+            Content hash of job ad.
+        signature : tuple[int]
+            Signature of job ad.
+        """
+        if content_hash in self._signatures:
+            return content_hash
+        best, best_similarity = None, self._threshold
+        for key in self._bands(signature):
+            for cluster in self._buckets.get(key, []):
+                cluster_similarity = similarity(signature, self._signatures[cluster])
+                if cluster_similarity >= best_similarity:
+                    best, best_similarity = cluster, cluster_similarity
+
+        return best
+
+    def assign(self, job_ads, fingerprints):
+        """Sets the cluster of job ads, creating new clusters as needed.
+
+        Arguments
+        ----------
+        job_ads : list[:class:`JobAd`]
+            Job ads to cluster.
+        fingerprints : list[tuple(str, tuple[int])]
+            Fingerprints of job ads, see :func:`fingerprints`.
+
+        Returns
+        ----------
+        new_clusters : list[tuple(str, bytes)]
+            Ids and packed signatures of created clusters.
+        """
+        new_clusters = []
+        for job_ad, fingerprint in zip(job_ads, fingerprints):
+            if fingerprint is None:
+                continue
+            content_hash, signature = fingerprint
+            cluster = self.find(content_hash, signature)
+            if cluster is None:
+                cluster = content_hash
+                self.add(cluster, signature)
+                new_clusters.append((cluster, pack_signature(signature)))
+            job_ad["cluster"] = cluster
+
+        return new_clusters
@@ -0,0 +1,478 @@
+﻿import asyncio
+import codecs
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of requests to a single host.
+
+    Tokens are added to the bucket at a constant rate up to its capacity
+    (burst). Each request takes one token, waiting asynchronously for a new
+    one if the bucket is empty, so only requests to the same host are held
+    back.
+
+    Arguments
+    ----------
+    rate : float
+        Number of requests allowed per second.
+    burst : int
+        Number of requests which can be sent at once after the host has been
+        idle.
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        if rate <= 0 or burst < 1:
+            raise ValueError("TokenBucket rate should be positive and burst at least 1.")
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        """Adds tokens accumulated since last update.
+        """
+        now = time.monotonic()
+        if self._updated is not None:
+            self._tokens = min(self._burst,
+                               self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Takes a token from the bucket, waiting for one if necessary.
+        """
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class ConnectionPool:
+    """Pool of keep-alive HTTP connections shared by a search run.
+
+    Connections to each host are kept open after a request and reused by
+    later requests to the same host, so that a search run does not have to
+    reconnect for every page. The pool keeps count of new and reused
+    connections.
+
+    The pool should be used as an asynchronous context manager and passed to
+    every :class:`JobAdFetcher` of the run::
+
+        async with ConnectionPool() as pool:
+            async with JobAdFetcher(pool=pool) as fetcher:
+                page = await fetcher.fetch(url)
+
+    Arguments
+    ----------
+    size : int
+        Maximum number of open connections in total.
+    host_size : int
+        Maximum number of open connections to a single host.
+    keepalive : float
+        Time in seconds an idle connection is kept open.
+    """
+
+    def __init__(self, size=20, host_size=2, keepalive=30):
+        self._size = size
+        self._host_size = host_size
+        self._keepalive = keepalive
+        self._connector = None
+        # connection counters
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_create_end.append(self._on_create)
+        self.trace_config.on_connection_reuseconn.append(self._on_reuse)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def connector(self):
+        """:class:`aiohttp.TCPConnector` holding the pooled connections.
+        """
+        if self._connector is None:
+            self._connector = aiohttp.TCPConnector(
+                limit=self._size, limit_per_host=self._host_size,
+                keepalive_timeout=self._keepalive)
+
+        return self._connector
+
+    async def close(self):
+        """Closes all pooled connections.
+        """
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+    async def _on_create(self, session, context, params):
+        self.new_connections += 1
+
+    async def _on_reuse(self, session, context, params):
+        self.reused_connections += 1
+
+
+class JobAdFetcher:
+    """Shared asynchronous HTTP session for :class:`JobAdParser` instances.
+
+    All parsers of a search run fetch their pages through a single
+    :class:`JobAdFetcher`, which allows requests to different sites and for
+    different search terms to overlap. The number of simultaneous requests to
+    a single host is limited, and requests to each host are rate limited with
+    a :class:`TokenBucket` to avoid bombarding sites.
+
+    The fetcher should be used as an asynchronous context manager::
+
+        async with JobAdFetcher() as fetcher:
+            page = await fetcher.fetch(url)
+
+    Arguments
+    ----------
+    host_limit : int
+        Maximum number of concurrent requests to a single host.
+    timeout : float
+        Total timeout of a single request in seconds.
+    pool : :class:`ConnectionPool`
+        Shared pool of connections. If None, the fetcher keeps its own
+        connections, which are closed with the fetcher.
+    cache : :class:`ResponseCache`
+        Cache of earlier responses. If provided, cached pages are revalidated
+        with conditional requests, and pages which haven't changed are not
+        returned. Fetched pages are only cached once they have been handled,
+        see :meth:`commit_cache`.
+    chunk_size : int
+        Size in bytes of chunks read when streaming pages.
+    archive : :class:`PageArchive`
+        Archive to store all fetched pages in.
+    hosts : dict
+        Replacement base URLs for hosts, host names as keys. Requests to these
+        hosts are sent to the replacement instead, e.g. a local stand-in
+        server, while limits, cache and archive still use the original URL.
+    """
+
+    def __init__(self, host_limit=2, timeout=30, pool=None, cache=None,
+                 chunk_size=16384, archive=None, hosts=None):
+        if host_limit < 1:
+            raise ValueError("host_limit of JobAdFetcher should be at least 1.")
+        self._host_limit = host_limit
+        self._timeout = timeout
+        self._chunk_size = chunk_size
+        self._pool = pool
+        self._cache = cache
+        self._archive = archive
+        self._replace_hosts = hosts if hosts is not None else {}
+        self._session = None
+        # validators of fetched pages not yet cached, URLs as keys
+        self._cache_pending = {}
+        # semaphores limiting concurrent requests, host names as keys
+        self._hosts = {}
+        # token buckets limiting request rate, host names as keys
+        self._buckets = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """Opens the shared HTTP session.
+        """
+        if self._session is None:
+            timeout = aiohttp.ClientTimeout(total=self._timeout)
+            if self._pool is None:
+                self._session = aiohttp.ClientSession(timeout=timeout)
+            else:
+                self._session = aiohttp.ClientSession(
+                    timeout=timeout, connector=self._pool.connector,
+                    connector_owner=False, trace_configs=[self._pool.trace_config])
+
+    async def close(self):
+        """Closes the shared HTTP session.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _host_semaphore(self, host):
+        """Returns semaphore limiting concurrent requests to host.
+
+        Arguments
+        ----------
+        host : str
+            Network location of host.
+        """
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self._host_limit)
+
+        return self._hosts[host]
+
+    def _host_bucket(self, host, rate, burst):
+        """Returns token bucket limiting request rate to host.
+
+        The bucket is created on the first request to the host.
+
+        Arguments
+        ----------
+        host : str
+            Network location of host.
+        rate : float
+            Number of requests allowed per second.
+        burst : int
+            Number of requests which can be sent at once.
+        """
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(rate, burst)
+
+        return self._buckets[host]
+
+    def _request_url(self, url):
+        """Returns URL to send request for url to.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+        """
+        parsed = urlparse(url)
+        if parsed.netloc not in self._replace_hosts:
+            return url
+
+        return (self._replace_hosts[parsed.netloc].rstrip("/") + parsed.path + 
+                ("?" + parsed.query if parsed.query else ""))
+
+    def _cache_headers(self, url):
+        """Returns headers for a conditional request of a cached page.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+
+        Returns
+        ----------
+        headers : dict
+            Request headers. None if page is fresh in cache and shouldn't be
+            requested at all.
+        """
+        headers = {}
+        if self._cache is not None:
+            entry = self._cache.get(url)
+            if entry is not None:
+                if self._cache.is_fresh(entry):
+                    return None
+                if entry["etag"] is not None:
+                    headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"] is not None:
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def _store(self, url, response, body, encoding, tag):
+        """Stores fetched page in archive and keeps it for the cache.
+
+        The validators of the page are only stored in the cache by 
+        :meth:`commit_cache`, once its job ads have been stored.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+        response : :class:`aiohttp.ClientResponse`
+            Response of request.
+        body : bytes
+            Contents of page.
+        encoding : str
+            Encoding of page contents.
+        tag : tuple(str, str)
+            Site and search term of page, recorded in the archive.
+        """
+        self._keep_validators(url, response, tag)
+        if self._archive is not None:
+            site, search_term = tag if tag is not None else (None, None)
+            self._archive.store(site, search_term, url, body, encoding)
+
+    def _keep_validators(self, url, response, tag):
+        """Keeps validators of fetched page until they are cached.
+
+        Arguments
+        ----------
+        url : str
+            URL of page.
+        response : :class:`aiohttp.ClientResponse`
+            Response of request.
+        tag : tuple(str, str)
+            Site and search term of page.
+        """
+        if self._cache is not None:
+            self._cache_pending[url] = (tag, response.headers.get("ETag"),
+                                        response.headers.get("Last-Modified"))
+
+    def commit_cache(self, search_term=None):
+        """Stores fetched pages in the cache, once they have been handled.
+
+        Pages are only cached after their job ads have been stored, so that
+        pages of a failed run are fetched and parsed again on the next run.
+
+        Arguments
+        ----------
+        search_term : str
+            Search term of pages to cache, as given in the tag of requests. 
+            If None, all fetched pages are cached.
+        """
+        for url, (tag, etag, last_modified) in list(self._cache_pending.items()):
+            if search_term is None or (tag is not None and tag[1] == search_term):
+                self._cache.store(url, etag, last_modified)
+                del self._cache_pending[url]
+
+    async def stream(self, url, rate=1.0, burst=1, tag=None):
+        """Fetches page and yields it decoded as text in chunks as it arrives.
+
+        Nothing is yielded if the fetcher has a cache and the page is either
+        fresh in the cache or the site responds that it hasn't been modified.
+        Archived pages are written chunk by chunk as they arrive and are only
+        added to the archive once the whole page has been read.
+
+        Raises :class:`aiohttp.ClientError` if the request fails and
+        :class:`asyncio.TimeoutError` if it times out.
+
+        Arguments
+        ----------
+        url : str
+            URL of page to fetch.
+        rate : float
+            Number of requests allowed per second to the host of url. Only
+            used on the first request to the host.
+        burst : int
+            Number of requests which can be sent at once to the host of url.
+            Only used on the first request to the host.
+        tag : tuple(str, str)
+            Site and search term of page, recorded in the archive.
+
+        Yields
+        ----------
+        chunk : str
+            Decoded chunk of page contents.
+        """
+        headers = self._cache_headers(url)
+        if headers is None:
+            return
+        if self._session is None:
+            await self.open()
+        host = urlparse(url).netloc
+        await self._host_bucket(host, rate, burst).acquire()
+        async with self._host_semaphore(host):
+            async with self._session.get(self._request_url(url),
+                                         headers=headers) as response:
+                if response.status == 304 and headers:
+                    self._cache.touch(url)
+                    return
+                response.raise_for_status()
+                encoding = response.charset or "utf-8"
+                decoder = codecs.getincrementaldecoder(encoding)()
+                writer = None
+                if self._archive is not None:
+                    writer = self._archive.open_page()
+                try:
+                    async for chunk in response.content.iter_chunked(self._chunk_size):
+                        if writer is not None:
+                            writer.write(chunk)
+                        yield decoder.decode(chunk)
+                    yield decoder.decode(b"", final=True)
+                except BaseException:
+                    # failed or abandoned pages are not archived
+                    if writer is not None:
+                        writer.abort()
+                    raise
+
+        self._keep_validators(url, response, tag)
+        if writer is not None:
+            site, search_term = tag if tag is not None else (None, None)
+            writer.close(site, search_term, url, encoding)
+
+    async def fetch(self, url, rate=1.0, burst=1, tag=None):
+        """Fetches page and returns it decoded as text.
+
+        If the fetcher has a cache and the page is either fresh in the cache
+        or the site responds that it hasn't been modified, None is returned
+        since the page has already been handled.
+
+        Raises :class:`aiohttp.ClientError` if the request fails and
+        :class:`asyncio.TimeoutError` if it times out.
+
+        Arguments
+        ----------
+        url : str
+            URL of page to fetch.
+        rate : float
+            Number of requests allowed per second to the host of url. Only
+            used on the first request to the host.
+        burst : int
+            Number of requests which can be sent at once to the host of url.
+            Only used on the first request to the host.
+        tag : tuple(str, str)
+            Site and search term of page, recorded in the archive.
+
+        Returns
+        ----------
+        text : str
+            Decoded contents of page. None if page is unchanged since it was
+            cached.
+        """
+        fetched = await self.fetch_bytes(url, rate, burst, tag)
+        if fetched is None:
+            return None
+
+        return fetched[0].decode(fetched[1])
+
+    async def fetch_bytes(self, url, rate=1.0, burst=1, tag=None):
+        """Fetches page and returns its raw contents and encoding.
+
+        See :meth:`fetch` for details.
+
+        Arguments
+        ----------
+        url : str
+            URL of page to fetch.
+        rate : float
+            Number of requests allowed per second to the host of url.
+        burst : int
+            Number of requests which can be sent at once to the host of url.
+        tag : tuple(str, str)
+            Site and search term of page, recorded in the archive.
+
+        Returns
+        ----------
+        page : tuple(bytes, str)
+            Contents of page and their encoding. None if page is unchanged 
+            since it was cached.
+        """
+        headers = self._cache_headers(url)
+        if headers is None:
+            return None
+        if self._session is None:
+            await self.open()
+        host = urlparse(url).netloc
+        await self._host_bucket(host, rate, burst).acquire()
+        async with self._host_semaphore(host):
+            async with self._session.get(self._request_url(url),
+                                         headers=headers) as response:
+                if response.status == 304 and headers:
+                    self._cache.touch(url)
+                    return None
+                response.raise_for_status()
+                body = await response.read()
+                encoding = response.get_encoding()
+
+        self._store(url, response, body, encoding, tag)
+
+        return body, encoding
@@ -1,11 +1,24 @@
 ﻿import datetime
+from collections.abc import MutableMapping
 
+from .compression import CompressedText
 
-class JobAd(dict):
+try:
+    # numpy and pyarrow are optional, only needed for converting JobAdBatch
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class JobAd(MutableMapping):
     """Job ad container.
 
-    Subclass of dictionary which only accepts as keys the following (description
-    in parentheses):
+    Mapping which only accepts as keys the following (description in 
+    parentheses):
     
     - site (name of job ad site)
     - searchterm (searchterm which found ad)
@@ -18,34 +31,69 @@ class JobAd(dict):
     - relevant (relevance of job ad, set by user if desired)
     - recommendation (recommendation for job ad, provided by machine learning 
       model)
+    - cluster (id of cluster of near-duplicate job ads, see 
+      :mod:`jobadcollector.dedup`)
+
+    Values are stored in a list in the order of the keys, so job ads take 
+    far less memory than dictionaries and are quick to create from database 
+    rows, see :meth:`from_values`. All keys are always present, deleting a 
+    key sets its value to None.
 
+    Values can be stored compressed as :class:`CompressedText`, e.g. 
+    descriptions read from a compressed database. They are decompressed 
+    when first accessed with indexing or :meth:`get`.
     """
     # columns allowed in JobAd instance
     _cols = ["site", "searchterm", "id", "title", "url", "description", "date",
-             "language", "relevant", "recommendation"]
+             "language", "relevant", "recommendation", "cluster"]
+    # positions of columns in values
+    _index = {col: i for i, col in enumerate(_cols)}
+    _date_index = _index["date"]
+
+    __slots__ = ("_values",)
 
     def __init__(self):
-        super(JobAd, self).__init__()
-        for key in self._cols:
-            self[key] = None
-        self["date"] = datetime.date.today()
+        self._values = [None] * len(self._cols)
+        self._values[self._date_index] = datetime.date.today()
+
+    def __getitem__(self, key):
+        i = self._index[key]
+        value = self._values[i]
+        if type(value) is CompressedText:
+            value = value.text()
+            self._values[i] = value
+        return value
 
     def __setitem__(self, key, val):
-        if key not in self._cols:
+        if key not in self._index:
             raise KeyError("Key not column in JobAd.")
-        return super().__setitem__(key, val)
+        self._values[self._index[key]] = val
 
     def __delitem__(self, key):
-        if key in self._cols:
-            self[key] = None
-        else:
-            return super().__delitem__(key)
+        self._values[self._index[key]] = None
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._cols)
+
+    def __len__(self):
+        return len(self._cols)
+
+    def __repr__(self):
+        return "JobAd(%r)" % self.as_dict()
+
+    def clear(self):
+        for i in range(len(self._cols)):
+            self._values[i] = None
 
     @classmethod
     def create(cls, dictionary):
         """Creates :class:`JobAd` instance from dictionary.
 
-        Removes keys not belonging to JobAd.
+        Removes keys not belonging to JobAd. Date is today if not in 
+        dictionary.
 
         Arguments
         ----------
@@ -58,13 +106,53 @@ class JobAd(dict):
             :class:`JobAd` instance with column values from dictionary.
 
         """
-        job_ad = JobAd()
+        values = [None] * len(cls._cols)
         for key in dictionary:
-            if key in cls._cols:
-                job_ad[key] = dictionary[key]
+            if key in cls._index:
+                values[cls._index[key]] = dictionary[key]
+        if "date" not in dictionary:
+            values[cls._date_index] = datetime.date.today()
+        job_ad = cls.__new__(cls)
+        job_ad._values = values
+
+        return job_ad
+
+    @classmethod
+    def from_values(cls, values):
+        """Creates :class:`JobAd` instance from column values.
+
+        Faster than :meth:`create`, e.g. for database rows.
+
+        Arguments
+        ----------
+        values : sequence
+            Values of all columns in the order of _cols.
+
+        Returns
+        ----------
+        job_ad : JobAd
+            :class:`JobAd` instance with values.
+        """
+        job_ad = cls.__new__(cls)
+        job_ad._values = list(values)
+        if len(job_ad._values) != len(cls._cols):
+            raise ValueError("JobAd has %d columns, got %d values." % 
+                             (len(cls._cols), len(job_ad._values)))
 
         return job_ad
 
+    def as_tuple(self):
+        """Returns values of columns in the order of _cols.
+        """
+        return tuple([value.text() if type(value) is CompressedText else value
+                      for value in self._values])
+
+    def as_dict(self):
+        """Returns dictionary with columns as keys, e.g. for named query
+        parameters of sqlite, which doesn't accept other mappings.
+        """
+        return dict(zip(self._cols, self.as_tuple()))
+
     def columns_not_none(self, columns):
         """Checks that values of columns are not none.
         
@@ -85,3 +173,203 @@ class JobAd(dict):
 
         return not_none
 
+
+def _to_date(value):
+    """Returns date of a date, datetime or ISO format string, e.g. from sqlite.
+    """
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+class JobAdBatch:
+    """Columnar container of job ads.
+
+    Holds a list of values for each column instead of a :class:`JobAd` for 
+    each job ad, so job ads can be read from database cursors and handed 
+    to code working on whole columns, such as the classifier, without 
+    walking a list of job ads once per column. Iterating over a batch 
+    yields :class:`JobAd` instances, so a batch can be used wherever job 
+    ads are iterated.
+
+    Columns can be converted to NumPy arrays and Arrow record batches if 
+    numpy or pyarrow is installed.
+
+    Arguments
+    ----------
+    columns : dict
+        Lists of values of equal length, :class:`JobAd` columns as keys. 
+        The lists are used as is, without copying. Job ads have None as 
+        value of columns not included, except for date.
+    """
+    __slots__ = ("_data", "_length")
+
+    # types of columns in Arrow record batches
+    _arrow_types = {"date": "date32", "relevant": "int64", "recommendation": "int64"}
+
+    def __init__(self, columns=None):
+        columns = columns if columns is not None else {}
+        for column in columns:
+            if column not in JobAd._index:
+                raise KeyError("Key not column in JobAd.")
+        lengths = set([len(values) for values in columns.values()])
+        if len(lengths) > 1:
+            raise ValueError("Columns of JobAdBatch differ in length.")
+        self._data = dict([(column, columns[column]) for column in JobAd._cols 
+                           if column in columns])
+        self._length = lengths.pop() if lengths else 0
+
+    @property
+    def columns(self):
+        """Columns included in batch, in the order of :class:`JobAd` columns.
+        """
+        return list(self._data)
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, column):
+        return column in self._data
+
+    def __getitem__(self, column):
+        return self._data[column]
+
+    def __setitem__(self, column, values):
+        if column not in JobAd._index:
+            raise KeyError("Key not column in JobAd.")
+        if self._data and len(values) != self._length:
+            raise ValueError("Column has %d values, JobAdBatch has %d job ads." %
+                             (len(values), self._length))
+        self._data[column] = values
+        self._data = dict([(column, self._data[column]) for column in JobAd._cols
+                           if column in self._data])
+        self._length = len(values)
+
+    def __iter__(self):
+        if self.columns == JobAd._cols:
+            return map(JobAd.from_values, self.rows())
+        return (JobAd.create(dict(zip(self.columns, row))) for row in self.rows())
+
+    def rows(self):
+        """Returns iterator over tuples of values of each job ad, in the order
+        of columns.
+        """
+        return zip(*self._data.values())
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """Creates :class:`JobAdBatch` from rows, e.g. of a database cursor.
+
+        Arguments
+        ----------
+        columns : list[str]
+            Columns of rows.
+        rows : list[sequence]
+            Values of each job ad in the order of columns.
+
+        Returns
+        ----------
+        batch : JobAdBatch
+            Batch of job ads of rows.
+        """
+        values = [list(column) for column in zip(*rows)] if rows \
+            else [[] for column in columns]
+
+        return cls(dict(zip(columns, values)))
+
+    @classmethod
+    def from_job_ads(cls, job_ads, columns=None):
+        """Creates :class:`JobAdBatch` from job ads.
+
+        Arguments
+        ----------
+        job_ads : iterable[:class:`JobAd`]
+            Job ads, or dictionaries with :class:`JobAd` columns as keys.
+        columns : list[str]
+            Columns to include. If None, all :class:`JobAd` columns are 
+            included.
+
+        Returns
+        ----------
+        batch : JobAdBatch
+            Batch of job ads.
+        """
+        columns = columns if columns is not None else JobAd._cols
+        if columns == JobAd._cols:
+            return cls.from_rows(columns, [job_ad.as_tuple() if type(job_ad) is JobAd
+                                           else [job_ad.get(column) for column in columns]
+                                           for job_ad in job_ads])
+        return cls.from_rows(columns, [[job_ad.get(column) for column in columns]
+                                       for job_ad in job_ads])
+
+    def to_job_ads(self):
+        """Returns list of :class:`JobAd` instances of batch.
+        """
+        return list(self)
+
+    def to_numpy(self):
+        """Returns columns as NumPy arrays.
+
+        Dates are converted to datetime64 and relevant and recommendation to 
+        floats, None becoming NaT and NaN. Other columns are object arrays.
+
+        Returns
+        ----------
+        arrays : dict
+            Arrays of columns, columns as keys.
+        """
+        if numpy is None:
+            raise EnvironmentError("Converting job ads to arrays requires numpy.")
+        arrays = {}
+        for column, values in self._data.items():
+            if column == "date":
+                arrays[column] = numpy.array([_to_date(value) for value in values],
+                                             dtype="datetime64[D]")
+            elif column in ["relevant", "recommendation"]:
+                arrays[column] = numpy.array([numpy.nan if value is None else value
+                                              for value in values], dtype=float)
+            else:
+                arrays[column] = numpy.array(values, dtype=object)
+
+        return arrays
+
+    def to_arrow(self):
+        """Returns batch as an Arrow record batch.
+
+        Returns
+        ----------
+        record_batch : :class:`pyarrow.RecordBatch`
+            Record batch with a field for each column. Dates are date32, 
+            relevant and recommendation int64 and other columns strings.
+        """
+        if pyarrow is None:
+            raise EnvironmentError("Converting job ads to Arrow requires pyarrow.")
+        arrays = []
+        for column, values in self._data.items():
+            if column == "date":
+                values = [_to_date(value) for value in values]
+            arrow_type = getattr(pyarrow, self._arrow_types.get(column, "string"))()
+            arrays.append(pyarrow.array(values, type=arrow_type))
+
+        return pyarrow.RecordBatch.from_arrays(arrays, names=self.columns)
+
+    @classmethod
+    def from_arrow(cls, record_batch):
+        """Creates :class:`JobAdBatch` from an Arrow record batch or table.
+
+        Arguments
+        ----------
+        record_batch : :class:`pyarrow.RecordBatch`
+            Record batch with :class:`JobAd` columns as field names. Other 
+            fields are ignored.
+
+        Returns
+        ----------
+        batch : JobAdBatch
+            Batch of job ads.
+        """
+        return cls(dict([(column, record_batch.column(column).to_pylist()) 
+                         for column in record_batch.schema.names 
+                         if column in JobAd._index]))
@@ -16,6 +16,11 @@ def main(argv):
     argparser.add_argument("db_name", type=str, 
         help="""Name of sqlite database. If one doesn't exist, an empty one is 
                 created.""")
+    argparser.add_argument("-db_profile", choices=["default", "performance"], 
+        default="default",
+        help="""Connection profile of database. performance enables write-ahead 
+                logging, so searches don't block reading, and memory-mapped I/O. 
+                If not provided, default is used.""")
 
     #Set up parser for modes (search, view, classify, Rfunc)
     subparsers = argparser.add_subparsers(dest='mode')
@@ -24,6 +29,61 @@ def main(argv):
     search_parser = subparsers.add_parser("search", help="Search for job ads.")
     search_parser.add_argument("search_terms", type=str,
         help="""Path to text file containing search terms separated by new lines (UTF-8).""")
+    search_parser.add_argument("-host_limit", type=int, default=2,
+        help="""Maximum number of concurrent requests to a single site. If not 
+                provided, 2 is used.""")
+    search_parser.add_argument("-cache", 
+        help="""Name of file to cache search result pages in. Unchanged pages are 
+                not downloaded or parsed again.""")
+    search_parser.add_argument("-max_pages", type=int, default=3,
+        help="""Maximum number of result pages to fetch from a site for a search 
+                term. If not provided, 3 is used.""")
+    search_parser.add_argument("-full", action="store_true",
+        help="""Parse all job ads found, including ones already in the database, 
+                instead of searching incrementally.""")
+    search_parser.add_argument("-known_ratio", type=float, default=0.8,
+        help="""Share of job ads on a result page already in the database at 
+                which no more pages are fetched in incremental searches. If not 
+                provided, 0.8 is used.""")
+    search_parser.add_argument("-parse_workers", type=int,
+        help="""Number of worker processes for parsing result pages. If not 
+                provided, pages are parsed in the main process.""")
+    search_parser.add_argument("-archive",
+        help="""Directory to archive all fetched result pages in. Archived pages 
+                can be parsed again with replay.""")
+
+    #mode - replay
+    replay_parser = subparsers.add_parser("replay", 
+        help="Parse archived result pages again.")
+    replay_parser.add_argument("archive",
+        help="""Directory of page archive.""")
+    replay_parser.add_argument("-start_date", 
+        help="""First fetch date of pages (%%d-%%m-%%Y). If not provided, all pages 
+                since start of archive are parsed.""")
+    replay_parser.add_argument("-end_date", 
+        help="""Last fetch date of pages (%%d-%%m-%%Y). If not provided, the present 
+                date is used.""")
+    replay_parser.add_argument("-parse_workers", type=int,
+        help="""Number of worker processes for parsing pages. If not provided, 
+                one per core is used.""")
+
+    #mode - query
+    query_parser = subparsers.add_parser("query", 
+        help="Search stored job ads by title and description.")
+    query_parser.add_argument("terms", 
+        help="""Search terms separated by spaces, all of which have to match. A 
+                term ending with * matches words starting with it.""")
+    query_parser.add_argument("-limit", type=int, default=20,
+        help="""Maximum number of job ads to show. If not provided, 20 is used.""")
+
+    #mode - compress
+    compress_parser = subparsers.add_parser("compress", 
+        help="Compress descriptions of stored and future job ads.")
+    compress_parser.add_argument("-codec", choices=["zlib", "zstd", "none"], 
+        default="zlib",
+        help="""Compression codec, zstd requires the zstandard package. none 
+                stores descriptions uncompressed again. If not provided, zlib 
+                is used.""")
 
     #mode - view
     view_parser = subparsers.add_parser("view", help="View entries in db.")
@@ -35,8 +95,22 @@ def main(argv):
     view_parser.add_argument("output_name", 
         help="""Name of file to output ads to.""")
     view_parser.add_argument("-output_type", 
-        help="""Type of output file, html or csv. If not provided, html is used.""", 
-        default="html")
+        choices=["html", "html_paged", "csv", "arrow", "parquet"], default="html",
+        help="""Type of output file, html, html_paged, csv, arrow or parquet. 
+                html_paged writes a page loading rows lazily from data files 
+                next to it, for large outputs. arrow and parquet require the 
+                pyarrow package. If not provided, html is used.""")
+    view_parser.add_argument("-gzip", action="store_true",
+        help="""Compress html and csv output files with gzip.""")
+
+    #mode - import
+    import_parser = subparsers.add_parser("import", 
+        help="Store job ads of an Arrow or Parquet file in db.")
+    import_parser.add_argument("input_name", 
+        help="""Name of file to import ads from, e.g. written by view.""")
+    import_parser.add_argument("-input_type", choices=["arrow", "parquet"],
+        help="""Type of input file. If not provided, files ending with .parquet 
+                are read as parquet and others as arrow.""")
 
     #mode - classify
     class_parser = subparsers.add_parser("classify", 
@@ -125,9 +199,26 @@ def main(argv):
                            for term in open(parsed_argv.search_terms).readlines()]
         my_search_terms  = [term for term in my_search_terms if term != ""]
 
+    #set JobAdCollector options
+    options = {"db_profile": parsed_argv.db_profile}
+    if "host_limit" in parsed_argv:
+        options["host_limit"] = parsed_argv.host_limit
+    if "cache" in parsed_argv:
+        options["cache_name"] = parsed_argv.cache
+    if "max_pages" in parsed_argv:
+        options["max_pages"] = parsed_argv.max_pages
+    if "full" in parsed_argv:
+        options["incremental"] = not parsed_argv.full
+    if "known_ratio" in parsed_argv:
+        options["known_ratio"] = parsed_argv.known_ratio
+    if "parse_workers" in parsed_argv:
+        options["parse_workers"] = parsed_argv.parse_workers
+    if "archive" in parsed_argv and parsed_argv.mode == "search":
+        options["archive_name"] = parsed_argv.archive
+
     if parsed_argv.mode == "Rfunc":
         jac = jobadcollector.JobAdCollector(my_search_terms, 
-            parsed_argv.db_name)
+            parsed_argv.db_name, **options)
         if parsed_argv.Rfunmode == "detlang":
             jac.det_lang_store_ads(start, end)
         if parsed_argv.Rfunmode == "train":
@@ -145,14 +236,24 @@ def main(argv):
             jac.recomm_store_ads(RFC, parsed_argv.language, start, end)
 
     else:
-        jac = jobadcollector.JobAdCollector(my_search_terms, parsed_argv.db_name)
+        jac = jobadcollector.JobAdCollector(my_search_terms, parsed_argv.db_name,
+                                            **options)
         if parsed_argv.mode == "view":
             jac.output_results(start, end, parsed_argv.output_name, 
-                               parsed_argv.output_type)
+                               parsed_argv.output_type, parsed_argv.gzip)
         elif parsed_argv.mode == "classify":
             jac.classify_ads_GUI(start, end)
         elif parsed_argv.mode == "search":
             jac.start_search()
+        elif parsed_argv.mode == "query":
+            jac.query_ads(parsed_argv.terms, parsed_argv.limit)
+        elif parsed_argv.mode == "replay":
+            jac.replay_archive(parsed_argv.archive, start, end)
+        elif parsed_argv.mode == "import":
+            jac.import_results(parsed_argv.input_name, parsed_argv.input_type)
+        elif parsed_argv.mode == "compress":
+            jac.compress_descriptions(None if parsed_argv.codec == "none" 
+                                      else parsed_argv.codec)
 
 if (__name__ == "__main__"):
     main(sys.argv)
\ No newline at end of file
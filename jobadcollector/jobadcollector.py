@@ -1,9 +1,12 @@
 ﻿import datetime
-import random
-import time
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 
 import jobadcollector.parsers as parsers 
+import jobadcollector.fetching as fetching
+import jobadcollector.cache as cache
+import jobadcollector.archive as archive
+import jobadcollector.dedup as dedup
 import jobadcollector.db_controls as db_controls 
 import jobadcollector.db_gui as db_gui 
 
@@ -39,17 +42,63 @@ class JobAdCollector:
     Rlibpath : str
         Path to local R libraries. Only needed if classification module was 
         succesfully imported.
+    host_limit : int
+        Maximum number of concurrent requests to a single job ad site.
+    cache_name : str
+        Filename of local response cache. If provided, search result pages are
+        cached and only parsed again once they have changed.
+    max_pages : int
+        Maximum number of result pages fetched from a site for a search term.
+        Fewer pages are fetched once a page contains only stored job ads.
+    incremental : bool
+        Whether to search incrementally. Job ads already stored are then
+        skipped as soon as they are parsed, and no more result pages are
+        fetched once a page consists mostly of stored job ads.
+    known_ratio : float
+        Share of stored job ads on a result page at which incremental searches
+        fetch no more pages. Full searches stop at pages of only stored job ads.
+    parse_workers : int
+        Number of worker processes for parsing result pages. If None, pages
+        are parsed in the main process while they are downloaded.
+    archive_name : str
+        Directory of page archive. If provided, all fetched result pages are
+        stored in the archive, and can later be parsed again with
+        :meth:`replay_archive`.
+    hosts : dict
+        Replacement base URLs for job ad site hosts, host names as keys, e.g.
+        for searching a local stand-in server. See :class:`JobAdFetcher`.
+    db_profile : str
+        Connection profile of database, "default" or "performance". See 
+        :class:`JobAdDB`.
     """
 
     _sites = parsers.JobAdParser.parsers_impl
+    #days of clusters which new job ads are compared with
+    _cluster_days = 60
+    #number of archived pages parsed and stored at a time by replay_archive
+    _replay_pages = 200
+    #number of job ads fingerprinted in a single task by replay_archive
+    _fingerprint_batch = 100
 
     def __init__(self, search_terms, db_name,
-                 Rlibpath="C:/Users/SuperSSD/Documents/R/win-library/3.2"):
+                 Rlibpath="C:/Users/SuperSSD/Documents/R/win-library/3.2",
+                 host_limit=2, cache_name=None, max_pages=3, incremental=True,
+                 known_ratio=0.8, parse_workers=None, archive_name=None, hosts=None,
+                 db_profile="default"):
         if not isinstance(search_terms, list) or db_name == "":
             raise ValueError("Invalid arguments for JobAdCollector. search_terms \
                               should be a list and db_name length larger than 0.")
         self._search_terms = search_terms
         self._db_name = db_name
+        self._host_limit = host_limit
+        self._cache_name = cache_name
+        self._max_pages = max_pages
+        self._incremental = incremental
+        self._known_ratio = known_ratio
+        self._parse_workers = parse_workers
+        self._archive_name = archive_name
+        self._hosts = hosts
+        self._db_profile = db_profile
         self._Rlibpath = ""
         self._classification = CLASSIFICATION
         if self._classification is True:
@@ -58,7 +107,9 @@ class JobAdCollector:
     def start_search(self, search_term=None):
         """Starts search for job advertisements using provided search term(s). 
 
-        HTML requests are randomly delayed by 3 to 5 seconds. 
+        All sites are searched for all search terms concurrently. Requests to
+        a single site are limited to host_limit at a time, and their rate is
+        limited separately for each site (see :class:`JobAdParser`).
 
         Arguments
         ----------
@@ -66,33 +117,220 @@ class JobAdCollector:
             Search term(s) to use. If None, instance variable search_terms,
             set during initialization, is used.
         """
-        random.seed(1222)
-        datab = db_controls.JobAdDB(self._db_name)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
         searchables = self._search_terms if not search_term else [search_term]
 
-        for search_term in searchables:
-            print("Searching for \"%s\"." % search_term)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._search(searchables, datab))
+        finally:
+            loop.close()
+
+    async def _search(self, searchables, datab):
+        """Searches all sites for all search terms using a shared fetcher.
+
+        A single pool of keep-alive connections is used for the whole run.
+        If the instance has a cache, it is shared by all parsers. Stored job 
+        ads are loaded once before searching. Incremental searches skip them,
+        full searches parse them again, but both stop fetching further result
+        pages once a page is mostly or wholly stored.
+        If parse_workers is set, pages are fetched in the event loop and parsed
+        in a pool of worker processes. Fingerprints of job ads for clustering
+        are computed in the same pool, or in the main process if parse_workers
+        is not set.
 
-            # Initialize parsers
-            ps = [parsers.MonsterParser(),
-                  parsers.IndeedParser(),
-                  parsers.DuunitoriParser(),
-                  parsers.OikotieParser()]
+        Arguments
+        ----------
+        searchables : list[str]
+            Search terms to use.
+        datab : :class:`JobAdDB`
+            Database to store job ads in.
+        """
+        options = {"max_pages": self._max_pages}
+        clusters = dedup.ClusterIndex(datab.get_clusters(
+            datetime.date.today() - datetime.timedelta(self._cluster_days)))
+        if self._incremental:
+            options["known_ads"] = datab.get_known_ads()
+            options["known_ratio"] = self._known_ratio
+        else:
+            options["stored_ads"] = datab.get_known_ads()
+        resp_cache = None
+        if self._cache_name:
+            resp_cache = cache.ResponseCache(self._cache_name)
+        page_archive = None
+        if self._archive_name:
+            page_archive = archive.PageArchive(self._archive_name)
+        executor = None
+        if self._parse_workers:
+            executor = ProcessPoolExecutor(self._parse_workers)
+            options["executor"] = executor
+        try:
+            async with fetching.ConnectionPool(host_size=self._host_limit) as pool:
+                async with fetching.JobAdFetcher(self._host_limit, pool=pool,
+                                                 cache=resp_cache,
+                                                 archive=page_archive,
+                                                 hosts=self._hosts) as fetcher:
+                    await asyncio.gather(*[self._search_term(search_term, fetcher,
+                                                             datab, clusters, options,
+                                                             executor)
+                                           for search_term in searchables])
+                print("Connections: %d new, %d reused." % 
+                      (pool.new_connections, pool.reused_connections))
+        finally:
+            if resp_cache is not None:
+                resp_cache.close()
+            if page_archive is not None:
+                page_archive.close()
+            if executor is not None:
+                executor.shutdown()
+
+    async def _search_term(self, search_term, fetcher, datab, clusters, options,
+                           executor):
+        """Searches all sites for a search term and stores found job ads.
+
+        After parsing, found job ads which are not yet stored are assigned to
+        clusters of near-duplicates, e.g. the same job ad posted on several 
+        sites. Fingerprints of job ads are computed in executor, if there is
+        one.
 
-            # Search for job ads
-            loop = asyncio.get_event_loop()
-            tasks = [parser.parse(search_term) for parser in ps]
-            loop.run_until_complete(asyncio.gather(*tasks))
+        Arguments
+        ----------
+        search_term : str
+            Search term to use.
+        fetcher : :class:`JobAdFetcher`
+            Shared fetcher for retrieving pages.
+        datab : :class:`JobAdDB`
+            Database to store job ads in.
+        clusters : :class:`ClusterIndex`
+            Shared index of clusters of near-duplicate job ads.
+        options : dict
+            Keyword arguments for parsers.
+        executor : :class:`concurrent.futures.ProcessPoolExecutor`
+            Executor for computing fingerprints of job ads. If None, they are
+            computed in the event loop, as parsing is.
+        """
+        print("Searching for \"%s\"." % search_term)
+
+        # Initialize parsers
+        ps = [parsers.MonsterParser(fetcher, **options),
+              parsers.IndeedParser(fetcher, **options),
+              parsers.DuunitoriParser(fetcher, **options),
+              parsers.OikotieParser(fetcher, **options)]
+
+        # Search for job ads
+        await asyncio.gather(*[parser.parse(search_term) for parser in ps])
+
+        # Cluster near-duplicates among job ads to be stored
+        job_ads = [job_ad for parser in ps for job_ad in parser.get_job_ads()]
+        new_ads = self._unstored_ads(datab, job_ads)
+        texts = [(job_ad["title"], job_ad["description"]) for job_ad in new_ads]
+        if executor is not None:
+            fingerprints = await asyncio.get_running_loop().run_in_executor(
+                executor, dedup.fingerprints, texts)
+        else:
+            fingerprints = dedup.fingerprints(texts)
+        # other search terms may have stored some of the job ads meanwhile
+        fingerprints = dict(zip([(job_ad["site"], job_ad["id"]) for job_ad in new_ads],
+                                fingerprints))
+        new_ads = self._unstored_ads(datab, new_ads)
+        new_clusters = clusters.assign(new_ads, [fingerprints[(job_ad["site"], job_ad["id"])]
+                                                 for job_ad in new_ads])
+
+        # Save job ads in database
+        counts = datab.store_ads(job_ads)
+        datab.store_clusters(new_clusters)
+        fetcher.commit_cache(search_term)
+        duplicates = len([job_ad for job_ad in new_ads 
+                          if job_ad["cluster"] != None]) - len(new_clusters)
+        print("Stored %d new job ads for \"%s\", %d already stored, %d near-duplicates." % 
+              (counts["inserted"], search_term, counts["ignored"], duplicates))
+
+    def _unstored_ads(self, datab, job_ads):
+        """Returns the job ads which storing would insert into the database.
+
+        Job ads already stored are left out, as are repeats of the same site 
+        and id, of which only the first would be stored.
 
-            # Save job ads in database
-            for parser in ps:
-                datab.store_ads(parser.get_job_ads())
+        Arguments
+        ----------
+        datab : :class:`JobAdDB`
+            Database job ads are stored in.
+        job_ads : list[:class:`JobAd`]
+            Job ads to check.
 
-            # Sleep for random time to avoid bombarding sites
-            time.sleep(random.uniform(0, 1))
+        Returns
+        ----------
+        job_ads : list[:class:`JobAd`]
+            Job ads not stored in the database, in order.
+        """
+        site_ids = {}
+        for job_ad in job_ads:
+            site_ids.setdefault(job_ad["site"], []).append(job_ad["id"])
+        seen = set([(site, ad_id) for site, ids in site_ids.items() 
+                    for ad_id in datab.exists(site, ids)])
+        unstored = []
+        for job_ad in job_ads:
+            key = (job_ad["site"], job_ad["id"])
+            if key not in seen:
+                seen.add(key)
+                unstored.append(job_ad)
+
+        return unstored
+
+    def replay_archive(self, archive_name, date_start=None, date_end=None):
+        """Parses archived result pages again and stores the job ads found.
+
+        Pages are parsed with the current parsers in parse_workers worker
+        processes (or as many as there are cores, if parse_workers is None).
+        New job ads are stored, and parsed fields of existing job ads are
+        updated, see :meth:`JobAdDB.upsert_ads`. Like in searches, new job ads
+        are assigned to clusters of near-duplicates before they are stored,
+        with fingerprints computed in the worker processes. Pages are handled
+        _replay_pages at a time.
 
-    def output_results(self, date_start, date_end, output_name, output_type):
-        """Outputs job ads from database as an HTML or CSV file.
+        Arguments
+        ----------
+        archive_name : str
+            Directory of page archive.
+        date_start : :class:`datetime`
+            Earliest fetch date of pages. If None, pages since the start of
+            the archive are parsed.
+        date_end : :class:`datetime`
+            Latest fetch date of pages. If None, pages until the end of the
+            archive are parsed.
+        """
+        page_archive = archive.PageArchive(archive_name)
+        pages = page_archive.get_pages(date_start, date_end)
+        page_archive.close()
+        print("Parsing %d pages from %s." % (len(pages), archive_name))
+
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
+        clusters = dedup.ClusterIndex(datab.get_clusters(
+            date_start - datetime.timedelta(self._cluster_days) 
+            if date_start is not None else None))
+        with ProcessPoolExecutor(self._parse_workers) as executor:
+            for i in range(0, len(pages), self._replay_pages):
+                group = pages[i:i + self._replay_pages]
+                results = executor.map(archive.parse_archived_page, 
+                                       [archive_name] * len(group), group, chunksize=8)
+                job_ads = [JobAd.from_values(ad) for ad_tuples in results 
+                           for ad in ad_tuples]
+                # cluster near-duplicates among job ads to be stored
+                new_ads = self._unstored_ads(datab, job_ads)
+                texts = [(job_ad["title"], job_ad["description"]) for job_ad in new_ads]
+                results = executor.map(dedup.fingerprints, 
+                                       [texts[j:j + self._fingerprint_batch] 
+                                        for j in range(0, len(texts), 
+                                                       self._fingerprint_batch)])
+                fingerprints = [fingerprint for result in results 
+                                for fingerprint in result]
+                datab.store_clusters(clusters.assign(new_ads, fingerprints))
+                datab.upsert_ads(job_ads)
+        datab.disconnect_db()
+
+    def output_results(self, date_start, date_end, output_name, output_type, 
+                       compress=False):
+        """Outputs job ads from database as an HTML, CSV, Arrow or Parquet file.
 
         All job ads between argument dates are included in the output.
   
@@ -108,15 +346,95 @@ class JobAdCollector:
         output_name : str
             Name of the file to output results to.
         output_type : str
-            Type of output file, "csv" or "html" possible.
+            Type of output file, "csv", "html", "html_paged", "arrow" or 
+            "parquet" possible. "html_paged" writes a page rendering rows 
+            lazily, see :meth:`JobAdDB.write_HTML_report`, for large outputs.
+            Arrow and Parquet files require pyarrow and can be read back 
+            with :meth:`import_results`.
+        compress : bool
+            Whether HTML and CSV files are gzip compressed.
         """
         
-        datab = db_controls.JobAdDB(self._db_name)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
         print("Writing to %s from %s." % (output_name, self._db_name))
         if output_type == "html":
-            datab.write_HTML_file(datab.get_ads(date_start, date_end), output_name)
+            datab.write_HTML_file(datab.iter_ads(date_start, date_end), output_name,
+                                  compress)
+        elif output_type == "html_paged":
+            datab.write_HTML_report(datab.iter_ads(date_start, date_end), output_name)
         elif output_type == "csv":
-            datab.write_CSV_file(datab.get_ads(date_start, date_end), output_name)
+            datab.write_CSV_file(datab.iter_ads(date_start, date_end), output_name,
+                                 compress)
+        elif output_type in ["arrow", "parquet"]:
+            rows = datab.write_arrow_file(datab.iter_ad_batches(date_start, date_end),
+                                          output_name, output_type)
+            print("Wrote %d job ads." % rows)
+        datab.disconnect_db()
+
+    def import_results(self, input_name, input_type=None):
+        """Stores job ads of an Arrow or Parquet file in the database.
+
+        Job ads already in the database are replaced, see 
+        :meth:`JobAdDB.import_arrow_file`.
+
+        Arguments
+        ----------
+        input_name : str
+            Name of file, e.g. written by :meth:`output_results`.
+        input_type : str
+            "arrow" or "parquet". If None, the type is determined by the 
+            file extension.
+        """
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
+        print("Importing %s to %s." % (input_name, self._db_name))
+        rows = datab.import_arrow_file(input_name, input_type)
+        datab.disconnect_db()
+        print("Imported %d job ads." % rows)
+
+    def query_ads(self, terms, limit=20):
+        """Searches stored job ads by title and description and prints them.
+
+        Job ads are ranked by relevance to the search terms, see 
+        :meth:`JobAdDB.search_ads`.
+
+        Arguments
+        ----------
+        terms : str
+            Search terms separated by whitespace. All terms have to match.
+        limit : int
+            Maximum number of job ads to print.
+
+        Returns
+        ----------
+        results : list[tuple(:class:`JobAd`, float, str)]
+            Matching job ads with their score and a snippet of the description.
+        """
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
+        results = datab.search_ads(terms, limit)
+        datab.disconnect_db()
+        for number, (ad, score, snippet) in enumerate(results, 1):
+            print("%d. %s (%s, %s)\n   %s\n   %s" % 
+                  (number, ad["title"], ad["site"], ad["date"], snippet, ad["url"]))
+        print("%d job ads found for \"%s\"." % (len(results), terms))
+
+        return results
+
+    def compress_descriptions(self, codec="zlib"):
+        """Compresses descriptions of stored job ads and prints the savings.
+
+        Job ads stored later are compressed as well, see 
+        :meth:`JobAdDB.compress_descriptions`.
+
+        Arguments
+        ----------
+        codec : str
+            "zlib", "zstd" or None to store descriptions uncompressed.
+        """
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
+        sizes = datab.compress_descriptions(codec)
+        datab.disconnect_db()
+        print("Rewrote descriptions of %d job ads, %d bytes before and %d after." %
+              (sizes["rows"], sizes["size_before"], sizes["size_after"]))
 
     def output_classified_results(self, 
                                   date_start=datetime.datetime.strptime(
@@ -141,8 +459,8 @@ class JobAdCollector:
             Type of output file, "csv" or "html".
         """
         
-        datab = db_controls.JobAdDB(self._db_name)
-        ads = datab.get_classified_ads(date_start, date_end, language, 1)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
+        ads = datab.iter_classified_ads(date_start, date_end, language, 1)
         print("Writing to %s from %s." % (output_name, self._db_name))
         if output_type == "html":
             datab.write_CSV_file(ads, output_name)
@@ -153,6 +471,7 @@ class JobAdCollector:
         """Starts GUI for classifying database entries between given dates.
         
         All job ads between argument dates are included for classification. 
+        Job ads are loaded a page at a time, see :meth:`JobAdDB.get_ads_page`.
 
         Arguments
         ----------
@@ -164,11 +483,19 @@ class JobAdCollector:
             included. If both date_start and date_end are None, all job ads in 
             the database are included.
         """
-        datab = db_controls.JobAdDB(self._db_name)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
+
+        job_ads, cursor = datab.get_ads_page(date_start, date_end)
+        def load_more():
+            nonlocal cursor
+            if cursor == None:
+                return []
+            job_ads, cursor = datab.get_ads_page(date_start, date_end, cursor=cursor)
+            return job_ads
 
-        gui = db_gui.JobAdGUI(datab.get_ads(date_start, date_end))
+        gui = db_gui.JobAdGUI(job_ads, load_more)
         gui.mainloop()
-        new_data = gui.ad_storage  # dictionary with ids as keys
+        new_data = gui.ad_storage  # dictionary with (site, id) pairs as keys
         new_data_dict = [JobAd.create(dict(zip(gui._db_data_columns, new_data[id])))
                          for id in new_data]
         
@@ -201,9 +528,9 @@ class JobAdCollector:
         
         JAC = classification.JobAdClassification(self._Rlibpath, self._search_terms, 
                                                self._sites, language)
-        datab = db_controls.JobAdDB(self._db_name)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
         RFmodel = JAC.train_model(
-                  datab.get_classified_ads(date_start, date_end, language, 1))
+                  datab.get_classified_batch(date_start, date_end, language, 1))
         
         datab.disconnect_db()
 
@@ -213,7 +540,9 @@ class JobAdCollector:
         """Attempts to determine language of job ads.
        
         The languages of all job ads between argument dates are determined 
-        and stored in the database. Classification has to be enabled in
+        and stored in the database. The language is determined once for each
+        cluster of near-duplicate job ads, and stored for the job ads of the
+        cluster between argument dates. Classification has to be enabled in
         JobAdCollector instance.
 
         Arguments
@@ -229,20 +558,23 @@ class JobAdCollector:
         if not self._classification:
             raise EnvironmentError("Classification not enabled in JobAdCollector.")
                                     
-        datab = db_controls.JobAdDB(self._db_name)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
         JAC = classification.JobAdClassification(self._Rlibpath, [], [], "")
 
-        ads = datab.get_ads(date_start, date_end)
-        lang_ads = JAC.det_lang_ads(ads)
-        datab.update_ads_language(lang_ads)
+        ads = datab.iter_cluster_ads(date_start, date_end)
+        datab.update_ads_language(JAC.iter_lang_ads(ads), clusters=True,
+                                  date_start=date_start, date_end=date_end,
+                                  commit_chunks=True)
         datab.disconnect_db()
 
     def recomm_store_ads(self, JAC, language, date_start, date_end):
         """Classifies ads using provided model.
        
         All job ads between argument dates of argument language are
-        classified. The results are stored under the recommendation
-        column in the database.
+        classified, once for each cluster of near-duplicate job ads. The 
+        results are stored under the recommendation column in the database,
+        for the job ads of each cluster between argument dates of argument
+        language.
 
         Arguments
         ----------
@@ -261,11 +593,12 @@ class JobAdCollector:
         if not self._classification:
             raise EnvironmentError("Classification not enabled in JobAdCollector.")
                                       
-        datab = db_controls.JobAdDB(self._db_name)
+        datab = db_controls.JobAdDB(self._db_name, self._db_profile)
 
-        ads = datab.get_ads(date_start, date_end, language)
-        rec_ads = JAC.recommend_ads(ads)
-        datab.update_ads_recommendation(rec_ads)
+        ads = datab.iter_cluster_ads(date_start, date_end, language)
+        datab.update_ads_recommendation(JAC.iter_recommend_ads(ads), clusters=True,
+                                        date_start=date_start, date_end=date_end,
+                                        language=language, commit_chunks=True)
         datab.disconnect_db()
         
     def save_model(self, JAC, filename):
@@ -1,11 +1,15 @@
 ﻿from html.parser import HTMLParser
-import urllib.request
+import asyncio
+import importlib
 import json
 from urllib.parse import urlparse, quote_plus
 from abc import ABCMeta, abstractmethod
 import re
 
+import aiohttp
+
 from .job_ad import JobAd
+from .fetching import JobAdFetcher
 
 
 class JobAdParser(HTMLParser, metaclass=ABCMeta):
@@ -22,38 +26,312 @@ class JobAdParser(HTMLParser, metaclass=ABCMeta):
     - Once an ad has been fully parsed, the instance function _save_job_ad()
       should be called.
 
+    Pages are fetched asynchronously using a :class:`JobAdFetcher`. If no
+    fetcher is provided, a new one is opened for each search. Requests to the
+    site are limited to request_rate per second, with at most request_burst
+    requests sent at once.
+
+    Search results can span several pages, the URL of each page being
+    generated by _generate_URL(). After the first page, further pages are
+    fetched page_batch at a time concurrently, up to max_pages pages. No more
+    pages are fetched once a page is mostly known, i.e. at least known_ratio
+    of its ads are either already stored or already parsed from an earlier
+    page.
+
+    If known_ads is provided, job ads already stored are skipped as soon as
+    they have been parsed, without creating :class:`JobAd` instances. If
+    stored_ads is provided instead, all job ads are parsed, and stored job ads
+    are only counted as known when deciding whether to fetch more pages.
+
+    If an executor is provided, result pages are downloaded whole and parsed
+    in the executor using :func:`parse_page`, instead of being parsed while
+    they are downloaded. With a :class:`concurrent.futures.ProcessPoolExecutor`
+    parsing then runs in parallel with fetching and on several cores. Known
+    job ads are sent to the worker processes with each page. The parser class is imported by name in the worker processes, so it must
+    be defined at the top level of a module.
+
+    Arguments
+    ----------
+    fetcher : :class:`JobAdFetcher`
+        Shared fetcher used for retrieving pages.
+    max_pages : int
+        Maximum number of result pages to fetch for a search term.
+    page_batch : int
+        Number of result pages fetched concurrently.
+    known_ads : :class:`KnownAds`
+        Container of (site, id) pairs of already stored job ads. If None, all
+        job ads are regarded as new.
+    known_ratio : float
+        Share of known job ads on a page at which no more pages are fetched.
+    stored_ads : :class:`KnownAds`
+        Container of (site, id) pairs of already stored job ads, which are
+        parsed but count as known job ads on a page.
+    executor : :class:`concurrent.futures.Executor`
+        Executor for parsing result pages.
     """
     # list of site names for implemented parsers
     parsers_impl = ['indeed', 'duunitori', 'monster', 'oikotie']
-
-    def __init__(self):
+    # site name of parser, one of parsers_impl
+    site = None
+    # requests per second and burst size allowed for site
+    request_rate = 1.0
+    request_burst = 1
+
+    def __init__(self, fetcher=None, max_pages=1, page_batch=2, known_ads=None,
+                 known_ratio=1.0, executor=None, stored_ads=None):
         super(JobAdParser, self).__init__(convert_charrefs=True)
+        self._fetcher = fetcher
+        self._executor = executor
+        self._max_pages = max_pages
+        self._page_batch = page_batch
+        self._known_ads = known_ads
+        self._known_ratio = known_ratio
+        self._stored_ads = stored_ads
         # storage place for job ads
         self._job_ads = []
+        # number of skipped known job ads
+        self._known = 0
+        # search term of current search
+        self._search_term = None
         # temporary storage of ad data during parsing
         self._id = ""
         self._title = ""
         self._url = "" 
         self._additional = ""
 
-    def parse(self, search_term):
+    async def parse(self, search_term):
         """Performs search on job ad site for search term.
 
+        Result pages are fetched until max_pages is reached or a mostly known
+        page is found. Parsed job ads are stored in the instance, see
+        :meth:`get_job_ads`.
+
+        Arguments
+        ----------
+        search_term : str
+            Search term for job ad site.
+        """
+        page = 0
+        while page < self._max_pages:
+            # first page alone, as most searches fit on one page
+            batch = range(page, min(page + (self._page_batch if page > 0 else 1),
+                                    self._max_pages))
+            results = await asyncio.gather(*[self._parse_result_page(search_term, n)
+                                             for n in batch])
+            known_pages = [self._is_known_page(job_ads, known)
+                           for job_ads, known in results]
+            for job_ads, known in results:
+                self._job_ads.extend(job_ads)
+                self._known += known
+            if any(known_pages):
+                break
+            page = batch.stop
+
+    async def _parse_result_page(self, search_term, page):
+        """Parses a single result page using a new parser instance.
+
+        Arguments
+        ----------
+        search_term : str
+            Search term for job ad site.
+        page : int
+            Number of result page, starting from 0.
+
+        Returns
+        ----------
+        job_ads : list[:class:`JobAd`]
+            New job ads parsed from page.
+        known : int
+            Number of known job ads skipped on page.
+        """
+        if self._executor is not None:
+            return await self._parse_result_page_executor(search_term, page)
+        parser = type(self)(self._fetcher, known_ads=self._known_ads)
+        async for job_ad in parser.iter_parse(search_term, page):
+            pass
+
+        return parser.get_job_ads(), parser._known
+
+    async def _parse_result_page_executor(self, search_term, page):
+        """Fetches a single result page and parses it in the instance executor.
+
+        Arguments
+        ----------
+        search_term : str
+            Search term for job ad site.
+        page : int
+            Number of result page, starting from 0.
+
+        Returns
+        ----------
+        job_ads : list[:class:`JobAd`]
+            New job ads parsed from page.
+        known : int
+            Number of known job ads skipped on page.
+        """
+        url = self._generate_URL(search_term, page)
+        self._search_term = search_term
+        try:
+            fetched = await self.fetch_bytes(url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print("Failed to retrieve %s from %s." % 
+                  (search_term, type(self).__name__), e)
+            return [], 0
+        if fetched is None:
+            return [], 0
+        ad_tuples, known = await asyncio.get_running_loop().run_in_executor(
+            self._executor, parse_page, parser_name(type(self)), fetched[0], 
+            fetched[1], search_term, self._known_ads)
+
+        return [JobAd.from_values(ad) for ad in ad_tuples], known
+
+    def _is_known_page(self, job_ads, known):
+        """Checks whether a result page is mostly known.
+
+        Job ads are known if they have already been stored in the database or
+        parsed from an earlier page. Empty pages are known.
+
+        Arguments
+        ----------
+        job_ads : list[:class:`JobAd`]
+            New job ads parsed from page.
+        known : int
+            Number of known job ads skipped on page.
+
+        Returns
+        ----------
+        known_page : bool
+            Whether at least known_ratio of the job ads on page are known.
+        """
+        total = len(job_ads) + known
+        parsed_ids = set([job_ad["id"] for job_ad in self._job_ads])
+        stored_ads = self._stored_ads if self._stored_ads is not None else ()
+        known += len([job_ad for job_ad in job_ads if job_ad["id"] in parsed_ids
+                      or (self.site, job_ad["id"]) in stored_ads])
+
+        return total == 0 or known >= self._known_ratio * total
+
+    async def iter_parse(self, search_term, page=0):
+        """Performs search on job ad site for search term, yielding job ads.
+
+        The search results page is parsed in chunks while it is being
+        downloaded, and each job ad is yielded as soon as the chunk containing
+        it has been parsed. Job ads are also stored in the instance. Only a
+        single result page is parsed.
+
         Arguments
         ----------
         search_term : str
             Search term for job ad site.
+        page : int
+            Number of result page, starting from 0.
+
+        Yields
+        ----------
+        job_ad : :class:`JobAd`
+            Parsed job ad.
         """
-        url = self._generate_URL(search_term)
+        url = self._generate_URL(search_term, page)
+        self._search_term = search_term
+        parsed = len(self._job_ads)
+        pending = ""
         try:
-            url_req = urllib.request.urlopen(url)
-            encoding = url_req.headers.get_content_charset()
-            url_req_text = re.sub("\s+", " ", url_req.read().decode(encoding))
-            url_req_text = re.sub("(&nbsp;)+", " ", url_req_text)
-            self.feed(url_req_text)
-        except urllib.error.HTTPError as e:
+            async for chunk in self.stream(url):
+                pending = self._feed_chunk(pending + chunk)
+                for job_ad in self._job_ads[parsed:]:
+                    yield job_ad
+                parsed = len(self._job_ads)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print("Failed to retrieve %s from %s." % 
                   (search_term, type(self).__name__), e)
+            return
+        self._feed_chunk(pending, final=True)
+        for job_ad in self._job_ads[parsed:]:
+            yield job_ad
+
+    async def stream(self, url):
+        """Fetches page in decoded chunks using the instance fetcher.
+
+        Arguments
+        ----------
+        url : str
+            URL of page to fetch.
+
+        Yields
+        ----------
+        chunk : str
+            Decoded chunk of page contents. Nothing is yielded if page is
+            unchanged since it was last fetched.
+        """
+        tag = (self.site, self._search_term)
+        if self._fetcher is not None:
+            async for chunk in self._fetcher.stream(url, self.request_rate,
+                                                    self.request_burst, tag):
+                yield chunk
+        else:
+            async with JobAdFetcher() as fetcher:
+                async for chunk in fetcher.stream(url, self.request_rate,
+                                                  self.request_burst, tag):
+                    yield chunk
+
+    async def fetch_bytes(self, url):
+        """Fetches whole page using the instance fetcher.
+
+        Arguments
+        ----------
+        url : str
+            URL of page to fetch.
+
+        Returns
+        ----------
+        page : tuple(bytes, str)
+            Contents of page and their encoding. None if page is unchanged
+            since it was last fetched.
+        """
+        tag = (self.site, self._search_term)
+        if self._fetcher is not None:
+            return await self._fetcher.fetch_bytes(url, self.request_rate,
+                                                   self.request_burst, tag)
+        async with JobAdFetcher() as fetcher:
+            return await fetcher.fetch_bytes(url, self.request_rate,
+                                             self.request_burst, tag)
+
+    def _feed_chunk(self, text, final=False):
+        """Parses job ads from a chunk of page contents.
+
+        Only text up to the last complete tag is parsed, so that whitespace
+        and entities split between chunks are normalized as a whole. The rest
+        is returned and should be prepended to the next chunk.
+
+        Arguments
+        ----------
+        text : str
+            Decoded chunk of page contents.
+        final : bool
+            Whether chunk is the last one, in which case all text is parsed.
+
+        Returns
+        ----------
+        pending : str
+            Text left unparsed.
+        """
+        end = len(text) if final else text.rfind(">") + 1
+        if end > 0:
+            self._parse_page(text[:end])
+
+        return text[end:]
+
+    def _parse_page(self, page):
+        """Parses job ads from page contents.
+
+        Arguments
+        ----------
+        page : str
+            Decoded contents of page.
+        """
+        page = re.sub("\s+", " ", page)
+        page = re.sub("(&nbsp;)+", " ", page)
+        self.feed(page)
    
     def get_job_ads(self):
         """Returns parsed job ads. 
@@ -71,47 +349,136 @@ class JobAdParser(HTMLParser, metaclass=ABCMeta):
     def _save_job_ad(self):
         """Saves parsed job in instance. 
 
-        Should only be called once parsing of ad is complete.  
+        Should only be called once parsing of ad is complete. Known job ads
+        are only counted.
         """
+        if self._known_ads is not None and (self.site, self._id) in self._known_ads:
+            self._known += 1
+            return
         self._job_ads.append(
             JobAd.create({
+                "site": self.site,
+                "searchterm": self._search_term,
                 "id": self._id,
                 "title": re.sub("\s{2,}", " ", self._title.strip()),
                 "url": self._url,
                 "description": re.sub("\s{2,}", " ", self._additional.strip())}))
 
     @abstractmethod
-    def _generate_URL(self, search_term):
-        """Generates URL for search term.
+    def _generate_URL(self, search_term, page=0):
+        """Generates URL of result page for search term.
 
         Arguments
         ----------
         search_term : str
             Search term to generate URL for.
+        page : int
+            Number of result page, starting from 0.
         """
 
 
+def parser_name(parser_class):
+    """Returns the name of a parser class for looking it up in a worker process.
+
+    Arguments
+    ----------
+    parser_class : type
+        :class:`JobAdParser` subclass.
+
+    Returns
+    ----------
+    parser_name : str
+        Module and qualified name of class, separated by a colon.
+    """
+    return "%s:%s" % (parser_class.__module__, parser_class.__qualname__)
+
+
+def _resolve_parser(parser_name):
+    """Returns the parser class of a name given by :func:`parser_name`.
+
+    Raises ValueError if the name does not refer to an importable
+    :class:`JobAdParser` subclass, e.g. a class defined inside a function.
+    """
+    module_name, _, qualname = parser_name.partition(":")
+    try:
+        parser_class = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            parser_class = getattr(parser_class, name)
+    except (ImportError, AttributeError):
+        parser_class = None
+    if not (isinstance(parser_class, type) and issubclass(parser_class, JobAdParser)):
+        raise ValueError("Parser %s cannot be resolved in worker process." % parser_name)
+
+    return parser_class
+
+
+def parse_page(parser_name, page, encoding, search_term, known_ads=None):
+    """Parses job ads from a fetched result page.
+
+    Intended to be run in a worker process, so arguments and results are
+    plain picklable values.
+
+    Arguments
+    ----------
+    parser_name : str
+        Name of :class:`JobAdParser` subclass to parse page with, see
+        :func:`parser_name`.
+    page : bytes
+        Contents of page.
+    encoding : str
+        Encoding of page contents.
+    search_term : str
+        Search term of page.
+    known_ads : :class:`KnownAds`
+        Container of (site, id) pairs of already stored job ads, which are
+        skipped. If None, all job ads are regarded as new.
+
+    Returns
+    ----------
+    ad_tuples : list[tuple]
+        Parsed job ads, values in order of :class:`JobAd` columns.
+    known : int
+        Number of known job ads skipped on page.
+    """
+    parser = _resolve_parser(parser_name)(known_ads=known_ads)
+    parser._search_term = search_term
+    parser._feed_chunk(page.decode(encoding), final=True)
+
+    return ([job_ad.as_tuple() for job_ad in parser.get_job_ads()], parser._known)
+
+
 class IndeedParser(JobAdParser):
     """Subclass of :class:`JobAdParser`. Implementation of parsing for Indeed.fi.
     """
 
-    def __init__(self):
-        super(IndeedParser, self).__init__()
+    site = "indeed"
+    request_rate = 1.0
+    request_burst = 2
+
+    def __init__(self, *args, **kwargs):
+        super(IndeedParser, self).__init__(*args, **kwargs)
         self._job = 0  # inside job ad
         self._add = 0  # parsing done
 
-    def _generate_URL(self, search_term):
+    def _generate_URL(self, search_term, page=0):
         """Generates URL for search term for indeed.fi.
 
         Arguments
         ----------
         search_term : str
             Search term to generate URL for.
+        page : int
+            Number of result page, starting from 0.
         """
         search_term = search_term.replace(" ", "%20")
 
-        return ("http://www.indeed.fi/jobs?as_and=%s&as_phr=&as_any=&as_not=&as_ttl=&as_cmp=&jt=all" + \
-                "&st=&radius=50&l=Helsinki&fromage=any&limit=50&sort=date&psf=advsrch") % quote_plus(search_term)
+        url = ("http://www.indeed.fi/jobs?as_and=%s&as_phr=&as_any=&as_not=&as_ttl=&as_cmp=&jt=all" + \
+               "&st=&radius=50&l=Helsinki&fromage=any&limit=50&sort=date&psf=advsrch") % quote_plus(search_term)
+        if page > 0:
+            # results are offset by ad, 50 ads per page
+            url = url + "&start=%d" % (page * 50)
+
+        return url
 
     def handle_starttag(self, tag, attrs):
         if tag == "h2" and ('class', 'jobtitle') in attrs:
@@ -149,22 +516,32 @@ class MonsterParser(JobAdParser):
     """Subclass of :class:`JobAdParser`. Implementation of parsing for Monster.fi.
     """
     
-    def __init__(self):
-        super(MonsterParser, self).__init__()
+    site = "monster"
+    request_rate = 1.0
+    request_burst = 2
+
+    def __init__(self, *args, **kwargs):
+        super(MonsterParser, self).__init__(*args, **kwargs)
         self._job = 0       # inside job ad
         self._add = 0       # add ad
         self._in_title = 0  # title element
 
-    def _generate_URL(self, search_term):
+    def _generate_URL(self, search_term, page=0):
         """Generates URL for search term for monster.fi.
 
         Arguments
         ----------
         search_term : str
             Search term to generate URL for.
+        page : int
+            Number of result page, starting from 0.
         """
-        return "http://www.monster.fi/tyopaikat/haku/?q=%s&where=P__C3__A4__C3__A4kaupunkiseutu__2C-Uusimaa" % \
-               quote_plus(search_term)
+        url = "http://www.monster.fi/tyopaikat/haku/?q=%s&where=P__C3__A4__C3__A4kaupunkiseutu__2C-Uusimaa" % \
+              quote_plus(search_term)
+        if page > 0:
+            url = url + "&page=%d" % (page + 1)
+
+        return url
 
     def handle_starttag(self, tag, attrs):
         if tag == "script" and ("type", "application/ld+json") in attrs:
@@ -197,22 +574,32 @@ class DuunitoriParser(JobAdParser):
     """Subclass of :class:`JobAdParser`. Implementation of parsing for Duunitori.fi.
     """
       
-    def __init__(self):
-        super(DuunitoriParser, self).__init__()
+    site = "duunitori"
+    request_rate = 1.0
+    request_burst = 2
+
+    def __init__(self, *args, **kwargs):
+        super(DuunitoriParser, self).__init__(*args, **kwargs)
         self._job = 0           # inside job ad
         self._job_list = 1      # inside search results
         self._title_stat = 0    # inside title element
         self._title_added = 0   # title has been added
 
-    def _generate_URL(self, search_term):
+    def _generate_URL(self, search_term, page=0):
         """Generates URL for search term for duunitori.fi.
 
         Arguments
         ----------
         search_term : str
             Search term to generate URL for.
+        page : int
+            Number of result page, starting from 0.
         """
-        return "http://duunitori.fi/tyopaikat/?haku=%s&alue=" % quote_plus(search_term)
+        url = "http://duunitori.fi/tyopaikat/?haku=%s&alue=" % quote_plus(search_term)
+        if page > 0:
+            url = url + "&sivu=%d" % (page + 1)
+
+        return url
 
     def handle_starttag(self, tag, attrs):
         if tag == "section" and ('class', 'setion--secondary') in attrs:
@@ -251,25 +638,35 @@ class OikotieParser(JobAdParser):
     """Subclass of :class:`JobAdParser`. Implementation of parsing for Oikotie.fi.
     """
 
-    def __init__(self):
-        super(OikotieParser, self).__init__()
+    site = "oikotie"
+    request_rate = 1.0
+    request_burst = 2
+
+    def __init__(self, *args, **kwargs):
+        super(OikotieParser, self).__init__(*args, **kwargs)
         self._job_list = 0  # inside job ad list element
         self._job = 0  # inside job ad element
         self._job_title = 0  # inside job title element
         self._job_descrip = 0  # inside job description element
         self._add = 0  # parsing done
 
-    def _generate_URL(self, search_term):
+    def _generate_URL(self, search_term, page=0):
         """Generates URL for search term for oikotie.fi.
 
         Arguments
         ----------
         search_term : str
             Search term to generate URL for.
+        page : int
+            Number of result page, starting from 0.
         """
         search_term = search_term.replace(" ", "%20")
         
-        return "https://tyopaikat.oikotie.fi/?sijainti[101]=101&jq=%s&sort_by=score" % quote_plus(search_term)
+        url = "https://tyopaikat.oikotie.fi/?sijainti[101]=101&jq=%s&sort_by=score" % quote_plus(search_term)
+        if page > 0:
+            url = url + "&page=%d" % (page + 1)
+
+        return url
 
     def handle_starttag(self, tag, attrs):
         if tag == "ul" and ('class', 'joblist') in attrs:
@@ -316,3 +713,8 @@ class OikotieParser(JobAdParser):
             self._title = self._title + " " + data.strip()
         elif self._job_descrip == 1:
             self._additional = self._additional + " " + data.strip()
+
+
+# parser classes of implemented sites, site names as keys
+site_parsers = {"indeed": IndeedParser, "duunitori": DuunitoriParser,
+                "monster": MonsterParser, "oikotie": OikotieParser}
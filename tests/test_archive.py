@@ -0,0 +1,86 @@
+﻿import unittest
+import os
+import shutil
+import tempfile
+import datetime
+
+from jobadcollector.archive import PageArchive, load_page, parse_archived_page
+
+
+class PageArchiveTestCase(unittest.TestCase):
+    """Various tests for PageArchive class.
+    """
+
+    page = """<html><body>
+        <h2 class="jobtitle" id="jl_1"><a href="/rc/clk?jk=1">Data   analyst</a></h2>
+        <span>Great&nbsp;&nbsp;company</span>
+        <div class="result-link-bar-container"></div>
+        </body></html>""".encode("utf-8")
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = PageArchive(self.directory)
+
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(self.directory)
+
+    def test_store_dedup(self):
+        """Test identical pages are stored only once.
+        """
+        hash = self.archive.store("indeed", "analyst", "http://a.fi/1", self.page, "utf-8")
+        self.assertEqual(self.archive.store("indeed", "analyst", "http://a.fi/1",
+                                            self.page, "utf-8"), hash)
+        self.archive.store("indeed", "analyst", "http://a.fi/2", b"other", "utf-8")
+        files = [name for root, dirs, names in os.walk(os.path.join(self.directory, "pages"))
+                 for name in names]
+        self.assertEqual(len(files), 2)
+        entries = self.archive.get_pages()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(load_page(self.directory, entries[0]), self.page)
+        self.assertEqual(load_page(self.directory, entries[1]), b"other")
+
+    def test_page_writer(self):
+        """Test pages are archived in chunks and aborted pages are discarded.
+        """
+        writer = self.archive.open_page()
+        for i in range(0, len(self.page), 7):
+            writer.write(self.page[i:i + 7])
+        hash = writer.close("indeed", "analyst", "http://a.fi/1", "utf-8")
+        self.assertEqual(self.archive.store("indeed", "analyst", "http://a.fi/1",
+                                            self.page, "utf-8"), hash)
+        writer = self.archive.open_page()
+        writer.write(b"partial")
+        writer.abort()
+        files = [name for root, dirs, names in os.walk(os.path.join(self.directory, "pages"))
+                 for name in names]
+        self.assertEqual(len(files), 1)
+        entries = self.archive.get_pages()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(load_page(self.directory, entries[0]), self.page)
+
+    def test_get_pages_dates(self):
+        """Test pages are filtered by fetch date.
+        """
+        self.archive.store("indeed", "analyst", "http://a.fi/1", self.page, "utf-8")
+        self.archive.store(None, None, "http://a.fi/2", b"other", "utf-8")
+        today = datetime.date.today()
+        self.assertEqual(len(self.archive.get_pages(today, today)), 1)
+        self.assertEqual(len(self.archive.get_pages(today + datetime.timedelta(1))), 0)
+        self.assertEqual(len(self.archive.get_pages(None, today - datetime.timedelta(1))), 0)
+
+    def test_parse_archived_page(self):
+        """Test archived pages are parsed with the current parsers.
+        """
+        self.archive.store("indeed", "analyst", "http://a.fi/1", self.page, "utf-8")
+        entry = self.archive.get_pages()[0]
+        ad_tuples = parse_archived_page(self.directory, entry)
+        self.assertEqual(len(ad_tuples), 1)
+        site, search_term, id, title = ad_tuples[0][:4]
+        self.assertEqual((site, search_term, id, title),
+                         ("indeed", "analyst", "jl_1", "Data analyst"))
+        self.assertIn(datetime.date.today(), ad_tuples[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
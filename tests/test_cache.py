@@ -0,0 +1,86 @@
+﻿import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from jobadcollector.cache import ResponseCache
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Various tests for ResponseCache class.
+    """
+
+    def setUp(self):
+        self.cache = ResponseCache(":memory:", max_entries=2, ttl=60, fresh=10)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_store_get(self):
+        """Test validators are stored and retrieved correctly.
+        """
+        self.assertIsNone(self.cache.get("http://a.fi/1"))
+        self.cache.store("http://a.fi/1", '"v1"', "Mon, 01 Jan 2016")
+        entry = self.cache.get("http://a.fi/1")
+        self.assertEqual(entry["etag"], '"v1"')
+        self.assertEqual(entry["last_modified"], "Mon, 01 Jan 2016")
+        self.assertTrue(self.cache.is_fresh(entry))
+
+    def test_fresh_touch(self):
+        """Test entries turn stale and are refreshed by touch.
+        """
+        self.cache.store("http://a.fi/1")
+        self.cache._conn.execute("UPDATE Responses SET stored = ?",
+                                 (time.time() - 20,))
+        self.assertFalse(self.cache.is_fresh(self.cache.get("http://a.fi/1")))
+        self.cache.touch("http://a.fi/1")
+        self.assertTrue(self.cache.is_fresh(self.cache.get("http://a.fi/1")))
+
+    def test_ttl_eviction(self):
+        """Test expired entries are not returned.
+        """
+        self.cache.store("http://a.fi/1")
+        self.cache._conn.execute("UPDATE Responses SET stored = ?",
+                                 (time.time() - 120,))
+        self.assertIsNone(self.cache.get("http://a.fi/1"))
+
+    def test_count_eviction(self):
+        """Test oldest entries are removed once maximum count is exceeded.
+        """
+        for i in range(3):
+            self.cache.store("http://a.fi/%d" % i)
+            self.cache._conn.execute("UPDATE Responses SET stored = stored - ?",
+                                     (10 - i,))
+        self.assertIsNone(self.cache.get("http://a.fi/0"))
+        self.assertIsNotNone(self.cache.get("http://a.fi/1"))
+        self.assertIsNotNone(self.cache.get("http://a.fi/2"))
+
+    def test_old_cache(self):
+        """Test caches of earlier versions storing page contents are emptied.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "cache.db")
+            conn = sqlite3.connect(filename)
+            conn.execute("""CREATE TABLE Responses (url varchar(1000) PRIMARY KEY,
+                            etag varchar(255), last_modified varchar(255), 
+                            encoding varchar(100), body blob, size integer, 
+                            stored real);""")
+            conn.execute("""INSERT INTO Responses VALUES 
+                            ('http://a.fi/1', '"v1"', NULL, 'utf-8', x'00', 1, ?)""",
+                         (time.time(),))
+            conn.commit()
+            conn.close()
+            cache = ResponseCache(filename)
+            self.assertIsNone(cache.get("http://a.fi/1"))
+            cache.store("http://a.fi/1", '"v2"')
+            self.assertEqual(cache.get("http://a.fi/1")["etag"], '"v2"')
+            cache.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
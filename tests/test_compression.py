@@ -0,0 +1,60 @@
+﻿import unittest
+
+from jobadcollector import compression
+from jobadcollector.compression import CompressedText, TextCodec, train_dictionary
+from jobadcollector.job_ad import JobAd
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Various tests for compression of job ad texts.
+    """
+
+    samples = ["We are looking for an experienced developer to join our team. "
+               "Great team and flexible hours, number %d." % i for i in range(50)]
+
+    def test_codec(self):
+        """Test text is compressed with the current codec and dictionary.
+        """
+        codec = TextCodec()
+        self.assertEqual(codec.compress("text"), "text")
+        codec.set_current("zlib")
+        plain = codec.compress(self.samples[0])
+        self.assertIsInstance(plain, bytes)
+        self.assertEqual(codec.decompress(plain), self.samples[0])
+        codec.add_dictionary(1, train_dictionary(self.samples))
+        codec.set_current("zlib", 1)
+        compressed = codec.compress(self.samples[0])
+        self.assertLess(len(compressed), len(plain))
+        #values of all dictionaries can be decompressed
+        self.assertEqual(codec.decompress(compressed), self.samples[0])
+        self.assertEqual(codec.decompress(plain), self.samples[0])
+        self.assertEqual(codec.decompress("text"), "text")
+        self.assertIsNone(codec.compress(None))
+        with self.assertRaises(ValueError):
+            codec.set_current("lzma")
+        if compression.zstandard is None:
+            with self.assertRaises(EnvironmentError):
+                codec.set_current("zstd")
+
+    def test_train_dictionary(self):
+        """Test dictionaries consist of common text within size.
+        """
+        dictionary = train_dictionary(self.samples, size=100)
+        self.assertLessEqual(len(dictionary), 100)
+        self.assertIn(b"experienced developer", train_dictionary(self.samples))
+        self.assertEqual(train_dictionary(["unique text", "other words"]), b"")
+
+    def test_lazy_text(self):
+        """Test compressed values of job ads are decompressed when accessed.
+        """
+        codec = TextCodec()
+        codec.set_current("zlib")
+        ad = JobAd.create({"description": CompressedText(codec.compress("text"), codec)})
+        self.assertIsInstance(ad._values[ad._index["description"]], CompressedText)
+        self.assertEqual(ad["description"], "text")
+        self.assertEqual(ad._values[ad._index["description"]], "text")
+        self.assertEqual(ad.get("description"), "text")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,33 @@
 ﻿import sqlite3
+import gzip
+import json
 import datetime
 import sys
+import os
+import shutil
+import tempfile
 import unittest
 
 
 import jobadcollector.db_controls as db_controls
 from jobadcollector.job_ad import JobAd
 
+class InterruptingConnection:
+    """Wrapper of :class:`sqlite3.Connection` calling a function before each commit.
+    """
+
+    def __init__(self, conn, before_commit):
+        self._conn = conn
+        self._before_commit = before_commit
+
+    def commit(self):
+        self._before_commit()
+        self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
 class JobAdDBTestCase(unittest.TestCase):
     """Various tests for JobAdDB class.
     """
@@ -15,16 +36,17 @@ class JobAdDBTestCase(unittest.TestCase):
         self.filename = ":memory:"
         self.db = db_controls.JobAdDB(self.filename)
         self.db._connect_db()
-        self.db_columns = [("site", "varchar(255)", 0), 
+        self.db_columns = [("site", "varchar(255)", 1), 
                          ("searchterm", "varchar(255)", 0), 
-                         ("id", "varchar(255)", 1), 
+                         ("id", "varchar(255)", 2), 
                          ("title", "varchar(255)", 0),
                          ("url", "varchar(1000)", 0),
                          ("description", "varchar(1000)", 0),
                          ("date", "date", 0),
                          ("language", "varchar(100)", 0),
                          ("relevant", "integer", 0),
-                         ("recommendation", "integer", 0)]
+                         ("recommendation", "integer", 0),
+                         ("cluster", "varchar(255)", 0)]
         self.job_ads = [{"site" : "best job ads site", "searchterm" : "greatest jobs",
             "id": "xyz412412se", "title" : "Great Job", "url" :"http://www.great.zyx",
             "description":"the absolutely best job"}, 
@@ -88,6 +110,130 @@ class JobAdDBTestCase(unittest.TestCase):
         columns = [(column[1], column[2], column[5]) for column in columns]
         self.assertCountEqual(columns, self.db_columns)
 
+    def test_indexes(self):
+        """Test indexes are created and used by date and language queries.
+        """
+        c = self.db._conn.cursor()
+        indexes = [entry[0] for entry in c.execute("""SELECT name FROM sqlite_master 
+                                                      WHERE type = 'index'""")]
+        for name in self.db._db_indexes:
+            self.assertIn(name, indexes)
+        plan = c.execute("""EXPLAIN QUERY PLAN SELECT * FROM JobEntries 
+                            WHERE relevant IN (0, 1) AND language == ? 
+                            AND date >= ? AND date <= ?""", ("English", 1, 2))
+        self.assertIn("USING INDEX", plan.fetchone()[3])
+
+    def test_migrations(self):
+        """Test migrations are applied in order and only once.
+        """
+        c = self.db._conn.cursor()
+        self.assertEqual(c.execute("PRAGMA user_version").fetchone()[0],
+                         len(self.db._migrations))
+        #legacy database without version
+        self.db.store_ads(self.job_ads)
+        c.execute("DROP INDEX JobEntries_date_site_id")
+        c.execute("PRAGMA user_version = 0")
+        self.db._update_schema()
+        self.assertEqual(c.execute("PRAGMA user_version").fetchone()[0],
+                         len(self.db._migrations))
+        self.assertIsNotNone(c.execute("""SELECT * FROM sqlite_master 
+                                          WHERE name = 'JobEntries_date_site_id'""").fetchone())
+        #database with indexes superseded in version 4
+        c.execute("CREATE INDEX JobEntries_date ON JobEntries (date)")
+        c.execute("PRAGMA user_version = 3")
+        self.db._update_schema()
+        self.assertIsNone(c.execute("""SELECT * FROM sqlite_master 
+                                       WHERE name = 'JobEntries_date'""").fetchone())
+        indexes = [entry[0] for entry in c.execute("""SELECT name FROM sqlite_master 
+            WHERE type = 'index' AND tbl_name = 'JobEntries' AND sql IS NOT NULL 
+            AND name != 'JobEntries_cluster'""")]
+        self.assertCountEqual(indexes, self.db._db_indexes)
+        self.assertEqual(len(self.db.get_ads(None, None)), 2)
+        #database from a newer version
+        c.execute("PRAGMA user_version = %d" % (len(self.db._migrations) + 1))
+        with self.assertRaises(ValueError):
+            self.db._update_schema()
+
+    def test_rewrite_table(self):
+        """Test tables are rewritten in batches, resuming interrupted copies.
+        """
+        self.db.store_ads(self.job_ads)
+        self.db._batch_size = 1
+        c = self.db._conn.cursor()
+        create_sql = """CREATE TABLE %s (site varchar(255), id varchar(255), 
+                        date date, language varchar(100), relevant integer,
+                        cluster varchar(255), PRIMARY KEY (site, id))"""
+        new_columns = ["site", "id", "date", "language", "relevant", "cluster"]
+        #interrupt copy after first batch
+        commits = []
+        class Interrupted(Exception):
+            pass
+        def failing_rewrite(c):
+            def interrupt():
+                commits.append(1)
+                if len(commits) == 3:
+                    raise Interrupted()
+            self.db._conn = InterruptingConnection(self.db._conn, interrupt)
+            try:
+                self.db._rewrite_table(c, "JobEntries", create_sql, new_columns)
+            finally:
+                self.db._conn = self.db._conn._conn
+        self.db._migrations = self.db._migrations + ["_migrate_test"]
+        self.db._migrate_test = failing_rewrite
+        with self.assertRaises(Interrupted):
+            self.db._update_schema()
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM JobEntries_new").fetchone()[0], 1)
+        self.assertEqual(c.execute("PRAGMA user_version").fetchone()[0],
+                         len(self.db._migrations) - 1)
+        #rows changed after being copied are copied again
+        c.execute("UPDATE JobEntries SET language = 'Finnish', id = 'changed' WHERE rowid = 1")
+        c.execute("""INSERT INTO JobEntries (rowid, site, id) 
+                     VALUES (3, 'best job ads site', 'new')""")
+        self.assertEqual(c.execute("SELECT id, language FROM JobEntries_new").fetchall(),
+                         [("changed", "Finnish")])
+        c.execute("DELETE FROM JobEntries WHERE id = 'new'")
+        self.db._conn.commit()
+        #resume
+        self.db._migrate_test = lambda c: self.db._rewrite_table(
+            c, "JobEntries", create_sql, new_columns)
+        self.db._update_schema()
+        self.assertEqual(c.execute("PRAGMA user_version").fetchone()[0],
+                         len(self.db._migrations))
+        columns = [column[1] for column in c.execute("PRAGMA table_info(JobEntries)")]
+        self.assertEqual(columns, new_columns)
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM JobEntries").fetchone()[0], 2)
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM MigrationProgress").fetchone()[0], 0)
+        self.assertIsNotNone(c.execute("""SELECT * FROM sqlite_master 
+                                          WHERE name = 'JobEntries_date_site_id'""").fetchone())
+        self.assertIsNone(c.execute("""SELECT * FROM sqlite_master 
+                                       WHERE name LIKE '%copy%'""").fetchone())
+        self.assertCountEqual(c.execute("SELECT rowid, id FROM JobEntries").fetchall(),
+                              [(1, "changed"), (2, "dsfewf32")])
+
+    def test_profiles(self):
+        """Test connection profiles are applied and unknown ones rejected.
+        """
+        with self.assertRaises(ValueError):
+            db_controls.JobAdDB(self.filename, "fastest")
+        directory = tempfile.mkdtemp()
+        try:
+            db = db_controls.JobAdDB(os.path.join(directory, "test.db"), "performance")
+            db.store_ads(self.job_ads)
+            c = db._conn.cursor()
+            self.assertEqual(c.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(c.execute("PRAGMA synchronous").fetchone()[0], 1)
+            self.assertEqual(c.execute("PRAGMA temp_store").fetchone()[0], 2)
+            #reading doesn't block writing
+            reader = db_controls.JobAdDB(os.path.join(directory, "test.db"), "performance")
+            ads = reader.iter_ads(None, None, batch_size=1)
+            next(ads)
+            db._conn.execute("PRAGMA busy_timeout = 0")
+            db.update_ads(self.job_ads_classified)
+            reader.disconnect_db()
+            db.disconnect_db()
+        finally:
+            shutil.rmtree(directory)
+
     def test_disconnect_db(self):
         """Test database connection is properly disconnected.
         """
@@ -133,6 +279,116 @@ class JobAdDBTestCase(unittest.TestCase):
                 if (sto_ad["id"] == ret_ad["id"]):
                     self.assertCountEqual(ret_ad, sto_ad)
 
+    def test_write_counts(self):
+        """Test writes are batched and return counts of affected ads.
+        """
+        self.db._batch_size = 1
+        self.assertEqual(self.db.store_ads(iter(self.job_ads)),
+                         {"inserted": 2, "ignored": 0})
+        self.assertEqual(self.db.store_ads(ad for ad in self.job_ads),
+                         {"inserted": 0, "ignored": 2})
+        self.assertEqual(self.db.update_ads(self.job_ads_classified), {"updated": 2})
+        self.assertEqual(self.db.update_ads_language(self.job_ads_classified[:1]),
+                         {"updated": 1})
+        missing = JobAd.create({"id": "notstored", "recommendation": 1})
+        self.assertEqual(self.db.update_ads_recommendation(
+                         [self.job_ads_classified[0], missing]), {"updated": 1})
+        self.assertFalse(self.db._conn.in_transaction)
+
+    def test_write_rollback(self):
+        """Test failed batch writes are rolled back as a whole.
+        """
+        self.db._batch_size = 1
+        job_ads = self.job_ads + [{"id": "missing columns"}]
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.db.store_ads(job_ads)
+        self.assertEqual(self.db.get_ads(None, None), [])
+
+    def test_write_commit_chunks(self):
+        """Test job ads are read outside transactions when committing chunks.
+        """
+        self.db._batch_size = 1
+        self.db.store_ads(self.job_ads)
+        in_transaction = []
+        def languages():
+            for ad in self.job_ads:
+                in_transaction.append(self.db._conn.in_transaction)
+                yield {"site": ad["site"], "id": ad["id"], "language": "Finnish"}
+        self.assertEqual(self.db.update_ads_language(languages(), commit_chunks=True),
+                         {"updated": 2})
+        self.assertEqual(in_transaction, [False, False])
+        self.assertEqual(len(self.db.get_ads(None, None, "Finnish")), 2)
+        #failed chunks are rolled back alone
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.db.update_ads_recommendation([{"site": "best job ads site", 
+                                                "id": "xyz412412se", "recommendation": 1},
+                                               {"id": "x"}], commit_chunks=True)
+        self.assertFalse(self.db._conn.in_transaction)
+        self.assertEqual(len([ad for ad in self.db.get_ads(None, None) 
+                              if ad["recommendation"] is not None]), 1)
+
+    def test_upsert_ads(self):
+        """Test new ads are stored and parsed fields of existing ads updated.
+        """
+        self.db.store_ads(self.job_ads)
+        self.db.update_ads(self.job_ads_classified)
+        job_ads = [JobAd.create(dict(ad)) for ad in self.job_ads]
+        job_ads[0]["title"] = "Even Greater Job"
+        job_ads.append(JobAd.create({"site": "best job ads site", 
+            "searchterm": "greatest jobs", "id": "new1", "title": "New Job",
+            "url": "http://www.new.zyx", "description": "a new job"}))
+        self.assertEqual(self.db.upsert_ads(job_ads), {"inserted": 1, "updated": 2})
+        ret_job_ads = self.db.get_ads(datetime.date.today()-datetime.timedelta(1),
+                                      datetime.date.today())
+        self.assertEqual(len(ret_job_ads), 3)
+        for ret_ad in ret_job_ads:
+            if ret_ad["id"] == "xyz412412se":
+                self.assertEqual(ret_ad["title"], "Even Greater Job")
+                # classification is kept
+                self.assertEqual(ret_ad["relevant"], 
+                                 self.job_ads_classified[0]["relevant"])
+            if ret_ad["id"] == "new1":
+                self.assertEqual(ret_ad["title"], "New Job")
+
+    def test_get_known_ads(self):
+        """Test (site, id) pairs of stored ads are known.
+        """
+        self.assertEqual(len(self.db.get_known_ads()), 0)
+        self.db.store_ads(self.job_ads)
+        known_ads = self.db.get_known_ads()
+        self.assertEqual(len(known_ads), 2)
+        self.assertIn(("best job ads site", "xyz412412se"), known_ads)
+        self.assertNotIn(("worst job ads site", "xyz412412se"), known_ads)
+        self.assertNotIn(("best job ads site", "notstored"), known_ads)
+        # ads stored without site match any site
+        known_ads = db_controls.KnownAds([(None, "nosite")])
+        self.assertIn(("best job ads site", "nosite"), known_ads)
+
+    def test_search_ads(self):
+        """Test full-text search finds ranked ads and follows updates.
+        """
+        self.db.store_ads(self.job_ads)
+        results = self.db.search_ads("absolutely job")
+        self.assertEqual(len(results), 2)
+        results = self.db.search_ads("great")
+        self.assertEqual([ad["id"] for ad, score, snippet in results], ["xyz412412se"])
+        self.assertEqual(results[0][0]["url"], "http://www.great.zyx")
+        self.assertIn("[best]", self.db.search_ads("best")[0][2])
+        self.assertEqual(len(self.db.search_ads("wor*")), 1)
+        self.assertEqual(self.db.search_ads('"AND -'), [])
+        #title matches rank higher
+        job_ad = JobAd.create(dict(self.job_ads[1]))
+        job_ad["description"] = "a great job, great great"
+        self.db.update_ads([job_ad])
+        results = self.db.search_ads("great")
+        self.assertEqual([ad["id"] for ad, score, snippet in results],
+                         ["xyz412412se", "dsfewf32"])
+        self.assertEqual(self.db.search_ads("worst"), [])
+        #upserted ads are indexed
+        job_ad["title"] = "Worst Job"
+        self.db.upsert_ads([job_ad])
+        self.assertEqual(len(self.db.search_ads("worst")), 1)
+
     def test_update_ads(self):
         """Test ads are updated correctly.
         """
@@ -179,16 +435,380 @@ class JobAdDBTestCase(unittest.TestCase):
             for class_ad in self.job_ads_classified_less:
                     self.assertCountEqual(ret_ad, class_ad)
 
+    def test_iter_ads(self):
+        """Test ads are iterated in batches and can be updated while iterating.
+        """
+        self.db.store_ads(self.job_ads)
+        ads = self.db.iter_ads(None, None, batch_size=1)
+        self.assertNotIsInstance(ads, list)
+        self.assertCountEqual([ad["id"] for ad in ads], ["xyz412412se", "dsfewf32"])
+        self.assertEqual(len(list(self.db.iter_ads(None, datetime.date.today()))), 2)
+        self.assertEqual(len(list(self.db.iter_ads(datetime.date.today() + 
+                                                   datetime.timedelta(1), None))), 0)
+        #update languages of ads as they are read
+        self.db._batch_size = 1
+        counts = self.db.update_ads_language({"site": ad["site"], "id": ad["id"], 
+                                              "language": "English"}
+                                             for ad in self.db.iter_ads(None, None))
+        self.assertEqual(counts, {"updated": 2})
+        self.assertEqual(len(self.db.get_ads(None, None, "English")), 2)
+        self.assertEqual(len(list(self.db.iter_classified_ads(batch_size=1))), 0)
+        self.db.update_ads(self.job_ads_classified)
+        self.assertEqual(len(list(self.db.iter_classified_ads(batch_size=1))), 2)
+
+    def test_ad_batches(self):
+        """Test ads are read and written in columnar batches.
+        """
+        self.db.store_ads(self.job_ads)
+        batches = list(self.db.iter_ad_batches(None, None, batch_size=1))
+        self.assertEqual([len(batch) for batch in batches], [1, 1])
+        self.assertCountEqual([batch["id"][0] for batch in batches], 
+                              ["xyz412412se", "dsfewf32"])
+        batch = next(self.db.iter_ad_batches(None, None))
+        self.assertCountEqual(list(batch), self.db.get_ads(None, None))
+        self.assertEqual(list(self.db.iter_ad_batches(None, None, "English")), [])
+        #batches are written like job ads
+        batch["language"] = ["English"] * len(batch)
+        self.assertEqual(self.db.update_ads(batch), {"updated": 2})
+        self.assertEqual(len(self.db.get_ads(None, None, "English")), 2)
+        #classified ads in a single batch
+        self.assertEqual(len(self.db.get_classified_batch()), 0)
+        self.db.update_ads(self.job_ads_classified)
+        batch = self.db.get_classified_batch(all_columns=0)
+        self.assertEqual(batch.columns, ["site", "searchterm", "title", "description", 
+                                         "language", "relevant"])
+        self.assertCountEqual(batch["relevant"], [ad["relevant"] for ad in 
+                                                  self.job_ads_classified])
+
+    def test_arrow_formats(self):
+        """Test unknown Arrow file formats and missing pyarrow are reported.
+        """
+        batches = self.db.iter_ad_batches(None, None)
+        self.assertRaises(ValueError, lambda: self.db.write_arrow_file(batches, "ads.xls", 
+                                                                       "excel"))
+        if db_controls.pyarrow is None:
+            self.assertRaises(EnvironmentError, 
+                              lambda: self.db.write_arrow_file(batches, "ads.arrow"))
+            self.assertRaises(EnvironmentError, 
+                              lambda: self.db.import_arrow_file("ads.parquet"))
+
+    @unittest.skipIf(db_controls.pyarrow is None, "pyarrow not installed")
+    def test_arrow_files(self):
+        """Test ads are exported to Arrow and Parquet files and imported back.
+        """
+        self.db.store_ads(self.job_ads)
+        self.db.update_ads(self.job_ads_classified)
+        ads = self.db.get_ads(None, None)
+        directory = tempfile.mkdtemp()
+        for file_format in ["arrow", "parquet"]:
+            filename = os.path.join(directory, "ads." + file_format)
+            self.assertEqual(self.db.write_arrow_file(
+                self.db.iter_ad_batches(None, None, batch_size=1), filename), len(ads))
+            db = db_controls.JobAdDB(os.path.join(directory, file_format + ".db"))
+            self.assertEqual(db.import_arrow_file(filename), len(ads))
+            self.assertCountEqual(db.get_ads(None, None), ads)
+            db.disconnect_db()
+        shutil.rmtree(directory)
+
+    def test_get_ads_page(self):
+        """Test ads are paged by date and id with cursors.
+        """
+        today = datetime.date.today()
+        ads = [JobAd.create({"site": "site", "id": "id%02d" % i, "title": "title",
+                             "date": today - datetime.timedelta(i % 3),
+                             "language": "English" if i % 2 else "Finnish"})
+               for i in range(10)]
+        self.db.store_ads(ads)
+        expected = sorted([(str(ad["date"]), ad["site"], ad["id"]) for ad in ads])
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = self.db.get_ads_page(None, None, page_size=3, cursor=cursor)
+            pages.append(page)
+            if cursor == None:
+                break
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual([(ad["date"], ad["site"], ad["id"]) for page in pages 
+                          for ad in page],
+                         expected)
+        #exact multiple of page size ends without an empty page
+        page, cursor = self.db.get_ads_page(None, None, page_size=10)
+        self.assertEqual((len(page), cursor), (10, None))
+        #filters apply to all pages
+        page, cursor = self.db.get_ads_page(today, None, "English", page_size=1)
+        page2, cursor = self.db.get_ads_page(today, None, "English", page_size=1,
+                                             cursor=cursor)
+        self.assertEqual([ad["id"] for ad in page + page2], ["id03", "id09"])
+        self.assertIsNone(cursor)
+        plan = self.db._conn.execute("""EXPLAIN QUERY PLAN SELECT * FROM JobEntries
+                                        WHERE (date, site, id) > (?, ?, ?) 
+                                        ORDER BY date, site, id LIMIT 3""",
+                                     ("", "", "")).fetchone()[3]
+        self.assertIn("JobEntries_date_site_id", plan)
+        with self.assertRaises(ValueError):
+            self.db.get_ads_page(None, None, cursor="not a cursor")
+        with self.assertRaises(ValueError):
+            self.db.get_ads_page(None, None, page_size=0)
+
+    def test_clusters(self):
+        """Test ads are processed once per cluster and updated by cluster.
+        """
+        ads = [JobAd.create({"site": "site", "id": "id%d" % i, "title": "title",
+                             "cluster": cluster})
+               for i, cluster in enumerate(["a", "b", "a", None, None])]
+        self.db.store_ads(ads)
+        representatives = list(self.db.iter_cluster_ads(None, None, batch_size=1))
+        self.assertCountEqual([ad["id"] for ad in representatives], 
+                              ["id0", "id1", "id3", "id4"])
+        counts = self.db.update_ads_language(
+            ({"site": ad["site"], "id": ad["id"], "cluster": ad["cluster"], 
+              "language": "English"}
+             for ad in representatives if ad["id"] in ["id0", "id3"]), clusters=True)
+        self.assertEqual(counts, {"updated": 3})
+        self.assertCountEqual([ad["id"] for ad in self.db.get_ads(None, None, "English")],
+                              ["id0", "id2", "id3"])
+        self.assertEqual(len(list(self.db.iter_cluster_ads(None, None, "English"))), 2)
+        #without clusters, only the given job ads are updated
+        counts = self.db.update_ads_recommendation([{"site": "site", "id": "id1", 
+                                                     "recommendation": 1}])
+        self.assertEqual(counts, {"updated": 1})
+        #cluster is kept when updating job ads without one
+        self.db.update_ads([JobAd.create({"site": "site", "id": "id0", "title": "new"})])
+        self.assertEqual(self.db.get_ads(None, None, "all")[0]["cluster"], "a")
+        self.db.store_clusters([("a", b"signature")])
+        self.db.store_clusters([("a", b"other"), ("b", b"signature")])
+        self.assertCountEqual(self.db.get_clusters(datetime.date.today()),
+                              [("a", b"signature"), ("b", b"signature")])
+        self.assertEqual(self.db.get_clusters(datetime.date.today() + 
+                                              datetime.timedelta(1)), [])
+        #job ads without a cluster with the same id on different sites
+        self.db.store_ads([JobAd.create({"site": site, "id": "123", "title": "title"})
+                           for site in ["indeed", "monster"]])
+        representatives = [ad for ad in self.db.iter_cluster_ads(None, None) 
+                            if ad["id"] == "123"]
+        self.assertCountEqual([ad["site"] for ad in representatives], 
+                              ["indeed", "monster"])
+        self.db.update_ads_language((JobAd.create({"site": ad["site"], "id": ad["id"], 
+                                                   "cluster": ad["cluster"], 
+                                                   "language": "Finnish"})
+                                     for ad in representatives), clusters=True)
+        self.assertCountEqual([ad["site"] for ad in self.db.get_ads(None, None, "Finnish")],
+                              ["indeed", "monster"])
+        #job ads in the same cluster outside the filters are not updated
+        old_date = datetime.date.today() - datetime.timedelta(10)
+        self.db.store_ads([JobAd.create({"site": "site", "id": ad_id, "title": "title",
+                                         "cluster": "c", "language": language, 
+                                         "date": date})
+                           for ad_id, language, date in [
+                               ("id5", "English", datetime.date.today()),
+                               ("id6", "Finnish", datetime.date.today()),
+                               ("id7", "English", old_date)]])
+        counts = self.db.update_ads_recommendation(
+            [{"site": "site", "id": "id5", "cluster": "c", "recommendation": 1}],
+            clusters=True, date_start=datetime.date.today() - datetime.timedelta(1),
+            language="English")
+        self.assertEqual(counts, {"updated": 1})
+        counts = self.db.update_ads_recommendation(
+            [{"site": "site", "id": "id5", "cluster": "c", "recommendation": 0}],
+            clusters=True, date_end=old_date)
+        self.assertEqual(counts, {"updated": 2})
+        self.assertEqual(dict([(ad["id"], ad["recommendation"]) 
+                               for ad in self.db.get_ads(None, None) 
+                               if ad["cluster"] == "c"]),
+                         {"id5": 0, "id6": None, "id7": 0})
+
+    def test_site_key(self):
+        """Test ads are keyed by site and id, and looked up by site.
+        """
+        ads = [JobAd.create({"site": site, "id": "123", "title": "title %s" % site})
+               for site in ["indeed", "monster", None]]
+        self.assertEqual(self.db.store_ads(ads), {"inserted": 3, "ignored": 0})
+        self.assertEqual(self.db.store_ads(ads), {"inserted": 0, "ignored": 3})
+        self.assertCountEqual([ad["site"] for ad in self.db.get_ads(None, None)],
+                              ["indeed", "monster", ""])
+        self.assertEqual(self.db.exists("indeed", ["123", "456"]), set(["123"]))
+        self.assertEqual(self.db.exists("duunitori", ["123"]), set())
+        self.assertEqual(self.db.exists(None, ["123"]), set(["123"]))
+        self.assertEqual(self.db.exists("indeed", ["id%d" % i for i in range(5000)]), set())
+        self.db.update_ads_language([{"site": "monster", "id": "123", "language": "English"}])
+        self.assertEqual([ad["site"] for ad in self.db.get_ads(None, None, "English")],
+                         ["monster"])
+        self.assertEqual(self.db.upsert_ads([ads[0]]), {"inserted": 0, "updated": 1})
+        plan = self.db._conn.execute("""EXPLAIN QUERY PLAN SELECT id FROM JobEntries
+                                        WHERE site = ? AND id IN (?)""", ("", "")).fetchone()
+        self.assertIn("INDEX", plan[3])
+
+    def test_migrate_site_key(self):
+        """Test job ads are kept when migrating to the (site, id) key.
+        """
+        c = self.db._conn.cursor()
+        c.execute("DROP TABLE JobEntries")
+        c.execute("PRAGMA user_version = 0")
+        #database of version 5, keyed by id
+        self.db._migrations = self.db._migrations[:5]
+        self.db._update_schema()
+        del self.db._migrations
+        c.executemany("""INSERT INTO JobEntries (site, id, title, description, date) 
+                         VALUES (?, ?, ?, ?, ?)""",
+                      [("indeed", "1", "Data analyst", "python", datetime.date.today()),
+                       (None, "2", "Nurse", "hospital", datetime.date.today())])
+        self.db._conn.commit()
+        self.db._update_schema()
+        self.assertEqual(c.execute("PRAGMA user_version").fetchone()[0],
+                         len(self.db._migrations))
+        self.assertCountEqual([(ad["site"], ad["id"]) for ad in self.db.get_ads(None, None)],
+                              [("indeed", "1"), ("", "2")])
+        self.assertEqual(self.db.exists("indeed", ["1"]), set(["1"]))
+        if self.db._conn.execute("""SELECT * FROM sqlite_master 
+                                    WHERE name = 'JobEntriesFTS'""").fetchone():
+            self.assertEqual([ad["id"] for ad, score, snippet 
+                              in self.db.search_ads("hospital")], ["2"])
+
+    def test_compress_descriptions(self):
+        """Test descriptions are compressed and read back transparently.
+        """
+        ads = [JobAd.create({"site": "site", "id": "id%d" % i, "title": "title",
+                             "description": "Looking for an experienced developer "
+                                            "with Python skills, ad %d." % i})
+               for i in range(20)]
+        self.db.store_ads(ads)
+        sizes = self.db.compress_descriptions("zlib")
+        self.assertEqual(sizes["rows"], 20)
+        self.assertLess(sizes["size_after"], sizes["size_before"])
+        self.db.store_ads([JobAd.create({"site": "site", "id": "new", 
+                                         "description": "new python ad"})])
+        types = self.db._conn.execute("""SELECT DISTINCT typeof(description) 
+                                         FROM JobEntries""").fetchall()
+        self.assertEqual(types, [("blob",)])
+        stored = self.db.get_ads(None, None)
+        self.assertCountEqual([ad["description"] for ad in stored],
+                              [ad["description"] for ad in ads] + ["new python ad"])
+        #updates keep descriptions compressed
+        self.db.update_ads(stored)
+        self.assertEqual(self.db.get_ads(None, None)[0]["description"], 
+                         stored[0]["description"])
+        if self.db._conn.execute("""SELECT * FROM sqlite_master 
+                                    WHERE name = 'JobEntriesFTS'""").fetchone():
+            results = self.db.search_ads("python", limit=30)
+            self.assertEqual(len(results), 21)
+            self.assertIn("[python]", results[0][2].lower())
+        self.db.compress_descriptions(None)
+        types = self.db._conn.execute("""SELECT DISTINCT typeof(description) 
+                                         FROM JobEntries""").fetchall()
+        self.assertEqual(types, [("text",)])
+        with self.assertRaises(ValueError):
+            self.db.compress_descriptions("lzma")
+
+    def test_plain_fulltext(self):
+        """Test job ads can be written without this library unless compressed.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "ads.db")
+            db = db_controls.JobAdDB(filename)
+            db.store_ads(self.job_ads)
+            def insert(id):
+                conn = sqlite3.connect(filename)
+                with conn:
+                    conn.execute("""INSERT INTO JobEntries (site, id, title, description)
+                                    VALUES ('site', ?, 'title', 'python')""", (id,))
+                conn.close()
+            insert("plain")
+            db.compress_descriptions("zlib")
+            self.assertRaises(sqlite3.OperationalError, lambda: insert("compressed"))
+            db.compress_descriptions(None)
+            insert("uncompressed")
+            if db._conn.execute("""SELECT * FROM sqlite_master 
+                                   WHERE name = 'JobEntriesFTS'""").fetchone():
+                self.assertCountEqual([ad["id"] for ad, score, snippet 
+                                       in db.search_ads("python")],
+                                      ["plain", "uncompressed"])
+            db.disconnect_db()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_compression_kept(self):
+        """Test compression of a database applies to later connections.
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "ads.db")
+            db = db_controls.JobAdDB(filename)
+            db.compress_descriptions("zlib")
+            db.disconnect_db()
+            db = db_controls.JobAdDB(filename)
+            db.store_ads(self.job_ads)
+            self.assertEqual(db._conn.execute("""SELECT DISTINCT typeof(description) 
+                                                 FROM JobEntries""").fetchall(),
+                             [("blob",)])
+            self.assertCountEqual([ad["description"] for ad in db.get_ads(None, None)],
+                                  [ad["description"] for ad in self.job_ads])
+            db.disconnect_db()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_write_files(self):
+        """Test ads are written to HTML and CSV files from an iterator.
+        """
+        self.db.store_ads(self.job_ads)
+        directory = tempfile.mkdtemp()
+        try:
+            for writer, filename in [(self.db.write_HTML_file, "ads.html"),
+                                     (self.db.write_CSV_file, "ads.csv")]:
+                writer(self.db.iter_ads(None, None, batch_size=1),
+                       os.path.join(directory, filename))
+                with open(os.path.join(directory, filename), encoding="utf-8") as file:
+                    contents = file.read()
+                self.assertIn("Great Job", contents)
+                self.assertIn("Bad Job", contents)
+                writer(self.db.iter_ads(None, None), os.path.join(directory, filename + ".gz"),
+                       compress=True)
+                with gzip.open(os.path.join(directory, filename + ".gz"), "rt", 
+                               encoding="utf-8") as file:
+                    self.assertEqual(file.read(), contents)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_write_HTML_report(self):
+        """Test ads are written to a lazily loading HTML page and data files.
+        """
+        self.db.store_ads(self.job_ads)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "ads.html")
+            self.assertEqual(self.db.write_HTML_report(self.db.iter_ads(None, None), 
+                                                       filename, chunk_size=1), 2)
+            with open(filename, encoding="utf-8") as file:
+                contents = file.read()
+            self.assertIn("rows: 2, chunkSize: 1", contents)
+            self.assertNotIn("Great Job", contents)
+            titles = []
+            for number in range(2):
+                with open(os.path.join(directory, "ads_data", "chunk_%05d.js" % number),
+                          encoding="utf-8") as file:
+                    data = file.read()
+                prefix = "jobAdChunk(%d, " % number
+                self.assertTrue(data.startswith(prefix))
+                titles += [row[2] for row in json.loads(data[len(prefix):-3])]
+            self.assertCountEqual(titles, ["Great Job", "Bad Job"])
+            #data files of an earlier report are removed
+            self.db.write_HTML_report(self.db.iter_ads(None, None), filename)
+            self.assertEqual(os.listdir(os.path.join(directory, "ads_data")), 
+                             ["chunk_00000.js"])
+            self.assertRaises(ValueError, lambda: self.db.write_HTML_report([], filename, 0))
+        finally:
+            shutil.rmtree(directory)
+
     def test_update_ads_recommendation(self):
         """Tests recommendation column is properly updated.
         """
         #store ads without recommendation
         self.db.store_ads(self.job_ads)
         #update recommendations
-        id_recomm = [{"id": ad["id"], "recommendation": 1} 
+        id_recomm = [{"site": ad["site"], "id": ad["id"], "recommendation": 1} 
                      for ad in self.job_ads_classified]
         self.db.update_ads_recommendation(id_recomm)
-        ret_id_recomm = [{"id": ad["id"], 
+        ret_id_recomm = [{"site": ad["site"], "id": ad["id"], 
                           "recommendation": ad["recommendation"]} 
                          for ad in self.db.get_ads(
                              datetime.date.today()-datetime.timedelta(1),
@@ -201,10 +821,10 @@ class JobAdDBTestCase(unittest.TestCase):
         #store ads without recommendation
         self.db.store_ads(self.job_ads)
         #update recommendations
-        id_lang = [{"id": ad["id"], "language": "Russian"} 
+        id_lang = [{"site": ad["site"], "id": ad["id"], "language": "Russian"} 
                      for ad in self.job_ads_classified]
         self.db.update_ads_language(id_lang)
-        ret_id_lang = [{"id": ad["id"], "language": ad["language"]} 
+        ret_id_lang = [{"site": ad["site"], "id": ad["id"], "language": ad["language"]} 
                          for ad in self.db.get_ads(
                              datetime.date.today()-datetime.timedelta(1),
                              datetime.date.today())]
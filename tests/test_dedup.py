@@ -0,0 +1,61 @@
+﻿import unittest
+
+from jobadcollector.dedup import (ClusterIndex, fingerprints, normalize_text,
+                                  pack_signature, unpack_signature, similarity)
+from jobadcollector.job_ad import JobAd
+
+
+class DedupTestCase(unittest.TestCase):
+    """Various tests for near-duplicate detection of job ads.
+    """
+
+    texts = [("Data Analyst", "Company 1 is looking for a data analyst with "
+                              "experience of Python, SQL and R. Great team."),
+             ("Data analyst!", "Company 1 is looking for a data analyst with "
+                               "experience of Python, SQL & R.  Great team, flexible hours."),
+             ("Nurse", "Hospital 2 is looking for a nurse for night shifts in Espoo."),
+             ("Data Analyst", "Company 1 is looking for a data analyst with "
+                              "experience of Python, SQL and R. Great team."),
+             ("Chef", None)]
+
+    def test_normalize_text(self):
+        """Test case, punctuation and whitespace are normalized.
+        """
+        self.assertEqual(normalize_text(" Data\tANALYST, (Python)&R_ "), 
+                         "data analyst python r")
+        self.assertEqual(normalize_text(None), "")
+
+    def test_fingerprints(self):
+        """Test signatures estimate similarity of job ad texts.
+        """
+        results = fingerprints(self.texts)
+        self.assertIsNone(results[4])
+        self.assertEqual(results[0], results[3])
+        self.assertGreater(similarity(results[0][1], results[1][1]), 0.7)
+        self.assertLess(similarity(results[0][1], results[2][1]), 0.2)
+        self.assertEqual(unpack_signature(pack_signature(results[0][1])), results[0][1])
+
+    def test_assign(self):
+        """Test near-duplicates are assigned to the same cluster.
+        """
+        job_ads = [JobAd.create({"id": str(i), "title": title, "description": description})
+                   for i, (title, description) in enumerate(self.texts)]
+        index = ClusterIndex(threshold=0.7)
+        new_clusters = index.assign(job_ads, fingerprints(self.texts))
+        self.assertEqual(len(new_clusters), 2)
+        self.assertEqual(len(set([job_ad["cluster"] for job_ad in job_ads[:4]])), 2)
+        self.assertEqual(job_ads[0]["cluster"], job_ads[1]["cluster"])
+        self.assertEqual(job_ads[0]["cluster"], job_ads[3]["cluster"])
+        self.assertNotEqual(job_ads[0]["cluster"], job_ads[2]["cluster"])
+        self.assertIsNone(job_ads[4]["cluster"])
+        #clusters of earlier runs are loaded from packed signatures
+        index = ClusterIndex(new_clusters, threshold=0.7)
+        job_ad = JobAd.create({"id": "5"})
+        self.assertEqual(index.assign([job_ad], fingerprints(self.texts[1:2])), [])
+        self.assertEqual(job_ad["cluster"], job_ads[0]["cluster"])
+        with self.assertRaises(ValueError):
+            ClusterIndex(bands=7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,404 @@
+﻿import unittest
+import asyncio
+import time
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from jobadcollector import parsers
+from jobadcollector.fetching import JobAdFetcher, ConnectionPool, TokenBucket
+from jobadcollector.cache import ResponseCache
+from jobadcollector.archive import PageArchive, load_page
+
+
+class LocalIndeedParser(parsers.IndeedParser):
+    """Indeed parser fetching its search pages from a local server.
+    """
+
+    request_rate = 100.0
+    # set to address of local server
+    base_url = None
+    path = "/jobs"
+
+    def _generate_URL(self, search_term, page=0):
+        return self.base_url + self.path + "?q=%s&page=%d" % (search_term, page)
+
+
+class LocalPagedParser(LocalIndeedParser):
+    """Local Indeed parser fetching several result pages.
+    """
+
+    path = "/pages"
+
+
+class UpperPagedParser(LocalPagedParser):
+    """Local paged parser overriding parsing, upper casing titles.
+    """
+
+    def _save_job_ad(self):
+        self._title = self._title.upper()
+        super(UpperPagedParser, self)._save_job_ad()
+
+
+class JobAdFetcherTestCase(unittest.TestCase):
+    """Class for testing fetching of pages from a local server.
+    """
+
+    ad = """
+        <h2 class="jobtitle" id="jl_1"><a href="/rc/clk?jk=1">Data   analyst</a></h2>
+        <span>Great&nbsp;&nbsp;company</span>
+        <div class="result-link-bar-container"></div>
+        """
+    page = "<html><body>" + ad + "</body></html>"
+
+    def setUp(self):
+        self.active = 0
+        self.max_active = 0
+        self.requests = 0
+        self.pages = []
+
+    async def _handler(self, request):
+        self.active += 1
+        self.max_active = max(self.active, self.max_active)
+        await asyncio.sleep(0.2)
+        self.active -= 1
+        return web.Response(text=self.page, content_type="text/html")
+
+    async def _stream_handler(self, request):
+        response = web.StreamResponse(headers={"Content-Type": "text/html; charset=utf-8"})
+        await response.prepare(request)
+        ad = self.ad
+        await response.write(b"<html><body>" + ad.encode("utf-8"))
+        # wait until first ad has been yielded
+        await asyncio.sleep(0.3)
+        await response.write(ad.replace("jl_1", "jl_2").encode("utf-8") +
+                             b"</body></html>")
+        await response.write_eof()
+        return response
+
+    async def _pages_handler(self, request):
+        page = int(request.query["page"])
+        self.pages.append(page)
+        ads = ""
+        if page < 3:
+            ads = "".join([self.ad.replace("jl_1", "jl_%d_%d" % (page, i))
+                           for i in range(2)])
+        return web.Response(text="<html><body>%s</body></html>" % ads,
+                            content_type="text/html")
+
+    async def _etag_handler(self, request):
+        self.requests += 1
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(text=self.page, content_type="text/html",
+                            headers={"ETag": '"v1"'})
+
+    def _run_with_server(self, coroutine_function):
+        async def run():
+            app = web.Application()
+            app.router.add_get("/jobs", self._handler)
+            app.router.add_get("/etag", self._etag_handler)
+            app.router.add_get("/stream", self._stream_handler)
+            app.router.add_get("/pages", self._pages_handler)
+            server = TestServer(app)
+            await server.start_server()
+            LocalIndeedParser.base_url = str(server.make_url("")).rstrip("/")
+            try:
+                return await coroutine_function(LocalIndeedParser.base_url)
+            finally:
+                await server.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_fetch_host_limit(self):
+        """Test concurrent requests to a host are limited and overlap.
+        """
+        async def fetch_all(base_url):
+            async with JobAdFetcher(host_limit=2) as fetcher:
+                start = time.monotonic()
+                pages = await asyncio.gather(*[fetcher.fetch(base_url + "/jobs", 100, 4)
+                                               for i in range(4)])
+                return pages, time.monotonic() - start
+
+        pages, elapsed = self._run_with_server(fetch_all)
+        self.assertEqual(pages, [self.page] * 4)
+        self.assertEqual(self.max_active, 2)
+        self.assertLess(elapsed, 0.75)
+
+    def test_rate_limit(self):
+        """Test requests to a host are rate limited while other hosts are not.
+        """
+        async def fetch_all(base_url):
+            local_url = base_url.replace("127.0.0.1", "localhost")
+            async with JobAdFetcher(host_limit=4) as fetcher:
+                start = time.monotonic()
+                limited = asyncio.gather(*[fetcher.fetch(base_url + "/jobs", 10, 2)
+                                           for i in range(4)])
+                free = asyncio.gather(*[fetcher.fetch(local_url + "/jobs", 100, 4)
+                                        for i in range(4)])
+                await free
+                free_elapsed = time.monotonic() - start
+                await limited
+                return free_elapsed, time.monotonic() - start
+
+        free_elapsed, elapsed = self._run_with_server(fetch_all)
+        # two requests in burst, the remaining two 0.1 s apart
+        self.assertGreaterEqual(elapsed, 0.4)
+        self.assertLess(free_elapsed, 0.4)
+
+    def test_token_bucket(self):
+        """Test token bucket allows bursts and then limits rate.
+        """
+        async def acquire_all():
+            bucket = TokenBucket(rate=20, burst=3)
+            start = time.monotonic()
+            for i in range(3):
+                await bucket.acquire()
+            burst_elapsed = time.monotonic() - start
+            for i in range(4):
+                await bucket.acquire()
+            return burst_elapsed, time.monotonic() - start
+
+        loop = asyncio.new_event_loop()
+        try:
+            burst_elapsed, elapsed = loop.run_until_complete(acquire_all())
+        finally:
+            loop.close()
+        self.assertLess(burst_elapsed, 0.05)
+        self.assertGreaterEqual(elapsed, 0.19)
+
+    def test_cache(self):
+        """Test cached pages are revalidated and unchanged pages not returned.
+        """
+        resp_cache = ResponseCache(":memory:", fresh=60)
+
+        async def fetch_all(base_url):
+            async with JobAdFetcher(cache=resp_cache) as fetcher:
+                first = await fetcher.fetch(base_url + "/etag", 100, 4)
+                # not cached before the page has been handled
+                uncached = resp_cache.get(base_url + "/etag") is None
+                fetcher.commit_cache()
+                # fresh in cache, no request sent
+                fresh = await fetcher.fetch(base_url + "/etag", 100, 4)
+                requests_fresh = self.requests
+                resp_cache._conn.execute("UPDATE Responses SET stored = ?",
+                                         (time.time() - 120,))
+                # stale in cache, conditional request returns 304
+                stale = await fetcher.fetch(base_url + "/etag", 100, 4)
+                return first, uncached, fresh, requests_fresh, stale
+
+        first, uncached, fresh, requests_fresh, stale = self._run_with_server(fetch_all)
+        resp_cache.close()
+        self.assertEqual(first, self.page)
+        self.assertTrue(uncached)
+        self.assertIsNone(fresh)
+        self.assertEqual(requests_fresh, 1)
+        self.assertIsNone(stale)
+        self.assertEqual(self.requests, 2)
+
+    def test_archive(self):
+        """Test fetched pages are archived with site and search term.
+        """
+        directory = tempfile.mkdtemp()
+        page_archive = PageArchive(directory)
+
+        async def parse_all(base_url):
+            async with JobAdFetcher(archive=page_archive) as fetcher:
+                await LocalIndeedParser(fetcher).parse("analyst")
+                await fetcher.fetch(base_url + "/jobs", 100, 4)
+
+        try:
+            self._run_with_server(parse_all)
+            entries = page_archive.get_pages()
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]["site"], "indeed")
+            self.assertEqual(entries[0]["searchterm"], "analyst")
+            self.assertEqual(load_page(directory, entries[0]), self.page.encode("utf-8"))
+        finally:
+            page_archive.close()
+            shutil.rmtree(directory)
+
+    def test_replace_hosts(self):
+        """Test requests to replaced hosts are sent to the replacement.
+        """
+        async def parse_all(base_url):
+            hosts = {"www.indeed.fi": base_url + "/"}
+            async with JobAdFetcher(hosts=hosts) as fetcher:
+                page = await fetcher.fetch("http://www.indeed.fi/jobs?q=analyst", 100, 4)
+                parser = parsers.IndeedParser(fetcher)
+                await parser.parse("analyst")
+                return page, parser.get_job_ads()
+
+        page, job_ads = self._run_with_server(parse_all)
+        self.assertEqual(page, self.page)
+        self.assertEqual([job_ad["id"] for job_ad in job_ads], ["jl_1"])
+
+    def test_pool_reuse(self):
+        """Test pooled connections are reused between requests and fetchers.
+        """
+        async def fetch_all(base_url):
+            async with ConnectionPool(host_size=1) as pool:
+                for i in range(2):
+                    async with JobAdFetcher(pool=pool) as fetcher:
+                        for j in range(2):
+                            await fetcher.fetch(base_url + "/jobs", 100, 4)
+                return pool.new_connections, pool.reused_connections
+
+        new_connections, reused_connections = self._run_with_server(fetch_all)
+        self.assertEqual(new_connections, 1)
+        self.assertEqual(reused_connections, 3)
+
+    def test_stream_parse(self):
+        """Test job ads are yielded while page is being downloaded in chunks.
+        """
+        async def parse_all(base_url):
+            async with JobAdFetcher(chunk_size=7) as fetcher:
+                parser = LocalIndeedParser(fetcher)
+                parser.path = "/stream"
+                start = time.monotonic()
+                times = []
+                async for job_ad in parser.iter_parse("analyst"):
+                    times.append(time.monotonic() - start)
+                return parser.get_job_ads(), times
+
+        job_ads, times = self._run_with_server(parse_all)
+        self.assertEqual([job_ad["id"] for job_ad in job_ads], ["jl_1", "jl_2"])
+        for job_ad in job_ads:
+            self.assertEqual(job_ad["title"], "Data analyst")
+            self.assertEqual(job_ad["description"], "Great company")
+        self.assertLess(times[0], 0.25)
+        self.assertGreaterEqual(times[1], 0.3)
+
+    def test_stream_archive(self):
+        """Test streamed pages are archived from their chunks.
+        """
+        directory = tempfile.mkdtemp()
+        page_archive = PageArchive(directory)
+
+        async def parse_all(base_url):
+            async with JobAdFetcher(chunk_size=7, archive=page_archive) as fetcher:
+                parser = LocalIndeedParser(fetcher)
+                parser.path = "/stream"
+                async for job_ad in parser.iter_parse("analyst"):
+                    pass
+                return parser.get_job_ads()
+
+        try:
+            job_ads = self._run_with_server(parse_all)
+            self.assertEqual(len(job_ads), 2)
+            entries = page_archive.get_pages()
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]["searchterm"], "analyst")
+            page = ("<html><body>" + self.ad + self.ad.replace("jl_1", "jl_2") +
+                    "</body></html>").encode("utf-8")
+            self.assertEqual(load_page(directory, entries[0]), page)
+        finally:
+            page_archive.close()
+            shutil.rmtree(directory)
+
+    def test_parse_pages(self):
+        """Test result pages are parsed until a page without new job ads.
+        """
+        async def parse_all(base_url, known_ads, known_ratio=1.0, stored_ads=None):
+            async with JobAdFetcher() as fetcher:
+                parser = LocalPagedParser(fetcher, max_pages=10, page_batch=2,
+                                          known_ads=known_ads,
+                                          known_ratio=known_ratio,
+                                          stored_ads=stored_ads)
+                await parser.parse("analyst")
+                return [job_ad["id"] for job_ad in parser.get_job_ads()]
+
+        # pages 0-2 have ads, page 3 is empty
+        ids = self._run_with_server(lambda base_url: parse_all(base_url, None))
+        self.assertEqual(len(ids), 6)
+        self.assertCountEqual(self.pages, [0, 1, 2, 3, 4])
+        # ads on page 1 already stored and skipped
+        self.pages = []
+        known_ads = set([("indeed", "jl_1_0"), ("indeed", "jl_1_1")])
+        ids = self._run_with_server(lambda base_url: parse_all(base_url, known_ads))
+        self.assertCountEqual(ids, ["jl_0_0", "jl_0_1", "jl_2_0", "jl_2_1"])
+        self.assertCountEqual(self.pages, [0, 1, 2])
+        # half of ads on page 1 stored, page mostly known
+        self.pages = []
+        known_ads = set([("indeed", "jl_1_0")])
+        ids = self._run_with_server(lambda base_url: parse_all(base_url, known_ads, 0.5))
+        self.assertEqual(len(ids), 5)
+        self.assertCountEqual(self.pages, [0, 1, 2])
+        # ads on page 1 already stored but parsed again
+        self.pages = []
+        stored_ads = set([("indeed", "jl_1_0"), ("indeed", "jl_1_1")])
+        ids = self._run_with_server(lambda base_url: parse_all(base_url, None,
+                                                               stored_ads=stored_ads))
+        self.assertCountEqual(ids, ["jl_0_0", "jl_0_1", "jl_1_0", "jl_1_1",
+                                    "jl_2_0", "jl_2_1"])
+        self.assertCountEqual(self.pages, [0, 1, 2])
+        # max_pages limits pages
+        async def parse_max(base_url):
+            async with JobAdFetcher() as fetcher:
+                parser = LocalPagedParser(fetcher, max_pages=2)
+                await parser.parse("analyst")
+                return parser.get_job_ads()
+
+        self.pages = []
+        self.assertEqual(len(self._run_with_server(parse_max)), 4)
+        self.assertCountEqual(self.pages, [0, 1])
+
+    def test_parse_executor(self):
+        """Test result pages are parsed in worker processes with the parser class.
+        """
+        class UnimportableParser(LocalPagedParser):
+            pass
+
+        known_ads = set([("indeed", "jl_1_0"), ("indeed", "jl_1_1")])
+        executor = ProcessPoolExecutor(1)
+
+        async def parse_all(base_url, parser_class=UpperPagedParser):
+            async with JobAdFetcher() as fetcher:
+                parser = parser_class(fetcher, max_pages=10, 
+                                      known_ads=known_ads, executor=executor)
+                await parser.parse("analyst")
+                return parser.get_job_ads()
+
+        try:
+            job_ads = self._run_with_server(parse_all)
+            #classes which cannot be imported in the worker are not parsed
+            with self.assertRaises(ValueError):
+                self._run_with_server(lambda base_url: 
+                                      parse_all(base_url, UnimportableParser))
+        finally:
+            executor.shutdown()
+        self.assertCountEqual([job_ad["id"] for job_ad in job_ads],
+                              ["jl_0_0", "jl_0_1", "jl_2_0", "jl_2_1"])
+        self.assertCountEqual(self.pages, [0, 1, 2, 0])
+        for job_ad in job_ads:
+            self.assertEqual(job_ad["title"], "DATA ANALYST")
+            self.assertEqual(job_ad["site"], "indeed")
+            self.assertEqual(job_ad["searchterm"], "analyst")
+
+    def test_parse_shared_fetcher(self):
+        """Test parsers sharing a fetcher parse job ads from fetched pages.
+        """
+        async def parse_all(base_url):
+            async with JobAdFetcher() as fetcher:
+                ps = [LocalIndeedParser(fetcher) for i in range(2)]
+                await asyncio.gather(*[parser.parse("analyst") for parser in ps])
+                return [parser.get_job_ads() for parser in ps]
+
+        for job_ads in self._run_with_server(parse_all):
+            self.assertEqual(len(job_ads), 1)
+            self.assertEqual(job_ads[0]["id"], "jl_1")
+            self.assertEqual(job_ads[0]["title"], "Data analyst")
+            self.assertEqual(job_ads[0]["description"], "Great company")
+            self.assertEqual(job_ads[0]["site"], "indeed")
+            self.assertEqual(job_ads[0]["searchterm"], "analyst")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 ﻿import unittest
 import datetime
+import pickle
 import jobadcollector.job_ad as job_ad
 
 class JobAdTestCase(unittest.TestCase):
@@ -96,8 +97,91 @@ class JobAdTestCase(unittest.TestCase):
         for i in range(0, len(job_ads_complete)):
             for key in job_ads_complete[i]:
                 self.assertEqual(jobadslist[i][key], job_ads_complete[i][key])
-        
 
+        self.assertEqual(job_ad.JobAd.create({"id": "x"})["date"], datetime.date.today())
+        self.assertIsNone(job_ad.JobAd.create({"id": "x", "date": None})["date"])
+
+    def test_from_values(self):
+        """Test JobAd instances are properly created from column values.
+        """
+        values = ["site", "term", "id", "title", "url", "description", 
+                  datetime.date(2017, 1, 1), "English", 1, None, None]
+        ad = job_ad.JobAd.from_values(values)
+        self.assertEqual(dict(ad), dict(zip(job_ad.JobAd._cols, values)))
+        self.assertEqual(ad.as_tuple(), tuple(values))
+        values[0] = "other"
+        self.assertEqual(ad["site"], "site")
+        self.assertRaises(ValueError, lambda: job_ad.JobAd.from_values(values[:-1]))
+
+    def test_mapping(self):
+        """Test JobAd instances behave like dictionaries of their columns.
+        """
+        self.ad["title"] = "title"
+        self.assertEqual(list(self.ad), job_ad.JobAd._cols)
+        self.assertEqual(len(self.ad), len(job_ad.JobAd._cols))
+        self.assertIn("title", self.ad)
+        self.assertNotIn("what", self.ad)
+        self.assertEqual(self.ad.get("title"), "title")
+        self.assertEqual(self.ad.get("what", 1), 1)
+        self.assertEqual(self.ad, self.ad.as_dict())
+        self.assertEqual(self.ad, job_ad.JobAd.create(self.ad))
+        self.assertEqual(self.ad, pickle.loads(pickle.dumps(self.ad)))
+        self.ad.update({"url": "url"})
+        self.assertEqual(self.ad["url"], "url")
+        self.assertRaises(AttributeError, lambda: setattr(self.ad, "what", 1))
+
+
+class JobAdBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.job_ads = [job_ad.JobAd.create({"site": "site", "id": "id%d" % i, 
+                                             "title": "title %d" % i, 
+                                             "date": datetime.date(2017, 1, i + 1)})
+                        for i in range(3)]
+
+    def test_from_job_ads(self):
+        """Test batches are created from job ads and converted back.
+        """
+        batch = job_ad.JobAdBatch.from_job_ads(self.job_ads)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.columns, job_ad.JobAd._cols)
+        self.assertEqual(batch["id"], ["id0", "id1", "id2"])
+        self.assertEqual(batch.to_job_ads(), self.job_ads)
+        batch = job_ad.JobAdBatch.from_job_ads(self.job_ads, ["title", "id"])
+        self.assertEqual(batch.columns, ["id", "title"])
+        self.assertEqual(list(batch.rows())[0], ("id0", "title 0"))
+        self.assertEqual([ad["title"] for ad in batch], ["title 0", "title 1", "title 2"])
+        self.assertEqual(len(job_ad.JobAdBatch.from_job_ads([])), 0)
+
+    def test_columns(self):
+        """Test columns of batches are checked.
+        """
+        self.assertRaises(KeyError, lambda: job_ad.JobAdBatch({"what": [1]}))
+        self.assertRaises(ValueError, lambda: job_ad.JobAdBatch({"id": [1], "title": []}))
+        batch = job_ad.JobAdBatch({"title": ["a", "b"]})
+        batch["id"] = ["x", "y"]
+        self.assertEqual(batch.columns, ["id", "title"])
+        self.assertIn("id", batch)
+        self.assertRaises(ValueError, lambda: batch.__setitem__("url", ["z"]))
+        self.assertRaises(KeyError, lambda: batch.__setitem__("what", ["z", "z"]))
+
+    @unittest.skipIf(job_ad.numpy is None, "numpy not installed")
+    def test_to_numpy(self):
+        """Test batches are converted to NumPy arrays.
+        """
+        arrays = job_ad.JobAdBatch.from_job_ads(self.job_ads).to_numpy()
+        self.assertEqual(str(arrays["date"][0]), "2017-01-01")
+        self.assertTrue(all(arrays["relevant"] != arrays["relevant"]))
+
+    @unittest.skipIf(job_ad.pyarrow is None, "pyarrow not installed")
+    def test_arrow(self):
+        """Test batches are converted to Arrow record batches and back.
+        """
+        batch = job_ad.JobAdBatch.from_job_ads(self.job_ads)
+        record_batch = batch.to_arrow()
+        self.assertEqual(record_batch.num_rows, 3)
+        self.assertEqual(job_ad.JobAdBatch.from_arrow(record_batch).to_job_ads(), 
+                         self.job_ads)
 
 
 if __name__ == '__main__':
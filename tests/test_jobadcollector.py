@@ -1,6 +1,8 @@
 ﻿import unittest
 import os
+import shutil
 import sqlite3
+import tempfile
 import datetime
 
 import jobadcollector
@@ -45,6 +47,48 @@ class JobAdCollectorTestCase(unittest.TestCase):
         self._test_save_model()
         self._test_load_model()
 
+    def test_unstored_ads(self):
+        """Test only job ads which would be inserted are clustered.
+        """
+        datab = jobadcollector.db_controls.JobAdDB(":memory:")
+        datab.store_ads([jobadcollector.JobAd.create({"site": "indeed", "id": "1"})])
+        job_ads = [jobadcollector.JobAd.create({"site": site, "id": ad_id})
+                   for site, ad_id in [("indeed", "1"), ("monster", "1"), 
+                                       ("indeed", "2"), ("indeed", "2")]]
+        unstored = self.coll._unstored_ads(datab, job_ads)
+        self.assertEqual(unstored, [job_ads[1], job_ads[2]])
+        self.assertIs(unstored[1], job_ads[2])
+        datab.disconnect_db()
+
+    def test_replay_archive(self):
+        """Test replayed job ads are clustered like searched ones.
+        """
+        page = """<html><body>
+            <h2 class="jobtitle" id="jl_%d"><a href="/rc/clk?jk=1">Data analyst</a></h2>
+            <span>Great company looking for a data analyst</span>
+            <div class="result-link-bar-container"></div>
+            </body></html>"""
+        directory = tempfile.mkdtemp()
+        try:
+            archive_name = os.path.join(directory, "archive")
+            page_archive = jobadcollector.archive.PageArchive(archive_name)
+            for i in range(3):
+                page_archive.store("indeed", "analyst", "http://a.fi/%d" % i, 
+                                   (page % (i % 2)).encode("utf-8"), "utf-8")
+            page_archive.close()
+            db_name = os.path.join(directory, "replay.db")
+            coll = jobadcollector.JobAdCollector([], db_name, parse_workers=1)
+            coll.replay_archive(archive_name)
+            datab = jobadcollector.db_controls.JobAdDB(db_name)
+            job_ads = datab.get_ads(None, None)
+            self.assertCountEqual([ad["id"] for ad in job_ads], ["jl_0", "jl_1"])
+            self.assertIsNotNone(job_ads[0]["cluster"])
+            self.assertEqual(job_ads[0]["cluster"], job_ads[1]["cluster"])
+            self.assertEqual(len(datab.get_clusters()), 1)
+            datab.disconnect_db()
+        finally:
+            shutil.rmtree(directory)
+
     def _test_start_search(self):
         """Test search results are stored in database.
         """
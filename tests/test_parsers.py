@@ -49,6 +49,17 @@ class ParsersTestCase(unittest.TestCase):
             url = self.op._generate_URL(search_term[0])
             self.assertEqual(url, "https://tyopaikat.oikotie.fi/?sijainti[101]=101&jq="+ search_term[1] + "&sort_by=score")
 
+    def test_page_URLGenerator(self):
+        """Test URLs of later result pages differ from first page and each other.
+        """
+        for parser in [self.dtp, self.mp, self.ip, self.op]:
+            urls = [parser._generate_URL(self.search_terms[0][0], page) 
+                    for page in range(3)]
+            self.assertEqual(urls[0], parser._generate_URL(self.search_terms[0][0]))
+            self.assertEqual(len(set(urls)), 3)
+            for url in urls[1:]:
+                self.assertTrue(url.startswith(urls[0]))
+
     def test_Duunitoriparser(self):
         """Test Duunitori parser produces the correct fields.
         """